@@ -0,0 +1,113 @@
+import asyncio
+import os
+import random
+import time
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI
+
+from code_cache import schema_fingerprint
+from main3 import BASE_URL, ExcelAIProcessor
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """令牌桶限速器：每秒最多rate个请求，允许burst个突发"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncExcelAIProcessor(ExcelAIProcessor):
+    """基于异步连接池客户端的处理器，可并发生成多条指令/多个文件的代码"""
+
+    def __init__(self, max_concurrency=8, requests_per_second=5.0, max_retries=4, code_cache=None):
+        super().__init__(code_cache=code_cache)
+        self.max_retries = max_retries
+        self.async_client = AsyncOpenAI(
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            base_url=BASE_URL,
+            max_retries=0,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_concurrency,
+                                    max_keepalive_connections=max_concurrency),
+                timeout=httpx.Timeout(120.0, connect=10.0)
+            )
+        )
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._rate_limiter = RateLimiter(requests_per_second) if requests_per_second else None
+
+    async def agenerate_pandas_code(self, instruction, df=None):
+        df = self.df if df is None else df
+        local = self.intent_matcher.match(instruction, df, self.column_map)
+        if local and (code := self._clean_code(local)):
+            return code
+
+        fingerprint = schema_fingerprint(df)
+        model = self._model_for(instruction)
+        cached = self.code_cache.get(instruction, fingerprint, namespace=model)
+        if cached:
+            return self.optimize_code(cached, df)
+
+        try:
+            content = await self._complete(self._build_prompt(instruction, df), model)
+            code = self._extract_code(content)
+            self.code_cache.put(instruction, fingerprint, code, namespace=model)
+            return self.optimize_code(code, df)
+        except Exception as e:
+            print(f"API请求失败: {str(e)}")
+            return None
+
+    async def _complete(self, prompt, model):
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                if self._rate_limiter:
+                    await self._rate_limiter.acquire()
+                try:
+                    completion = await self.async_client.chat.completions.create(
+                        model=model,
+                        messages=[{"role": "user", "content": prompt}],
+                        temperature=0.2
+                    )
+                    return completion.choices[0].message.content
+                except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                    status = getattr(e, 'status_code', None)
+                    if attempt >= self.max_retries or (status is not None and status not in RETRY_STATUS):
+                        raise
+                    await asyncio.sleep(self._backoff(attempt, e))
+
+    @staticmethod
+    def _backoff(attempt, error):
+        response = getattr(error, 'response', None)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        try:
+            return float(retry_after)
+        except (TypeError, ValueError):
+            return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+    async def agenerate_many(self, instructions, df=None):
+        """针对同一DataFrame并发生成多条指令的代码，结果与输入顺序一致"""
+        return await asyncio.gather(*(self.agenerate_pandas_code(i, df) for i in instructions))
+
+    async def agenerate_for_frames(self, instruction, frames):
+        """针对多个DataFrame（如多个文件）并发生成同一指令的代码"""
+        return await asyncio.gather(*(self.agenerate_pandas_code(instruction, df) for df in frames))
+
+    async def aclose(self):
+        await self.async_client.close()
@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from code_cache import schema_fingerprint
+from main3 import ExcelAIProcessor
+from pipeline import LazyPlan
+from recipe import RecipeError, load_recipe, prepare_steps
+
+SAMPLE_ROWS = 50
+
+
+def load_instructions(path):
+    """读取指令脚本：每行一条，忽略空行和#开头的注释"""
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def read_sample(file_path):
+    """只读取前几行用于计算结构指纹和生成代码"""
+    df = pd.read_excel(file_path, nrows=SAMPLE_ROWS)
+    df.columns = ExcelAIProcessor._standardize_columns(df.columns)
+    return df
+
+
+def compile_instructions(processor, sample_df, instructions):
+    """在样例数据上逐条生成并试运行代码，返回代码列表（失败返回None）"""
+    processor.df = sample_df
+    # 与延迟模式的样例预览相同：过滤条件在前几行中没有匹配时结果为空表，不算失败
+    processor.plan = LazyPlan()
+    codes = []
+    for instruction in instructions:
+        code = processor.generate_pandas_code(instruction)
+        if not code or not processor.safe_execute(code, instruction):
+            if code:
+                processor.discard_cached_code(instruction)  # 否则之后每次批处理都会命中同一段错误代码
+            print(f"指令无法生成有效代码: {instruction}")
+            return None
+        codes.append(code)
+    return codes
+
+
+def process_file(file_path, codes, output_path, chunksize=None, recipe=None):
+    """子进程中执行 read_excel → safe_execute → save_excel；给定recipe时按配方回放（含结构兼容性检查）"""
+    start = time.perf_counter()
+    log = io.StringIO()
+    result = {'file': file_path, 'output': output_path, 'status': 'failed', 'rows': None, 'columns': None}
+    with contextlib.redirect_stdout(log):
+        processor = ExcelAIProcessor()
+        ok = processor.read_excel(file_path, chunksize=chunksize)
+        if recipe is not None:
+            ok = ok and processor.replay_recipe(recipe, codes)
+            codes = []
+        for i, code in enumerate(codes):
+            if not ok:
+                break
+            ok = processor.safe_execute(code)
+            if not ok:
+                result['failed_step'] = i + 1
+        if ok:
+            ok = processor.save_excel(output_path)
+    if ok:
+        result.update(status='ok', rows=len(processor.df), columns=len(processor.df.columns))
+    lines = [line for line in log.getvalue().splitlines() if line.strip()]
+    result['message'] = lines[-1] if lines else ''
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def output_paths(files, output_dir):
+    """按各文件相对于共同上级目录的路径放到output_dir下，避免不同目录中的同名文件互相覆盖"""
+    files = [os.path.abspath(f) for f in files]
+    base = os.path.commonpath([os.path.dirname(f) for f in files])
+    return {f: os.path.join(output_dir, os.path.relpath(f, base)) for f in files}
+
+
+def write_report(results, report_path):
+    if report_path.endswith('.json'):
+        with open(report_path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        return
+    fields = ['file', 'schema', 'status', 'failed_step', 'rows', 'columns', 'seconds', 'output', 'message']
+    with open(report_path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(results)
+
+
+def run_batch(instructions, pattern, output_dir, report_path, workers=None, chunksize=None, recipe=None):
+    files = sorted(glob.glob(pattern, recursive=True))
+    if not files:
+        print(f"没有匹配的文件: {pattern}")
+        return []
+    outputs = output_paths(files, output_dir)
+
+    # 按结构指纹分组，每种结构只调用一次模型
+    groups = {}
+    results = []
+    for file_path in files:
+        try:
+            groups.setdefault(schema_fingerprint(read_sample(file_path)), []).append(file_path)
+        except Exception as e:
+            results.append({'file': file_path, 'status': 'failed', 'message': f"读取文件失败: {str(e)}"})
+    print(f"共{len(files)}个文件，{len(groups)}种表结构")
+
+    if recipe is not None:
+        # 按配方回放：不请求模型，所有文件使用同一组已校验的代码，各文件读取后再检查结构是否兼容
+        plans = dict.fromkeys(groups, prepare_steps(recipe))
+    else:
+        processor = ExcelAIProcessor()
+        plans = {}
+        for fingerprint, paths in groups.items():
+            plans[fingerprint] = compile_instructions(processor, read_sample(paths[0]), instructions)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for fingerprint, paths in groups.items():
+            codes = plans[fingerprint]
+            for file_path in paths:
+                if codes is None:
+                    results.append({'file': file_path, 'schema': fingerprint[:12], 'status': 'failed',
+                                    'message': "代码生成失败"})
+                    continue
+                output_path = outputs[os.path.abspath(file_path)]
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                future = pool.submit(process_file, file_path, codes, output_path, chunksize, recipe)
+                futures[future] = (file_path, fingerprint)
+        for future in as_completed(futures):
+            file_path, fingerprint = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {'file': file_path, 'status': 'failed', 'message': f"执行异常: {str(e)}"}
+            result['schema'] = fingerprint[:12]
+            print(f"[{result['status']}] {file_path}")
+            results.append(result)
+
+    write_report(results, report_path)
+    succeeded = sum(r['status'] == 'ok' for r in results)
+    print(f"完成：成功{succeeded}个，失败{len(results) - succeeded}个，报告已保存到 {report_path}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="批量对多个Excel文件执行同一组指令")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--instructions', help="指令脚本文件，每行一条指令")
+    source.add_argument('--recipe', help="main3.py中导出的配方文件，离线回放，不请求模型")
+    parser.add_argument('--files', required=True, help="Excel文件通配符，如 'data/*.xlsx'")
+    parser.add_argument('--output-dir', default='batch_output', help="输出目录")
+    parser.add_argument('--report', default='batch_report.csv', help="报告路径（.csv或.json）")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认CPU核数")
+    parser.add_argument('--chunksize', type=int, default=None, help="流式模式：按块读取和写出超大工作表")
+    args = parser.parse_args()
+
+    recipe = None
+    if args.recipe:
+        try:
+            recipe = load_recipe(args.recipe)
+            prepare_steps(recipe)
+        except RecipeError as e:
+            print(str(e))
+            raise SystemExit(1)
+    run_batch(load_instructions(args.instructions) if args.instructions else None, args.files, args.output_dir,
+              args.report, args.workers, args.chunksize, recipe)
@@ -0,0 +1,281 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from stub_server import start_stub_server
+
+BENCH_DIR = os.getenv("EXCEL_AI_BENCH_DIR", "bench_data")
+DTYPES = ('int', 'float', 'str', 'date', 'bool', 'category')
+SCENARIOS = ('read_excel', 'generate_pandas_code', '_clean_code', 'safe_execute', 'save_excel')
+
+# 桩服务返回的代码与对应指令（指令不会被本地规则匹配，确保真正请求模型）
+STUB_INSTRUCTION = "把c0列乘以2再加上1，作为新的一列result"
+STUB_CODE = "df['result'] = df['c0'] * 2 + 1"
+CLEAN_SNIPPETS = (
+    "df = df.drop(columns=['c1'])",
+    "import pandas as pd\ndf['c0'] = df['c0'].fillna(0)",
+    "df['flag'] = df['c0'].apply(lambda x: 'high' if x > 50 else 'low')",
+    "df = df[(df['c0'] > 10) & (df['c1'] < 0.5)]",
+    "df['n'] = [random.randint(1, 10) for _ in range(len(df))]",
+    "df = df.sort_values('c0', ascending=False).reset_index(drop=True)",
+)
+EXECUTE_SNIPPETS = {
+    'arith': "df['result'] = df['c0'] * 2 + 1",
+    'filter': "df = df[df['c0'] > 50]",
+    'string': "df['c2'] = df['c2'].str.upper()",
+    'sort': "df = df.sort_values('c1')",
+    'drop': "df = df.drop(columns=['c1'])",
+}
+
+
+def _column(kind, rows, rng):
+    if kind == 'int':
+        return rng.integers(0, 100, rows)
+    if kind == 'float':
+        values = rng.random(rows).round(4)
+        values[rng.random(rows) < 0.05] = np.nan
+        return values
+    if kind == 'str':
+        return [f"s{v}" for v in rng.integers(0, rows, rows)]
+    if kind == 'date':
+        return pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D')
+    if kind == 'bool':
+        return rng.random(rows) < 0.5
+    if kind == 'category':
+        return rng.choice(['北京', '上海', '广州', '深圳'], rows)
+    raise ValueError(f"未知的列类型: {kind}")
+
+
+def make_frame(rows, cols, dtypes=('int', 'float', 'str', 'date'), seed=0):
+    """按列类型轮流生成 rows×cols 的DataFrame，列名为 c0, c1, ..."""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({f"c{i}": _column(dtypes[i % len(dtypes)], rows, rng) for i in range(cols)})
+
+
+def make_workbook(rows, cols, dtypes=('int', 'float', 'str', 'date'), sheets=1, directory=BENCH_DIR):
+    """生成（或复用已生成的）合成工作簿，返回文件路径"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"bench_{rows}x{cols}_{'-'.join(dtypes)}_{sheets}s.xlsx")
+    if os.path.exists(path):
+        return path
+    tmp_path = path + '.tmp.xlsx'
+    with pd.ExcelWriter(tmp_path, engine='openpyxl') as writer:
+        for s in range(sheets):
+            make_frame(rows, cols, dtypes, seed=s).to_excel(writer, sheet_name=f"sheet{s}", index=False)
+    os.replace(tmp_path, path)
+    return path
+
+
+def measure(func, repeat=5, setup=None):
+    """重复计时（不含setup），另用tracemalloc单独跑一次记录内存峰值"""
+    timings = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        'runs': repeat,
+        'min_s': min(timings),
+        'median_s': statistics.median(timings),
+        'mean_s': statistics.fmean(timings),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+class Bench:
+    """在一个合成工作簿上运行各阶段的计时场景"""
+
+    def __init__(self, path, server, repeat, workdir):
+        from code_cache import CodeCache
+        from main3 import ExcelAIProcessor
+        from openai import OpenAI
+
+        self.path = path
+        self.repeat = repeat
+        self.workdir = workdir
+        self.cache = CodeCache(path=os.path.join(workdir, 'code_cache.sqlite3'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+            self.processor = ExcelAIProcessor(code_cache=self.cache)
+        self.processor.client = OpenAI(api_key="bench", base_url=server.base_url, max_retries=0)
+
+    def _quiet(self, func, *args):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args)
+
+    def _load(self):
+        self.processor.workbooks.clear()  # 已打开的工作簿会被复用，基准中每次都重新读取
+        assert self._quiet(self.processor.read_excel, self.path), f"读取失败: {self.path}"
+        return self.processor.df
+
+    def read_excel(self):
+        def cold():
+            os.utime(self.path)  # 修改mtime使列式缓存副本失效
+            return ()
+        yield 'read_excel.cold', measure(self._load, self.repeat, cold)
+        yield 'read_excel.warm', measure(self._load, self.repeat)
+
+    def generate_pandas_code(self):
+        processor = self.processor
+        self._load()
+
+        def miss():
+            self.cache.clear()
+            return ()
+
+        def generate():
+            code = self._quiet(processor.generate_pandas_code, STUB_INSTRUCTION)
+            assert code, "代码生成失败"
+        yield 'generate_pandas_code.miss', measure(generate, self.repeat, miss)
+        yield 'generate_pandas_code.hit', measure(generate, self.repeat)
+
+    def _clean_code(self):
+        from code_validator import validate_code
+
+        def clean():
+            for snippet in CLEAN_SNIPPETS:
+                self._quiet(self.processor._clean_code, snippet)
+
+        def cold():
+            validate_code.cache_clear()
+            return ()
+        yield '_clean_code.cold', measure(clean, self.repeat, cold)
+        yield '_clean_code.warm', measure(clean, self.repeat)
+
+    def safe_execute(self):
+        processor = self.processor
+        base = self._load()
+
+        def reset():
+            processor.df = base
+            processor.history.clear()
+            return ()
+        for name, code in EXECUTE_SNIPPETS.items():
+            def run(code=code):
+                assert self._quiet(processor.safe_execute, code), f"执行失败: {code}"
+            yield f'safe_execute.{name}', measure(run, self.repeat, reset)
+
+    def save_excel(self):
+        processor = self.processor
+        output = os.path.join(self.workdir, 'out.xlsx')
+        for name, code in (('patch', "df.loc[0, 'c0'] = -1"), ('full', "df = df.sort_values('c1')")):
+            def prepare(code=code):
+                self._load()
+                self._quiet(processor.safe_execute, code)
+                return ()
+
+            def save():
+                assert self._quiet(processor.save_excel, output), "保存失败"
+            yield f'save_excel.{name}', measure(save, self.repeat, prepare)
+
+    def run(self, scenarios):
+        for scenario in scenarios:
+            yield from getattr(self, scenario)()
+
+
+def run_suite(shapes, scenarios=SCENARIOS, repeat=5, latency=0.05, directory=BENCH_DIR):
+    """对每种表格形状运行所有场景，返回可序列化为JSON的结果"""
+    server = start_stub_server(code=STUB_CODE, latency=latency)
+    results = []
+    try:
+        for rows, cols, dtypes, sheets in shapes:
+            path = make_workbook(rows, cols, dtypes, sheets, directory)
+            shape = {'rows': rows, 'cols': cols, 'dtypes': list(dtypes), 'sheets': sheets}
+            workdir = tempfile.mkdtemp(prefix='excel_ai_bench_')
+            try:
+                bench = Bench(path, server, repeat, workdir)
+                for scenario, stats in bench.run(scenarios):
+                    results.append({'scenario': scenario, 'shape': shape, **stats})
+                    print(f"{scenario:<28} {rows}x{cols}x{sheets}  中位数{stats['median_s'] * 1000:9.2f}ms  "
+                          f"内存峰值{stats['peak_kb']:10.1f}KB")
+                bench.cache.close()
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    finally:
+        server.shutdown()
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'repeat': repeat,
+            'latency': latency,
+        },
+        'results': results,
+    }
+
+
+def _key(result):
+    shape = result['shape']
+    return (result['scenario'], shape['rows'], shape['cols'], tuple(shape['dtypes']), shape['sheets'])
+
+
+def compare(baseline, current, threshold=1.2):
+    """按场景与形状对比两次结果的中位数，返回变慢超过阈值的条目"""
+    before = {_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get(_key(result))
+        if old is None or not old['median_s']:
+            continue
+        ratio = result['median_s'] / old['median_s']
+        mark = '  变慢' if ratio > threshold else ''
+        print(f"{result['scenario']:<28} {old['median_s'] * 1000:9.2f}ms → {result['median_s'] * 1000:9.2f}ms  "
+              f"x{ratio:.2f}{mark}")
+        if ratio > threshold:
+            regressions.append((result['scenario'], result['shape'], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="read → generate → execute → save 各阶段性能基准")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--cols', type=int, nargs='+', default=[8])
+    parser.add_argument('--dtypes', default='int,float,str,date', help=f"列类型轮换，可选：{','.join(DTYPES)}")
+    parser.add_argument('--sheets', type=int, nargs='+', default=[1])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0.05, help="桩服务每次请求的延迟（秒）")
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', help="与之前的结果JSON对比")
+    parser.add_argument('--threshold', type=float, default=1.2, help="中位数超过基线的倍数视为变慢")
+    args = parser.parse_args()
+
+    dtypes = tuple(args.dtypes.split(','))
+    unknown = set(dtypes) - set(DTYPES)
+    if unknown:
+        parser.error(f"未知的列类型: {', '.join(sorted(unknown))}")
+    shapes = [(r, c, dtypes, s) for r in args.rows for c in args.cols for s in args.sheets]
+    report = run_suite(shapes, args.scenarios, args.repeat, args.latency)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}个场景的中位数超过基线的{args.threshold}倍")
+            sys.exit(1)
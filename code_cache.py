@@ -0,0 +1,119 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+
+DEFAULT_CACHE_DIR = os.getenv("EXCEL_AI_CACHE_DIR", ".excel_ai_cache")
+
+
+def normalize_instruction(instruction):
+    """指令归一化：全角转半角、去首尾标点、合并空白；保留大小写（列名和取值区分大小写）"""
+    text = unicodedata.normalize('NFKC', instruction).strip()
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip('。.!！;；')
+
+
+def schema_fingerprint(df):
+    """基于列名与dtype的结构指纹（不包含样例数据）"""
+    schema = [[str(col), str(dtype)] for col, dtype in df.dtypes.items()]
+    return hashlib.sha256(json.dumps(schema, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class CodeCache:
+    """指令→代码的磁盘缓存，按LRU与TTL淘汰"""
+
+    def __init__(self, path=None, max_entries=2000, ttl=30 * 24 * 3600):
+        path = path or os.path.join(DEFAULT_CACHE_DIR, "code_cache.sqlite3")
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS code_cache ("
+            "key TEXT PRIMARY KEY, code TEXT NOT NULL, "
+            "created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON code_cache(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(instruction, fingerprint, namespace=''):
+        raw = '\x1f'.join([namespace, normalize_instruction(instruction), fingerprint])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, instruction, fingerprint, namespace='', count=True):
+        """count=False用于修复记录等其他用途的查询，不计入代码缓存命中率"""
+        key = self.make_key(instruction, fingerprint, namespace)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT code, created FROM code_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row and (not self.ttl or now - row[1] <= self.ttl):
+                self._conn.execute("UPDATE code_cache SET last_used = ? WHERE key = ?", (now, key))
+                self._conn.commit()
+                self.hits += count
+                return row[0]
+            if row:
+                self._conn.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+                self._conn.commit()
+            self.misses += count
+            return None
+
+    def put(self, instruction, fingerprint, code, namespace=''):
+        if not code:
+            return
+        key = self.make_key(instruction, fingerprint, namespace)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO code_cache (key, code, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, code, now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def invalidate(self, instruction, fingerprint, namespace=''):
+        key = self.make_key(instruction, fingerprint, namespace)
+        with self._lock:
+            self._conn.execute("DELETE FROM code_cache WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.ttl:
+            self._conn.execute("DELETE FROM code_cache WHERE created < ?", (now - self.ttl,))
+        count = self._conn.execute("SELECT COUNT(*) FROM code_cache").fetchone()[0]
+        if count > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM code_cache WHERE key IN "
+                "(SELECT key FROM code_cache ORDER BY last_used ASC LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM code_cache")
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM code_cache").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': entries,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,221 @@
+import ast
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+SANDBOX_NAMES = {'df', 'sheets', 'pd', 'np', 'random', 'str', 'int', 'float', 'bool', 'list', 'dict', 'tuple', 'len', 'range'}
+
+ALLOWED_NODES = (
+    ast.Module, ast.Expr, ast.Assign, ast.AugAssign, ast.Delete, ast.If, ast.For, ast.Pass,
+    ast.Name, ast.Attribute, ast.Subscript, ast.Slice, ast.Starred, ast.Constant,
+    ast.List, ast.Tuple, ast.Dict, ast.Set, ast.Call, ast.keyword,
+    ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp, ast.Lambda, ast.arguments, ast.arg,
+    ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.comprehension,
+    ast.JoinedStr, ast.FormattedValue,
+    ast.expr_context, ast.operator, ast.unaryop, ast.boolop, ast.cmpop,
+)
+
+# 文件/网络读写相关的pandas接口
+IO_ATTRS = {
+    'to_csv', 'to_excel', 'to_pickle', 'to_parquet', 'to_feather', 'to_json', 'to_html', 'to_sql',
+    'to_hdf', 'to_clipboard', 'to_latex', 'to_stata', 'to_orc', 'to_xml', 'to_gbq', 'to_markdown',
+    'ExcelWriter', 'ExcelFile', 'HDFStore', 'io', 'tofile', 'dump', 'dumps',
+}
+# 注入的模块（及其子模块）只开放下列属性，不能借由 pd.compat.os、np.f2py.subprocess 之类的属性走到其他模块
+MODULE_ATTRS = {
+    'pd': {
+        'DataFrame', 'Series', 'Index', 'MultiIndex', 'Categorical', 'CategoricalDtype', 'Timestamp', 'Timedelta',
+        'DateOffset', 'Period', 'Interval', 'NA', 'NaT', 'Grouper', 'NamedAgg', 'StringDtype', 'Int64Dtype',
+        'Float64Dtype', 'BooleanDtype', 'to_datetime', 'to_numeric', 'to_timedelta', 'concat', 'merge',
+        'merge_asof', 'cut', 'qcut', 'isna', 'isnull', 'notna', 'notnull', 'date_range', 'period_range',
+        'timedelta_range', 'crosstab', 'pivot_table', 'pivot', 'melt', 'get_dummies', 'factorize', 'unique',
+        'wide_to_long', 'offsets', 'api',
+    },
+    'pd.api': {'types'},
+    'pd.api.types': {
+        'is_numeric_dtype', 'is_string_dtype', 'is_object_dtype', 'is_bool_dtype', 'is_integer_dtype',
+        'is_float_dtype', 'is_datetime64_any_dtype', 'is_list_like', 'is_scalar',
+    },
+    'pd.offsets': {
+        'Day', 'Hour', 'Minute', 'Second', 'Week', 'MonthEnd', 'MonthBegin', 'QuarterEnd', 'QuarterBegin',
+        'YearEnd', 'YearBegin', 'BDay', 'BusinessDay', 'BMonthEnd', 'BMonthBegin', 'DateOffset',
+    },
+    'np': {
+        'nan', 'inf', 'pi', 'e', 'where', 'select', 'isnan', 'isinf', 'isfinite', 'isin', 'round', 'around',
+        'floor', 'ceil', 'trunc', 'abs', 'absolute', 'sqrt', 'square', 'power', 'exp', 'log', 'log2', 'log10',
+        'log1p', 'sign', 'clip', 'maximum', 'minimum', 'fmax', 'fmin', 'mean', 'median', 'sum', 'prod', 'std',
+        'var', 'min', 'max', 'nanmean', 'nanmedian', 'nansum', 'nanmin', 'nanmax', 'nanstd', 'percentile',
+        'quantile', 'cumsum', 'cumprod', 'diff', 'arange', 'linspace', 'array', 'asarray', 'zeros', 'ones',
+        'full', 'zeros_like', 'ones_like', 'full_like', 'concatenate', 'unique', 'sort', 'argsort', 'argmax',
+        'argmin', 'repeat', 'tile', 'digitize', 'searchsorted', 'logical_and', 'logical_or', 'logical_not',
+        'logical_xor', 'nan_to_num', 'mod', 'floor_divide', 'divide', 'multiply', 'add', 'subtract', 'sin',
+        'cos', 'tan', 'hypot', 'gcd', 'lcm', 'int8', 'int16', 'int32', 'int64', 'uint8', 'float32', 'float64',
+        'bool_', 'str_', 'object_', 'datetime64', 'timedelta64', 'busday_count', 'is_busday', 'random',
+    },
+    'np.random': {'default_rng', 'randint', 'rand', 'randn', 'random', 'choice', 'uniform', 'normal', 'seed',
+                  'shuffle', 'permutation'},
+    'random': {'randint', 'random', 'uniform', 'choice', 'choices', 'sample', 'shuffle', 'gauss',
+               'normalvariate', 'randrange', 'seed', 'triangular'},
+}
+MODULE_NAMES = {'pd', 'np', 'random'}
+# 任何对象上都不允许的属性名：常见的指向模块或解释器内部的属性
+MODULE_LIKE_ATTRS = {
+    'os', 'sys', 'subprocess', 'builtins', 'importlib', 'shutil', 'socket', 'pickle', 'marshal', 'compat',
+    'core', 'api', 'testing', 'util', 'plotting', 'modules', 'f2py', 'ctypeslib', 'lib', 'globals', 'env',
+    'loader', 'pd', 'np', 'random', 'f_globals', 'f_back', 'gi_frame', 'tb_frame',
+}
+STRING_EVAL_ATTRS = {'query', 'eval'}
+# str.format的替换字段可以访问属性和下标：'{0.__class__.__init__.__globals__}'.format(df)
+FORMAT_ATTRS = {'format', 'format_map'}
+FORMAT_ACCESS_RE = re.compile(r'\{[^{}:!]*[.\[]')
+ROW_LOOP_ATTRS = {'iterrows', 'itertuples'}
+
+ValidationResult = namedtuple('ValidationResult', ['ok', 'code', 'errors', 'warnings'])
+
+
+def _bound_names(tree):
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Store):
+            names.add(node.id)
+        elif isinstance(node, ast.arg):
+            names.add(node.arg)
+    return names
+
+
+def _slow_pattern(node):
+    """识别会退化为Python逐行循环的写法"""
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+        attr = node.func.attr
+        if attr in ROW_LOOP_ATTRS:
+            return f"{attr}() 会逐行循环，建议改用向量化写法"
+        if attr in ('apply', 'map', 'applymap'):
+            if any(k.arg == 'axis' and isinstance(k.value, ast.Constant) and k.value.value in (1, 'columns')
+                   for k in node.keywords):
+                return f"{attr}(axis=1) 会逐行调用Python函数，建议改用列运算"
+            if node.args and isinstance(node.args[0], ast.Lambda):
+                return f"{attr}(lambda ...) 会逐元素调用Python函数，建议改用向量化写法"
+    if isinstance(node, ast.For):
+        return "for循环会逐行执行，建议改用向量化写法"
+    if isinstance(node, ast.comprehension) and isinstance(node.iter, ast.Call) \
+            and isinstance(node.iter.func, ast.Name) and node.iter.func.id == 'range':
+        return "按行数生成列表会逐行执行，建议改用向量化写法"
+    return None
+
+
+def _dotted(node):
+    """np.random.default_rng → ['np', 'random', 'default_rng']；不是纯属性链时返回None"""
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    return [node.id] + parts[::-1] if isinstance(node, ast.Name) else None
+
+
+def _string_arg(call):
+    """eval/query的表达式参数：第一个位置参数或expr="""
+    if call.args:
+        return call.args[0]
+    return next((k.value for k in call.keywords if k.arg == 'expr'), None)
+
+
+def _attribute_errors(tree):
+    """属性访问检查：注入模块只能访问MODULE_ATTRS中的属性且不能作为值单独使用，
+    format/eval/query只接受常量字符串"""
+    errors = []
+    parents = {id(child): node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    for node in ast.walk(tree):
+        parent = parents.get(id(node))
+        if isinstance(node, ast.Name) and node.id in MODULE_NAMES \
+                and not (isinstance(parent, ast.Attribute) and parent.value is node):
+            errors.append(f"不允许把模块{node.id}作为值使用")
+        if not isinstance(node, ast.Attribute):
+            continue
+        if node.attr.startswith('_'):
+            errors.append(f"不允许访问私有属性: {node.attr}")
+        elif node.attr in IO_ATTRS or node.attr.startswith('read_'):
+            errors.append(f"不允许的文件操作: {node.attr}")
+        elif node.attr in FORMAT_ATTRS:
+            template = node.value
+            if not (isinstance(template, ast.Constant) and isinstance(template.value, str)):
+                errors.append(f"{node.attr}只能用于常量字符串")
+            elif FORMAT_ACCESS_RE.search(template.value):
+                errors.append("格式化字符串中不允许访问属性或下标")
+        elif node.attr in STRING_EVAL_ATTRS:
+            expr = _string_arg(parent) if isinstance(parent, ast.Call) and parent.func is node else None
+            if not (isinstance(expr, ast.Constant) and isinstance(expr.value, str)):
+                errors.append(f"{node.attr}只能使用常量字符串表达式")
+            else:
+                errors.extend(f"{node.attr}表达式中{e}" for e in _expression_errors(expr.value))
+
+        dotted = _dotted(node)
+        if dotted is None or dotted[0] not in MODULE_NAMES:
+            if node.attr in MODULE_LIKE_ATTRS:
+                errors.append(f"不允许访问属性: {node.attr}")
+            continue
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            continue  # 只检查完整的属性链
+        for depth in range(1, len(dotted)):
+            owner = '.'.join(dotted[:depth])
+            if owner not in MODULE_ATTRS:
+                break  # 已经是模块中的函数/类，后面的属性按普通属性检查
+            if dotted[depth] not in MODULE_ATTRS[owner]:
+                errors.append(f"不允许的模块属性: {owner}.{dotted[depth]}")
+                break
+        else:
+            if '.'.join(dotted) in MODULE_ATTRS:
+                errors.append(f"不允许把模块{'.'.join(dotted)}作为值使用")
+    return errors
+
+
+def _expression_errors(text):
+    """query/eval字符串按Python表达式检查：不允许私有属性和模块属性"""
+    source = re.sub(r'`[^`]*`', 'col', text).replace('@', '')
+    try:
+        tree = ast.parse(source, mode='eval')
+    except SyntaxError:
+        return ["无法解析"]
+    if any(isinstance(node, ast.Name) and node.id.startswith('__') for node in ast.walk(tree)):
+        return ["不允许访问私有名称"]
+    return _attribute_errors(tree)
+
+
+@lru_cache(maxsize=2048)
+def validate_code(code):
+    """基于AST的白名单校验：节点类型、名称、属性；返回规范化后的代码和性能提示"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        return ValidationResult(False, None, (f"语法错误: {e.msg}",), ())
+
+    # 模块已预注入，直接去掉import语句
+    tree.body = [stmt for stmt in tree.body if not isinstance(stmt, (ast.Import, ast.ImportFrom))]
+    errors, warnings = [], []
+    known = SANDBOX_NAMES | _bound_names(tree)
+    uses_df = False
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            errors.append(f"不允许的语法: {type(node).__name__}")
+            continue
+        if isinstance(node, ast.Name):
+            uses_df = uses_df or node.id == 'df'
+            if node.id.startswith('__') or node.id not in known:
+                errors.append(f"不允许的名称: {node.id}")
+            elif isinstance(node.ctx, ast.Store) and node.id in MODULE_NAMES:
+                errors.append(f"不允许重新绑定模块名: {node.id}")
+        slow = _slow_pattern(node)
+        if slow and slow not in warnings:
+            warnings.append(slow)
+    errors.extend(_attribute_errors(tree))
+
+    if not uses_df and not errors:
+        errors.append("代码未包含df操作")
+    if errors:
+        return ValidationResult(False, None, tuple(dict.fromkeys(errors)), tuple(warnings))
+    return ValidationResult(True, ast.unparse(tree), (), tuple(warnings))
+
+
+@lru_cache(maxsize=512)
+def compile_code(code):
+    """按源码缓存编译结果：同一段代码在多次执行、多个文件间只编译一次"""
+    return compile(code, '<string>', 'exec')
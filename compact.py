@@ -0,0 +1,104 @@
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装pyarrow时字符串列保持原类型
+    pa = None
+
+# 不同值个数 / 非空值个数 低于该比例的字符串列转为category
+CATEGORY_RATIO = 0.5
+
+CompactReport = namedtuple('CompactReport', ['dtypes', 'before', 'after'])
+
+
+def _arrow_string_dtype():
+    if pa is None:
+        return None
+    try:
+        return pd.StringDtype('pyarrow', na_value=np.nan)  # 与pandas>=3默认的str类型一致，缺失值为NaN
+    except TypeError:
+        return pd.StringDtype('pyarrow')
+
+
+ARROW_STRING = _arrow_string_dtype()
+
+
+def _narrow_int(values):
+    """选择能容纳取值的最窄整数类型。窄类型只用于存储：任何运算都可能溢出且不报错，
+    执行代码前须先用widen_ints还原为原类型"""
+    if values.empty:
+        return None
+    low, high = int(values.min()), int(values.max())
+    for target in (np.int16, np.int32):
+        if np.dtype(target).itemsize >= values.dtype.itemsize:
+            return None
+        info = np.iinfo(target)
+        if info.min <= low and high <= info.max:
+            return target
+    return None
+
+
+def compact_series(values):
+    """返回取值完全相同、更省内存的列；无法压缩时原样返回。浮点数不降精度（float32运算结果会与原来不同）"""
+    dtype = values.dtype
+    if isinstance(dtype, np.dtype) and dtype.kind in 'iu':
+        target = _narrow_int(values)
+        return values.astype(target) if target is not None else values
+    if dtype == object or isinstance(dtype, pd.StringDtype):
+        if dtype == object and pd.api.types.infer_dtype(values, skipna=True) != 'string':
+            return values  # 混合类型的列不改动
+        count = values.count()
+        if count and values.nunique() / count < CATEGORY_RATIO:
+            return values.astype('category')
+        if ARROW_STRING is not None and dtype != ARROW_STRING:
+            return values.astype(ARROW_STRING)
+    return values
+
+
+def compact_frame(df):
+    """读取后的内存优化：低基数字符串转category、其余字符串使用Arrow存储、整数下转换；
+    返回 (新DataFrame, CompactReport)，report.dtypes记录被压缩列的原类型"""
+    before = int(df.memory_usage(index=True, deep=True).sum())
+    if df.columns.has_duplicates:
+        return df, CompactReport({}, before, before)
+    columns, dtypes = {}, {}
+    for name in df.columns:
+        column = df[name]
+        compacted = compact_series(column)
+        if compacted.dtype != column.dtype:
+            columns[name] = compacted
+            dtypes[name] = column.dtype
+    if columns:
+        df = df.copy(deep=False)
+        for name, values in columns.items():
+            df[name] = values
+    return df, CompactReport(dtypes, before, int(df.memory_usage(index=True, deep=True).sum()))
+
+
+def expand_frame(df, dtypes):
+    """把压缩过的列还原为读取时的类型（用于压缩类型不支持的操作和整表写出）"""
+    columns = [c for c in dtypes if c in df.columns and df[c].dtype != dtypes[c]]
+    if not columns:
+        return df
+    df = df.copy(deep=False)
+    for name in columns:
+        try:
+            df[name] = df[name].astype(dtypes[name])
+        except (TypeError, ValueError):
+            pass  # 列已被代码改写为其他内容，保留当前类型
+    return df
+
+
+def widen_ints(df, dtypes):
+    """执行代码前把下转换过的整数列还原为原类型（如int16→int64），避免df['age'] * 1000之类的运算静默溢出；
+    执行后由restore_compact按新的取值范围重新压缩"""
+    return expand_frame(df, {name: dtype for name, dtype in dtypes.items()
+                             if isinstance(dtype, np.dtype) and dtype.kind in 'iu'})
+
+
+def restore_compact(values, original):
+    """代码改动过的压缩列：先按原类型还原，再重新压缩（重新计算类别，按新的取值范围选择整数宽度）"""
+    return compact_series(values.astype(original))
@@ -0,0 +1,136 @@
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+
+def _same_buffer(a, b):
+    """两列共享同一块numpy内存（写时复制下未修改的列）时无需逐值比较"""
+    if not (isinstance(a.dtype, np.dtype) and a.dtype == b.dtype and len(a) == len(b)):
+        return False
+    x, y = a.to_numpy(copy=False), b.to_numpy(copy=False)
+    return x.__array_interface__ == y.__array_interface__
+
+
+def _series_nbytes(s):
+    return int(s.memory_usage(index=False, deep=True))
+
+
+class FrameDelta:
+    """把after还原为before所需的最小差异：被改动/删除的列、被删除的行、列重命名"""
+
+    def __init__(self, before, after, label=None):
+        self.label = label
+        self.columns = list(before.columns)
+        self.renamed = {}
+        self.restored = {}
+        self.index = None
+        self.unchanged = []
+        self.dropped_rows = None
+        self.full = None
+        if (before.columns.has_duplicates or after.columns.has_duplicates
+                or not before.index.is_unique or not after.index.is_unique):
+            self.full = before
+            self.nbytes = int(before.memory_usage(deep=True).sum())
+            return
+        self._diff(before, after)
+        self.nbytes = sum(_series_nbytes(s) for s in self.restored.values())
+        if self.index is not None:
+            self.nbytes += self.index.nbytes
+        if self.dropped_rows is not None:
+            self.nbytes += int(self.dropped_rows.memory_usage(deep=True).sum())
+
+    def _diff(self, before, after):
+        rows_same = before.index.equals(after.index)
+        kept = before.index if rows_same else before.index[before.index.isin(after.index)]
+        if not rows_same:
+            self.index = before.index
+
+        def same(b, a):
+            if rows_same:
+                return _same_buffer(b, a) or b.equals(a)
+            return b.dtype == a.dtype and b.loc[kept].equals(a.loc[kept])
+
+        # 识别重命名：新出现的列与消失的列内容一致
+        gone = [c for c in before.columns if c not in after.columns]
+        added = [c for c in after.columns if c not in before.columns]
+        for b in gone:
+            for a in added:
+                if a not in self.renamed and same(before[b], after[a]):
+                    self.renamed[a] = b
+                    break
+        source = {b: a for a, b in self.renamed.items()}
+
+        for col in before.columns:
+            a = source.get(col, col)
+            if a in after.columns and (col in source or same(before[col], after[a])):
+                self.unchanged.append(col)
+            else:
+                self.restored[col] = before[col]
+
+        if not rows_same:
+            dropped = before.index[~before.index.isin(after.index)]
+            if len(dropped):
+                self.dropped_rows = before.loc[dropped, self.unchanged]
+
+    def apply(self, after):
+        """由after重建before"""
+        if self.full is not None:
+            return self.full
+        df = after.rename(columns=self.renamed)
+        if self.index is not None:
+            base = df.loc[df.index.isin(self.index), self.unchanged]
+            if self.dropped_rows is not None:
+                base = pd.concat([base, self.dropped_rows])
+            base = base.reindex(self.index)
+        else:
+            base = df[self.unchanged]
+        base = base.copy(deep=False)
+        for col, series in self.restored.items():
+            base[col] = series
+        return base[self.columns]
+
+
+class History:
+    """撤销/重做栈，按内存预算淘汰最早的记录"""
+
+    def __init__(self, max_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.undo_stack = deque()
+        self.redo_stack = []
+
+    @property
+    def nbytes(self):
+        return sum(d.nbytes for d in self.undo_stack) + sum(d.nbytes for d in self.redo_stack)
+
+    def record(self, before, after, label=None):
+        self.undo_stack.append(FrameDelta(before, after, label))
+        self.redo_stack.clear()
+        self._evict()
+
+    def undo(self, current):
+        """返回 (上一步的DataFrame, 被撤销的标签)，无可撤销时返回 (None, None)"""
+        if not self.undo_stack:
+            return None, None
+        delta = self.undo_stack.pop()
+        previous = delta.apply(current)
+        self.redo_stack.append(FrameDelta(current, previous, delta.label))
+        self._evict()
+        return previous, delta.label
+
+    def redo(self, current):
+        if not self.redo_stack:
+            return None, None
+        delta = self.redo_stack.pop()
+        following = delta.apply(current)
+        self.undo_stack.append(FrameDelta(current, following, delta.label))
+        self._evict()
+        return following, delta.label
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def _evict(self):
+        while self.undo_stack and self.nbytes > self.max_bytes:
+            self.undo_stack.popleft()
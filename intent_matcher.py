@@ -0,0 +1,138 @@
+import re
+
+import pandas as pd
+
+OPS = {
+    '大于等于': '>=', '不小于': '>=', '小于等于': '<=', '不大于': '<=', '不等于': '!=',
+    '大于': '>', '小于': '<', '等于': '==', '不为': '!=', '不是': '!=', '非': '!=', '是': '==', '为': '==',
+    '>=': '>=', '<=': '<=', '!=': '!=', '==': '==', '>': '>', '<': '<', '=': '==',
+}
+OP_PATTERN = '|'.join(sorted((re.escape(k) for k in OPS), key=len, reverse=True))
+DESCENDING = {'降序', '从大到小', '倒序', '由大到小'}
+DIRECTION = r'升序|降序|从小到大|从大到小|由小到大|由大到小|倒序|正序'
+ROWS = r'(?:的)?(?:行|数据|记录)?'
+# “为空/非空/不为空”对应缺失值判断，不是与字符串'空'比较
+EMPTY = {'空', '空值', '空白', '缺失', '缺失值', 'null', 'NULL', 'NaN', 'nan', 'None'}
+# “城市为北京或上海”中的多个取值
+ALTERNATIVES = re.compile(r'或者|或|、|[,，/]')
+
+RULES = [
+    ('drop_rows', re.compile(rf'^(?:删除|删掉|去掉|去除)(?P<col>.+?)(?P<op>{OP_PATTERN})(?P<value>.+?){ROWS}$')),
+    ('drop_columns', re.compile(r'^(?:删除|删掉|去掉|去除)(?:列)?(?P<cols>.+?)(?:这?[一两几]?列)?$')),
+    ('sort', re.compile(rf'^(?:按照|按|根据)(?P<col>.+?)(?:列)?(?:进行)?(?P<dir>{DIRECTION})?排序'
+                        rf'(?:[，,]?(?P<dir2>{DIRECTION}))?$')),
+    ('filter', re.compile(rf'^(?:筛选出?|过滤出?|只保留|保留|选出)(?P<col>.+?)(?P<op>{OP_PATTERN})(?P<value>.+?){ROWS}$')),
+    ('rename', re.compile(r'^(?:将|把)?(?P<old>.+?)(?:列)?(?:重命名|改名|更名)(?:为|成)(?P<new>.+)$')),
+    ('rename', re.compile(r'^重命名(?:列)?(?P<old>.+?)(?:为|成)(?P<new>.+)$')),
+]
+
+
+def _strip(text):
+    return text.strip().strip('“”"\'‘’「」《》 ').strip()
+
+
+class IntentMatcher:
+    """常见指令（删列、排序、筛选、重命名）的本地规则匹配，直接生成Pandas代码而不调用模型"""
+
+    def __init__(self):
+        self.attempts = 0
+        self.hits = 0
+
+    def match(self, instruction, df, column_map=None):
+        self.attempts += 1
+        text = re.sub(r'\s+', ' ', instruction).strip().rstrip('。.!！')
+        for kind, pattern in RULES:
+            m = pattern.match(text)
+            if not m:
+                continue
+            code = getattr(self, f'_{kind}')(m, df, column_map or {})
+            if code:
+                self.hits += 1
+                return code
+        return None
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'attempts': self.attempts,
+            'hit_rate': self.hits / self.attempts if self.attempts else 0.0,
+        }
+
+    @staticmethod
+    def _resolve(name, df, column_map):
+        """把指令中的列名（原始列名或标准列名）解析为当前DataFrame的列"""
+        name = _strip(name)
+        if name.endswith('列'):
+            name = name[:-1]
+        candidates = [name, column_map.get(name), re.sub(r'[^\w]', '_', name)]
+        for candidate in candidates:
+            if candidate is not None and candidate in df.columns:
+                return candidate
+        # 忽略大小写、空白和下划线再比较一次
+        plain = {re.sub(r'[\s_]', '', str(c)).lower(): c for c in df.columns}
+        for original, standardized in column_map.items():
+            plain.setdefault(re.sub(r'[\s_]', '', original).lower(), standardized)
+        column = plain.get(re.sub(r'[\s_]', '', name).lower())
+        return column if column in df.columns else None
+
+    def _drop_columns(self, m, df, column_map):
+        names = [n for n in re.split(r'[、,，和及与]', m.group('cols')) if _strip(n)]
+        columns = [self._resolve(n, df, column_map) for n in names]
+        if not columns or None in columns:
+            return None
+        return f"df = df.drop(columns={columns!r})"
+
+    def _sort(self, m, df, column_map):
+        column = self._resolve(m.group('col'), df, column_map)
+        if column is None:
+            return None
+        ascending = (m.group('dir') or m.group('dir2')) not in DESCENDING
+        return f"df = df.sort_values({column!r}, ascending={ascending})"
+
+    def _condition(self, m, df, column_map):
+        column = self._resolve(m.group('col'), df, column_map)
+        if column is None:
+            return None
+        op = OPS[m.group('op')]
+        raw = _strip(m.group('value'))
+        if raw in EMPTY:
+            if op not in ('==', '!='):
+                return None
+            return f"df[{column!r}].{'isna' if op == '==' else 'notna'}()"
+        values = [self._value(_strip(v), df[column]) for v in ALTERNATIVES.split(raw)]
+        if not values or None in values:
+            return None
+        if op not in ('==', '!=') and (len(values) > 1 or isinstance(values[0], str)):
+            return None
+        if len(values) == 1:
+            return f"df[{column!r}] {op} {values[0]!r}"
+        condition = f"df[{column!r}].isin({values!r})"
+        return condition if op == '==' else f"~{condition}"
+
+    @staticmethod
+    def _value(raw, series):
+        """数值列按数字解析，其余列按字符串比较；无法解析时返回None"""
+        if not raw or raw in EMPTY:
+            return None
+        if not pd.api.types.is_numeric_dtype(series):
+            return raw
+        try:
+            value = float(raw)
+        except ValueError:
+            return None
+        return int(value) if value.is_integer() else value
+
+    def _filter(self, m, df, column_map):
+        condition = self._condition(m, df, column_map)
+        return f"df = df[{condition}]" if condition else None
+
+    def _drop_rows(self, m, df, column_map):
+        condition = self._condition(m, df, column_map)
+        return f"df = df[~({condition})]" if condition else None
+
+    def _rename(self, m, df, column_map):
+        column = self._resolve(m.group('old'), df, column_map)
+        new = _strip(m.group('new'))
+        if column is None or not new:
+            return None
+        return f"df = df.rename(columns={{{column!r}: {new!r}}})"
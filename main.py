@@ -1,17 +1,25 @@
 import pandas as pd
 import os
 import re
-from openai import OpenAI
+from startup import preload
 
 class ExcelAIProcessor:
     def __init__(self):
         self.df = None
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        self._client = None
         self.safe_globals = {'pd': pd, 'df': None}
 
+    @property
+    def client(self):
+        """首次请求模型时才导入openai并创建客户端，之后复用"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(
+                api_key=os.getenv("DASHSCOPE_API_KEY"),
+                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            )
+        return self._client
+
     def read_excel(self, file_path):
         """读取Excel文件到DataFrame"""
         try:
@@ -86,6 +94,8 @@ class ExcelAIProcessor:
 
 if __name__ == "__main__":
     processor = ExcelAIProcessor()
+    # 等待输入时在后台导入openai和to_markdown依赖的tabulate
+    preload('openai', 'tabulate')
     
     # 输入文件路径
     input_file = input("请输入要处理的Excel文件路径: ")
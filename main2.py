@@ -2,15 +2,12 @@ import pandas as pd
 import os
 import re
 import random  # 添加内置随机模块
-from openai import OpenAI
+from startup import preload
 
 class ExcelAIProcessor:
     def __init__(self):
         self.df = None
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        self._client = None
         # 增强安全白名单
         self.safe_globals = {
             'pd': pd,
@@ -29,6 +26,17 @@ class ExcelAIProcessor:
             }
         }
 
+    @property
+    def client(self):
+        """首次请求模型时才导入openai并创建客户端，之后复用"""
+        if self._client is None:
+            from openai import OpenAI
+            self._client = OpenAI(
+                api_key=os.getenv("DASHSCOPE_API_KEY"),
+                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            )
+        return self._client
+
     def read_excel(self, file_path):
         """读取Excel文件到DataFrame并标准化列名"""
         try:
@@ -125,7 +133,10 @@ class ExcelAIProcessor:
                 return False
                 
             try:
-                new_df.astype(self.df.dtypes.to_dict())
+                old_dtypes, new_dtypes = self.df.dtypes, new_df.dtypes
+                changed = {c: old_dtypes[c] for c in new_df.columns.intersection(self.df.columns)
+                           if new_dtypes[c] != old_dtypes[c]}
+                new_df[list(changed)].astype(changed)
             except Exception as e:
                 print(f"类型转换错误: {str(e)}")
                 return False
@@ -162,6 +173,8 @@ class ExcelAIProcessor:
 
 if __name__ == "__main__":
     processor = ExcelAIProcessor()
+    # 等待输入时在后台导入openai和to_markdown依赖的tabulate
+    preload('openai', 'tabulate')
     
     input_file = input("请输入要处理的Excel文件路径: ").strip()
     if not processor.read_excel(input_file):
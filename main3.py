@@ -1,37 +1,168 @@
+import argparse
+import numpy as np
 import pandas as pd
 import os
 import re
 import random
-from openai import OpenAI
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from code_cache import CodeCache, schema_fingerprint
+from compact import expand_frame, restore_compact, widen_ints
+from code_validator import compile_code, validate_code
+from history import History
+from intent_matcher import IntentMatcher
+from parallel import PARALLEL_MIN_ROWS, default_shards, run_sharded, shard_plan
+from pipeline import LazyPlan
+from prompt_builder import MAIN_MODEL, PromptBuilder, estimate_tokens
+from recipe import (RecipeError, RecipeLog, RecipeStep, build_recipe, check_schema, compare_output,
+                    frame_schema, load_recipe, prepare_steps, save_recipe, schema_digest)
+from repair import RepairStore, describe_error, format_error, make_error
+from sandbox_pool import SAFE_BUILTINS, SandboxPool, SandboxTimeout
+from startup import preload
+from streaming import StreamingWriter, is_row_local, iter_excel_chunks
+from tracing import JsonLogSink, PrometheusSink, Tracer, traced
+from vectorize import vectorize_code, verify_rewrite
+from workbook_session import SheetAccessor, WorkbookSession
+
+PREVIEW_ROWS = 200
+VERIFY_ROWS = 200
+# 多候选生成时依次使用的temperature，第一个与单次生成一致，其余提高多样性
+CANDIDATE_TEMPERATURES = (0.2, 0.6, 0.9, 1.1)
+SHEETS_REF = re.compile(r'\bsheets\b')
+BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+
+
+def _enable_copy_on_write():
+    """pandas>=3 默认写时复制；2.x 需手动开启；更早版本不支持"""
+    if int(pd.__version__.split('.')[0]) >= 3:
+        return True
+    try:
+        pd.set_option('mode.copy_on_write', True)
+        return True
+    except (KeyError, ValueError, pd.errors.OptionError):
+        return False
+
+
+COPY_ON_WRITE = _enable_copy_on_write()
+
+_client_lock = threading.Lock()
+_shared_client = None
+
+
+def default_client():
+    """首次请求模型时才导入openai并创建客户端（导入openai占启动时间的一半），
+    同一进程内的处理器共用这个客户端及其连接池"""
+    global _shared_client
+    with _client_lock:
+        if _shared_client is None:
+            from openai import OpenAI
+            _shared_client = OpenAI(
+                api_key=os.getenv("DASHSCOPE_API_KEY"),
+                base_url=BASE_URL
+            )
+        return _shared_client
+
+
+class CandidateCancelled(Exception):
+    """已有候选代码被采用，其余候选请求中止"""
+
+
+def _uses_sheets(code):
+    if isinstance(code, str):
+        return bool(SHEETS_REF.search(code))
+    return 'sheets' in code.co_names or any(
+        isinstance(const, types.CodeType) and _uses_sheets(const) for const in code.co_consts)
 
 class ExcelAIProcessor:
-    def __init__(self):
+    def __init__(self, code_cache=None, tracer=None, client=None):
         self.df = None
-        self.client = OpenAI(
-            api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
-        )
+        self.model = MAIN_MODEL
+        self.route_models = True
+        self.prompt_builder = PromptBuilder()
+        self.intent_matcher = IntentMatcher()
+        self.column_map = {}
+        self.code_cache = code_cache if code_cache is not None else CodeCache()
+        self.repairs = RepairStore(self.code_cache)
+        self.repair_stats = {'local': 0, 'llm': 0, 'failed': 0}
+        self.recipe_log = RecipeLog()
+        self.last_error = None
+        self.stream_source = None
+        self.chunksize = None
+        self.deferred_df = None
+        self.plan = None
+        self.last_timings = {}
+        self.history = History()
+        self.workbooks = {}
+        self.workbook = None
+        self.sheet_name = None
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.profiler = None
+        self.sandbox = None
+        self.shard_pool = None
+        self.shards = 1
+        self.compact = False
+        self._client = client
         self.safe_globals = {
             'pd': pd,
+            'np': np,
             'df': None,
             'random': random,
-            '__builtins__': {
-                'str': str, 'int': int, 'float': float, 'bool': bool,
-                'list': list, 'dict': dict, 'tuple': tuple,
-                'len': len, 'range': range
-            }
+            'sheets': SheetAccessor(self._resolve_sheet, self._sheet_keys, deep=not COPY_ON_WRITE),
+            '__builtins__': dict(SAFE_BUILTINS)
         }
 
-    def read_excel(self, file_path):
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = default_client()
+        return self._client
+
+    @client.setter
+    def client(self, client):
+        self._client = client
+
+    @staticmethod
+    def _standardize_columns(columns):
+        return pd.Index(columns).str.replace(r'[^\w]', '_', regex=True)
+
+    @traced(frame=True)
+    def read_excel(self, file_path, chunksize=None, deferred=False, sheet_name=None):
         try:
-            self.df = pd.read_excel(file_path)
-            # 标准化列名并打印
-            original_columns = self.df.columns.tolist()
-            self.df.columns = self.df.columns.str.replace(r'[^\w]', '_', regex=True)
+            self.stream_source, self.deferred_df, self.plan = None, None, None
+            if chunksize:
+                # 流式模式：只加载第一块作为样例，保存时再逐块处理整个文件
+                self.df = next(iter_excel_chunks(file_path, chunksize, sheet_name))
+                self.stream_source, self.chunksize, self.plan = file_path, chunksize, LazyPlan()
+                self.workbook, self.sheet_name, self.history = None, sheet_name, History()
+                # 标准化列名
+                original_columns = self.df.columns.tolist()
+                self.df.columns = self._standardize_columns(self.df.columns)
+                self.column_map = dict(zip(map(str, original_columns), self.df.columns))
+            else:
+                # 只读取工作表列表，当前工作表按需加载（首次读取后生成Feather副本）
+                workbook = self.workbooks.get(os.path.abspath(file_path)) \
+                    or WorkbookSession(file_path, self._standardize_columns, compact=self.compact)
+                self.workbooks[workbook.path] = workbook
+                self._activate(workbook, sheet_name or workbook.sheet_names[0])
+                if workbook.from_sidecar[self.sheet_name]:
+                    print("已从列式缓存副本加载")
+                self._print_compact()
+                if len(workbook.sheet_names) > 1:
+                    print(f"工作簿共{len(workbook.sheet_names)}个工作表：{', '.join(workbook.sheet_names)}；"
+                          f"当前：{self.sheet_name}")
             print("列名标准化映射：")
-            for o, n in zip(original_columns, self.df.columns):
+            for o, n in self.column_map.items():
                 print(f"原始: {o} → 新: {n}")
-            print(f"\n成功读取Excel文件，共{len(self.df)}行{len(self.df.columns)}列")
+            if self.stream_source:
+                print(f"\n流式读取Excel文件，样例块共{len(self.df)}行{len(self.df.columns)}列")
+            else:
+                print(f"\n成功读取Excel文件，共{len(self.df)}行{len(self.df.columns)}列")
+            if deferred and not chunksize:
+                # 延迟模式：指令只在样例上预览，保存时对全量数据融合执行一次
+                self.deferred_df, self.df, self.plan = self.df, self.df.head(PREVIEW_ROWS), LazyPlan()
+                print(f"延迟执行模式：指令先在前{len(self.df)}行样例上预览")
             print("前3行数据样例：")
             print(self.df.head(3))
             return True
@@ -39,105 +170,715 @@ class ExcelAIProcessor:
             print(f"读取文件失败: {str(e)}")
             return False
 
-    def generate_pandas_code(self, instruction):
-        prompt = f"""当前DataFrame结构（显示前3行）：
-{self.df.head(3).to_markdown(index=False)}
+    def _activate(self, workbook, sheet):
+        self.workbook, self.sheet_name = workbook, sheet
+        self.df = workbook.get(sheet)
+        self.column_map = workbook.column_maps[sheet]
+        self.history = workbook.history(sheet)
 
-当前标准列名列表：{', '.join(self.df.columns.tolist())}
+    def _original_dtypes(self):
+        return self.workbook.original_dtypes(self.sheet_name) if self.workbook is not None else {}
 
-请将以下自然语言指令转换为安全的Pandas代码：
-指令：{instruction}
+    def _print_compact(self):
+        report = self.workbook.compacted.get(self.sheet_name)
+        if report and report.dtypes:
+            print(f"内存优化：压缩{len(report.dtypes)}列，{report.before / 2 ** 20:.1f}MB → "
+                  f"{report.after / 2 ** 20:.1f}MB（{report.before / max(report.after, 1):.1f}倍）")
+
+    @traced(frame=True)
+    def switch_sheet(self, sheet, file_path=None):
+        """切换当前工作表（可指定已打开的其他工作簿），未加载的工作表此时才读取"""
+        if self.plan is not None:
+            print("流式/延迟模式下不支持切换工作表")
+            return False
+        workbook = self.workbooks.get(os.path.abspath(file_path)) if file_path else self.workbook
+        if workbook is None or sheet not in workbook.sheet_names:
+            print(f"找不到工作表: {sheet}")
+            return False
+        self._activate(workbook, sheet)
+        self._print_compact()
+        print(f"已切换到工作表 {workbook.name}/{sheet}，共{len(self.df)}行{len(self.df.columns)}列")
+        print(self.df.head(3))
+        return True
 
-要求：
-1. 必须使用上述标准列名列表中的准确列名
-2. 生成单行Python代码，使用df变量操作DataFrame
-3. 删除列操作必须明确指定列名，格式：df.drop(columns=[列名1, 列名2])
-4. 兼容Pandas >=1.0版本语法
-5. 如果要生成随机数，则必须使用random模块生成随机值（如random.randint）
-6. 禁止直接import random模块（已预注入）
-7. 返回格式：<code>你的代码</code>"""
+    def list_sheets(self):
+        for workbook in self.workbooks.values():
+            for sheet in workbook.sheet_names:
+                marks = ('当前' if (workbook, sheet) == (self.workbook, self.sheet_name) else '',
+                         '已加载' if workbook.is_loaded(sheet) else '',
+                         '已修改' if sheet in workbook.dirty else '')
+                print(f"{workbook.name}/{sheet} {' '.join(m for m in marks if m)}")
 
+    def _sheet_keys(self):
+        keys = []
+        for workbook in self.workbooks.values():
+            keys += workbook.sheet_names if workbook is self.workbook else []
+            keys += [f"{workbook.name}/{sheet}" for sheet in workbook.sheet_names]
+        return keys
+
+    def _resolve_sheet(self, key):
+        """sheets['表名'] 在当前工作簿中查找，sheets['文件名/表名'] 在已打开的工作簿中查找"""
+        name, _, sheet = key.rpartition('/')
+        for workbook in self.workbooks.values():
+            if (workbook.name == name if name else workbook is self.workbook) and sheet in workbook.sheet_names:
+                if (workbook, sheet) == (self.workbook, self.sheet_name):
+                    return self.df
+                return workbook.get(sheet)
+        return None
+
+    def _related_sheets(self, instruction):
+        """指令中提到的其他工作表，按需加载后用于构造prompt"""
+        related, seen = {}, {self.sheet_name}
+        for key in self._sheet_keys():
+            sheet = key.rpartition('/')[2]
+            if sheet in instruction and sheet not in seen:
+                seen.add(sheet)
+                related[key] = self._resolve_sheet(key)
+        return related
+
+    @traced()
+    def generate_pandas_code(self, instruction, on_progress=None):
+        code = self._lookup_code(instruction)
+        if code:
+            return code
+
+        related = self._related_sheets(instruction)
+        model = self._model_for(instruction)
         try:
-            completion = self.client.chat.completions.create(
-                model="deepseek-r1",
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.2
-            )
-            content = completion.choices[0].message.content
-            code_match = re.search(r'<code>(.*?)</code>', content, re.DOTALL)
-            return self._clean_code(code_match.group(1).strip()) if code_match else None
+            self.tracer.annotate(source='llm', model=model)
+            prompt = self._build_prompt(instruction, related=related)
+            content = self._stream_completion(model, prompt, on_progress)
+            code = self._extract_code(content)
+            self.code_cache.put(instruction, self._fingerprint(related), code, namespace=model)
+            return self.optimize_code(code)
         except Exception as e:
             print(f"API请求失败: {str(e)}")
             return None
 
-    def _clean_code(self, code):
-        code = ' '.join([line.split('#')[0].strip() for line in code.split('\n') 
-                        if line.strip() and not line.startswith(('import', 'from'))])
-        
-        unsafe_patterns = r'(numpy|__import__|os\.|sys\.|open\(|eval\()'
-        if re.search(unsafe_patterns, code, re.IGNORECASE):
-            print("检测到危险操作或禁用库")
-            return None
-            
-        if not re.search(r'\bdf\b', code):
-            print("代码未包含df操作")
+    def _lookup_code(self, instruction):
+        """不调用模型就能得到的代码：先走本地规则，再查代码缓存；都没有时返回None"""
+        local = self.intent_matcher.match(instruction, self.df, self.column_map)
+        self.tracer.count('intent_matcher', result='hit' if local else 'miss')
+        if local and (code := self._clean_code(local)):
+            print("本地规则匹配")
+            self.tracer.annotate(source='intent')
+            return code
+
+        related = self._related_sheets(instruction)
+        model = self._model_for(instruction)
+        fingerprint = self._fingerprint(related)
+        cached = self.code_cache.get(instruction, fingerprint, namespace=model)
+        # 缓存中的代码可能写入于校验规则收紧之前，或缓存文件被改动过，命中后同样要通过校验
+        code = self._clean_code(cached) if cached else None
+        if cached and not code:
+            self.code_cache.invalidate(instruction, fingerprint, namespace=model)
+        self.tracer.count('code_cache', result='hit' if code else 'invalid' if cached else 'miss')
+        if code:
+            print("命中代码缓存")
+            self.tracer.annotate(source='cache')
+            return self.optimize_code(code)
+        return None
+
+    @traced()
+    def speculative_execute(self, instruction, candidates=3, on_progress=None):
+        """一次并行请求多个候选代码，各自在样例上试运行，第一个通过的直接应用到整张表；
+        返回最终采用的代码，全部失败时返回None"""
+        code = self._lookup_code(instruction)
+        if code:
+            if self.safe_execute(code, instruction):
+                return code
+            self.discard_cached_code(instruction)
+
+        related = self._related_sheets(instruction)
+        fingerprint = self._fingerprint(related)
+        model = self._model_for(instruction)
+        prompt = self._build_prompt(instruction, related=related)
+        sample = self.df.head(VERIFY_ROWS)
+        stop = threading.Event()
+        self.tracer.annotate(source='llm', model=model, candidates=candidates)
+
+        def generate(index):
+            def progress(reasoning_chars, content_chars):
+                if stop.is_set():
+                    raise CandidateCancelled()
+                if on_progress and index == 0:
+                    on_progress(reasoning_chars, content_chars)
+            temperature = CANDIDATE_TEMPERATURES[index % len(CANDIDATE_TEMPERATURES)]
+            code = self._extract_code(self._stream_completion(model, prompt, progress, temperature))
+            return code if code and self._dry_run(code, sample) else None
+
+        executor = ThreadPoolExecutor(max_workers=candidates)
+        try:
+            futures = [executor.submit(generate, i) for i in range(candidates)]
+            passed = 0
+            for future in as_completed(futures):
+                try:
+                    code = future.result()
+                except CandidateCancelled:
+                    continue
+                except Exception as e:
+                    print(f"\n候选请求失败: {str(e)}")
+                    continue
+                if not code:
+                    continue
+                passed += 1
+                print(f"\n候选代码通过样例试运行: {code}")
+                code = self.optimize_code(code)
+                if self.safe_execute(code, instruction):
+                    # 其余候选不再需要，收到下一块输出时即断开
+                    stop.set()
+                    self.code_cache.put(instruction, fingerprint, code, namespace=model)
+                    self.tracer.annotate(passed=passed)
+                    return code
+            print(f"\n{candidates}个候选代码均未通过")
             return None
-            
+        finally:
+            stop.set()
+            executor.shutdown(wait=False)
+
+    @traced()
+    def execute_with_repair(self, instruction, code, max_repairs=2, on_progress=None):
+        """执行失败时自动修复：先按错误签名查本地修复记录，否则把错误、代码和相关列发给模型，
+        最多请求max_repairs次；返回最终执行成功的代码，失败时返回None"""
+        related = self._related_sheets(instruction)
+        fingerprint = self._fingerprint(related)
+        model = self._model_for(instruction)
+        failures, tried, requests, local_origin = [], {code}, 0, None
+        while not self.safe_execute(code, instruction):
+            error = self.last_error
+            if error is None:  # 流式模式不支持等无法靠改代码解决的情况
+                return None
+            if local_origin is not None:
+                # 本地修复记录改写后的代码仍然失败，该记录不再可信
+                self.repairs.discard(*local_origin, fingerprint)
+            failures.append((code, error))
+            repaired = self.repairs.lookup(code, error, fingerprint, self.df.columns)
+            repaired = self._clean_code(repaired) if repaired else None
+            local_origin = (code, error) if repaired and repaired not in tried else None
+            if local_origin:
+                print(f"按本地修复记录改写（{error.type}）: {repaired}")
+                self.repair_stats['local'] += 1
+                self.tracer.count('repair', source='local')
+            else:
+                repaired = None
+                while repaired is None and requests < max_repairs:
+                    requests += 1
+                    print(f"{error.type}: {error.message}\n第{requests}次请求模型修复…")
+                    repaired = self._request_repair(instruction, code, error, model, related, on_progress)
+                    self.repair_stats['llm'] += 1
+                    self.tracer.count('repair', source='llm')
+                    if repaired in tried:
+                        repaired = None
+            if repaired is None:
+                self.repair_stats['failed'] += 1
+                self.tracer.count('repair', source='failed')
+                return None
+            tried.add(repaired)
+            code = repaired
+
+        if failures:
+            print(f"修复成功: {code}")
+            for failed, error in failures:
+                self.repairs.record(failed, error, fingerprint, code)
+            self.code_cache.put(instruction, fingerprint, code, namespace=model)
+        self.tracer.annotate(failures=len(failures), llm_repairs=requests)
         return code
 
-    def safe_execute(self, code):
+    def _request_repair(self, instruction, code, error, model, related=None, on_progress=None):
+        prompt = self.prompt_builder.build_repair(instruction, self.df, code, format_error(error), related)
+        try:
+            content = self._stream_completion(model, prompt, on_progress)
+        except Exception as e:
+            print(f"修复请求失败: {str(e)}")
+            return None
+        print()
+        repaired = self._extract_code(content)
+        return self.optimize_code(repaired) if repaired else None
+
+    def _dry_run(self, code, sample):
+        """在样例上试运行：结果必须是DataFrame且能还原原有列类型（样例过滤后为空是允许的）"""
+        try:
+            result = self._run_compact(code, sample.copy(deep=not COPY_ON_WRITE))
+        except Exception:
+            return False
+        return isinstance(result, pd.DataFrame) and self._restore_dtypes(result, sample, quiet=True)
+
+    @traced(name='llm_call')
+    def _stream_completion(self, model, prompt, on_progress=None, temperature=0.2):
+        """流式接收回复，一旦出现</code>就停止接收并取消剩余输出"""
+        start = time.perf_counter()
+        first_token = None
+        stream = self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": prompt}],
+            temperature=temperature,
+            stream=True
+        )
+        content, reasoning_chars = '', 0
+        try:
+            for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if first_token is None:
+                    first_token = time.perf_counter()
+                reasoning_chars += len(getattr(delta, 'reasoning_content', None) or '')
+                if delta.content:
+                    scan_from = max(0, len(content) - len('</code>'))
+                    content += delta.content
+                    if '</code>' in content[scan_from:]:
+                        break
+                if on_progress:
+                    on_progress(reasoning_chars, len(content))
+        finally:
+            stream.close()
+        # 收到</code>后提前断开，拿不到usage，token数按字符估算
+        self.tracer.annotate(
+            model=model, prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(content),
+            reasoning_chars=reasoning_chars, latency_ms=(time.perf_counter() - start) * 1000,
+            first_token_ms=(first_token - start) * 1000 if first_token else None,
+        )
+        return content
+
+    @traced()
+    def optimize_code(self, code, df=None):
+        """把逐行apply/map改写为向量化代码，并在样例上验证结果一致"""
+        if not code:
+            return code
+        rewritten, random_values = vectorize_code(code)
+        if not rewritten:
+            return code
+        sample = (self.df if df is None else df).head(VERIFY_ROWS)
+        if not verify_rewrite(code, rewritten, sample, self._run_code, random_values):
+            print("向量化改写未通过样例验证，保留原代码")
+            return code
+        print(f"已向量化改写: {rewritten}")
+        return rewritten
+
+    def _build_prompt(self, instruction, df=None, related=None):
+        return self.prompt_builder.build(instruction, self.df if df is None else df, related)
+
+    def _fingerprint(self, related=None):
+        # 按读取时的类型计算，是否启用压缩、压缩成什么类型不影响缓存命中
+        fingerprint = schema_digest(self._frame_schema())
+        for key, df in sorted((related or {}).items()):
+            fingerprint += f"|{key}:{schema_fingerprint(df)}"
+        return fingerprint
+
+    def _model_for(self, instruction):
+        return self.prompt_builder.choose_model(instruction, self.model) if self.route_models else self.model
+
+    def _extract_code(self, content):
+        code_match = re.search(r'<code>(.*?)</code>', content or '', re.DOTALL)
+        return self._clean_code(code_match.group(1).strip()) if code_match else None
+
+    def discard_cached_code(self, instruction):
+        self.code_cache.invalidate(instruction, self._fingerprint(self._related_sheets(instruction)),
+                                   namespace=self._model_for(instruction))
+
+    @traced()
+    def _clean_code(self, code):
+        result = validate_code(code)
+        if not result.ok:
+            print(f"代码校验未通过: {'; '.join(result.errors)}")
+            return None
+        for warning in result.warnings:
+            print(f"性能提示: {warning}")
+        return result.code
+
+    @traced(frame=True, profile=True)
+    def safe_execute(self, code, instruction=None):
+        self.last_error = None
         if not code:
             return False
             
+        if self.stream_source and not is_row_local(code):
+            print("流式模式仅支持逐行操作（过滤、列赋值、字符串处理等），该代码依赖整张表")
+            return False
+
         try:
-            local_vars = {'df': self.df.copy(deep=True)}
-            exec(compile(code, '<string>', 'exec'), self.safe_globals, local_vars)
-            
-            new_df = local_vars.get('df')
-            if not isinstance(new_df, pd.DataFrame) or new_df.empty:
+            start = time.perf_counter()
+            # 写时复制下浅拷贝即可回滚，未修改的列不会被复制
+            snapshot = self.df.copy(deep=not COPY_ON_WRITE)
+            copied = time.perf_counter()
+            new_df = self._run_compact(code, snapshot)
+            executed = time.perf_counter()
+            if not isinstance(new_df, pd.DataFrame) or (new_df.empty and self.plan is None):
                 print("无效的DataFrame结果")
+                kind = type(new_df).__name__
+                self.last_error = make_error('InvalidResult', "执行后df为空表" if kind == 'DataFrame'
+                                             else f"执行后df是{kind}而不是DataFrame")
                 return False
                 
-            # 修正类型检查逻辑
-            common_cols = new_df.columns.intersection(self.df.columns)
-            try:
-                new_df[common_cols] = new_df[common_cols].astype(self.df.dtypes[common_cols].to_dict())
-            except Exception as e:
-                print(f"类型转换警告: {str(e)}")
+            # 只对类型发生变化的列做还原，避免整表astype
+            self._restore_dtypes(new_df)
+            validated = time.perf_counter()
+            self.history.record(self.df, new_df, code)
+            self.recipe_log.record(self._log_key(), RecipeStep(self.sheet_name, instruction, code, self._frame_schema()))
+            self.last_timings = {
+                'snapshot': copied - start,
+                'execute': executed - copied,
+                'validate': validated - executed,
+                'history': time.perf_counter() - validated,
+            }
                 
-            self.df = new_df
+            self._commit_frame(new_df)
+            if self.plan is not None:
+                self.plan.add(code)
             print(f"执行成功，更新后数据：\n{self.df.head(3)}")
+            print("耗时：快照{snapshot:.1f}ms，执行{execute:.1f}ms，校验{validate:.1f}ms，记录历史{history:.1f}ms".format(
+                **{k: v * 1000 for k, v in self.last_timings.items()}))
+            self.tracer.annotate(**{f"{k}_ms": v * 1000 for k, v in self.last_timings.items()})
             return True
         except Exception as e:
             print(f"执行失败: {str(e)}")
+            self.last_error = describe_error(e, code)
+            return False
+
+    @traced(frame=True)
+    def undo(self):
+        previous, code = self.history.undo(self.df)
+        if previous is None:
+            print("没有可撤销的操作")
+            return False
+        self._commit_frame(previous)
+        self.recipe_log.undo(self._log_key())
+        if self.plan is not None:
+            self.plan.pop()
+        print(f"已撤销: {code}\n{self.df.head(3)}")
+        return True
+
+    @traced(frame=True)
+    def redo(self):
+        following, code = self.history.redo(self.df)
+        if following is None:
+            print("没有可重做的操作")
+            return False
+        self._commit_frame(following)
+        self.recipe_log.redo(self._log_key())
+        if self.plan is not None:
+            self.plan.add(code)
+        print(f"已重做: {code}\n{self.df.head(3)}")
+        return True
+
+    def _log_key(self):
+        return self.workbook.path if self.workbook else self.stream_source, self.sheet_name
+
+    def _frame_schema(self, sheet=None):
+        if self.workbook is None or sheet in (None, self.sheet_name):
+            return frame_schema(self.df, self._original_dtypes())
+        return frame_schema(self.workbook.get(sheet), self.workbook.original_dtypes(sheet))
+
+    def export_recipe(self, path):
+        """把当前工作簿上仍然生效的步骤（撤销的不算）连同表结构导出为配方文件"""
+        source = self._log_key()[0]
+        steps = self.recipe_log.for_source(source)
+        if not steps:
+            print("当前工作簿没有可导出的步骤")
+            return False
+        outputs = {sheet: self._frame_schema(sheet) for sheet in dict.fromkeys(step.sheet for step in steps)}
+        try:
+            save_recipe(build_recipe(steps, outputs, source), path)
+        except OSError as e:
+            print(f"导出配方失败: {str(e)}")
+            return False
+        print(f"已导出{len(steps)}个步骤到配方 {path}")
+        return True
+
+    @traced(frame=True)
+    def replay_recipe(self, recipe, codes=None):
+        """在当前工作簿上按顺序回放配方，不请求模型；先检查涉及的所有工作表的结构，不兼容时不执行任何步骤"""
+        try:
+            codes = codes or prepare_steps(recipe)
+        except RecipeError as e:
+            print(str(e))
+            return False
+        names = self.workbook.sheet_names if self.workbook else [self.sheet_name]
+        contracts = recipe['sheets']
+        targets = {}
+        for contract in contracts:
+            if contract['name'] in names:
+                targets[contract['name']] = contract['name']
+            elif len(contracts) == 1:
+                targets[contract['name']] = self.sheet_name  # 单表配方按当前工作表回放（新文件的表名可能不同）
+            else:
+                print(f"工作簿中没有配方用到的工作表: {contract['name']}")
+                return False
+        pandas_version = recipe.get('environment', {}).get('pandas', '')
+        if pandas_version.split('.')[0] != pd.__version__.split('.')[0]:
+            print(f"提示：配方在pandas {pandas_version}下导出，当前为{pd.__version__}")
+
+        compatible = True
+        for contract in contracts:
+            errors, notes = check_schema(contract, self._frame_schema(targets[contract['name']]))
+            for note in notes:
+                print(f"提示（{targets[contract['name']]}）: {note}")
+            for error in errors:
+                print(f"不兼容（{targets[contract['name']]}）: {error}")
+            compatible = compatible and not errors
+        if not compatible:
+            print("表结构与配方不兼容，未执行任何步骤")
+            return False
+
+        for i, (step, code) in enumerate(zip(recipe['steps'], codes), 1):
+            target = targets[step['sheet']]
+            if target != self.sheet_name and not self.switch_sheet(target):
+                return False
+            print(f"[{i}/{len(codes)}] {step.get('instruction') or code}")
+            if not self.safe_execute(code, step.get('instruction')):
+                print(f"第{i}步执行失败，回放中止")
+                return False
+        for contract in contracts:
+            for diff in compare_output(contract['output'], self._frame_schema(targets[contract['name']])):
+                print(f"提示：回放结果与导出时不同，{diff}")
+        print(f"配方回放完成，共{len(codes)}步")
+        return True
+
+    def _commit_frame(self, df):
+        self.df = df
+        if self.workbook is not None and self.plan is None:
+            self.workbook.update(self.sheet_name, df)
+
+    @traced(status=False)
+    def _restore_dtypes(self, new_df, reference=None, quiet=False):
+        """把类型发生变化的列还原为原类型，无法还原时返回False"""
+        reference = self.df if reference is None else reference
+        if new_df.columns.has_duplicates or reference.columns.has_duplicates:
+            return True
+        old_dtypes, new_dtypes = reference.dtypes, new_df.dtypes
+        changed = {c: old_dtypes[c] for c in new_df.columns.intersection(reference.columns)
+                   if new_dtypes[c] != old_dtypes[c]}
+        self.tracer.annotate(columns=len(changed))
+        if not changed:
+            return True
+        originals = self._original_dtypes()
+        try:
+            # 压缩过的列不直接转回压缩类型（新值不在category中会变成缺失值），先还原为原类型再重新压缩
+            for c in [c for c in changed if c in originals]:
+                new_df[c] = restore_compact(new_df[c], originals[c])
+                del changed[c]
+            if changed:
+                new_df[list(changed)] = new_df[list(changed)].astype(changed)
+            return True
+        except Exception as e:
+            if not quiet:
+                print(f"类型转换警告: {str(e)}")
             return False
 
+    def _run_code(self, code, df):
+        if self.shard_pool is not None and isinstance(code, str) and len(df) >= PARALLEL_MIN_ROWS:
+            plan = shard_plan(code)
+            if plan is not None:
+                try:
+                    result = run_sharded(self.shard_pool, code, df, plan, self.shards)
+                    self.tracer.annotate(shards=self.shards, pruned=plan.columns is not None)
+                    return result
+                except SandboxTimeout:
+                    raise
+                except Exception:
+                    pass  # 分块执行失败（如某块中缺少代码假定存在的取值）时整表重新执行一次
+        # 启用子进程沙箱时在子进程中执行；读取其他工作表的代码依赖主进程数据，仍在本进程执行
+        if self.sandbox is not None and not _uses_sheets(code):
+            return self.sandbox.run(code, df)
+        local_vars = {'df': df}
+        if isinstance(code, str):
+            code = compile_code(code)
+        exec(code, self.safe_globals, local_vars)
+        return local_vars.get('df')
+
+    def _run_compact(self, code, df):
+        """下转换过的整数列先还原为原类型再执行；压缩后的类型不支持的操作
+        （如category列做字符串拼接、写入新类别）会报错，此时在还原为原类型的数据上重试一次。
+        代码可能在报错前已原地修改了df，两次执行各用一份副本，重试基于未改动的输入"""
+        originals = self._original_dtypes()
+        try:
+            return self._run_code(code, widen_ints(df, originals).copy(deep=not COPY_ON_WRITE))
+        except SandboxTimeout:
+            raise
+        except Exception:
+            expanded = expand_frame(df, originals)
+            if expanded is df:
+                raise
+            return self._run_code(code, expanded.copy(deep=not COPY_ON_WRITE))
+
+    def _run_plan(self, df):
+        try:
+            fused = widen_ints(df, self._original_dtypes()).copy(deep=not COPY_ON_WRITE)
+            return self._run_code(self.plan.compile(), fused)
+        except Exception:
+            # 融合后的代码失败时退回逐条执行；融合执行在副本上进行，失败前已执行的步骤不会留在df中
+            for code in self.plan.steps:
+                df = self._run_compact(code, df)
+            return df
+
+    @traced(frame=True)
+    def _materialize(self):
+        start = time.perf_counter()
+        result = self._run_plan(self.deferred_df.copy(deep=not COPY_ON_WRITE))
+        self._restore_dtypes(result)
+        print(f"已融合执行{len(self.plan)}条指令，耗时{(time.perf_counter() - start) * 1000:.1f}ms")
+        self.deferred_df, self.plan = None, None
+        self._commit_frame(result)
+        self.history.clear()
+
+    def _save_streaming(self, output_path):
+        writer = StreamingWriter(output_path)
+        for chunk in iter_excel_chunks(self.stream_source, self.chunksize, self.sheet_name):
+            chunk.columns = self._standardize_columns(chunk.columns)
+            writer.append(self._run_plan(chunk))
+        writer.save()
+        return writer.rows
+
+    @traced()
     def save_excel(self, output_path):
         try:
-            self.df.to_excel(output_path, index=False, engine='openpyxl')
-            print(f"文件已保存到 {output_path}")
+            if self.stream_source:
+                rows = self._save_streaming(output_path)
+                print(f"文件已流式保存到 {output_path}，共{rows}行")
+                return True
+            if self.deferred_df is not None:
+                self._materialize()
+            report = self.workbook.save(output_path)
+            self.tracer.annotate(mode=report.mode, cells=report.cells, bytes=report.bytes)
+            self.print_save_report(output_path, report)
             return True
         except Exception as e:
             print(f"保存失败: {str(e)}")
             return False
 
+    @staticmethod
+    def print_save_report(output_path, report):
+        if report.mode == 'none':
+            print("没有修改，无需保存")
+            return
+        if report.mode == 'copy':
+            print(f"没有修改，已复制原文件到 {output_path}")
+            return
+        mode = "增量回写" if report.mode == 'patch' else "整表重写"
+        print(f"文件已保存到 {output_path}（{mode}，工作表：{', '.join(report.sheets)}）："
+              f"写入{report.cells}个单元格，{report.bytes / 1024:.1f}KB，耗时{report.seconds:.2f}秒")
+        if report.reason:
+            print(f"未使用增量回写的原因：{report.reason}")
+
 if __name__ == "__main__":
-    processor = ExcelAIProcessor()
-    
+    parser = argparse.ArgumentParser(description="使用自然语言指令处理Excel")
+    parser.add_argument('--chunksize', type=int, default=None, help="流式模式：按块读取和写出超大工作表")
+    parser.add_argument('--lazy', action='store_true', help="延迟模式：指令先在样例上预览，保存时融合执行")
+    parser.add_argument('--trace', help="把各阶段耗时、token数、内存变化以JSON行追加写入该文件")
+    parser.add_argument('--metrics', help="把汇总指标以Prometheus文本格式写入该文件")
+    parser.add_argument('--profile', nargs='?', const='safe_execute.prof',
+                        help="对safe_execute做cProfile，结束时写入该文件并打印耗时最多的函数")
+    parser.add_argument('--candidates', type=int, default=1,
+                        help="并行请求N个候选代码，在样例上试运行后采用第一个通过的")
+    parser.add_argument('--compact', action='store_true',
+                        help="读取后压缩内存：低基数字符串转category、字符串使用Arrow存储、整数下转换")
+    parser.add_argument('--repair', type=int, default=2,
+                        help="执行失败时最多请求模型修复的次数（0为不修复，本地修复记录仍会使用）")
+    parser.add_argument('--sandbox', type=int, nargs='?', const=2, default=0,
+                        help="在预先启动的N个子进程中执行生成的代码（默认2个）")
+    parser.add_argument('--timeout', type=float, default=30.0, help="沙箱中单次执行的超时时间（秒）")
+    parser.add_argument('--memory-limit', type=int, default=4096, help="沙箱子进程可额外使用的内存（MB）")
+    parser.add_argument('--parallel', type=int, nargs='?', const=default_shards(), default=0,
+                        help=f"超过{PARALLEL_MIN_ROWS}行时把逐行运算按行分块，在N个子进程中并行执行（默认CPU核数）")
+    parser.add_argument('--replay', help="读取文件后按配方回放已导出的步骤（不请求模型），之后可继续输入指令")
+    args = parser.parse_args()
+
+    sinks = []
+    if args.trace:
+        sinks.append(JsonLogSink(args.trace))
+    if args.metrics:
+        sinks.append(PrometheusSink(args.metrics))
+    processor = ExcelAIProcessor(tracer=Tracer(sinks))
+    processor.compact = args.compact
+    if args.sandbox:
+        processor.sandbox = SandboxPool(args.sandbox, timeout=args.timeout, memory_mb=args.memory_limit)
+    if args.parallel > 1:
+        processor.shard_pool = SandboxPool(args.parallel, timeout=args.timeout, memory_mb=args.memory_limit)
+        processor.shards = args.parallel
+    if args.profile:
+        import cProfile
+        processor.profiler = cProfile.Profile()
+    # 等待输入文件路径时在后台导入openai，第一条指令请求模型时无需再等待
+    preload('openai')
+
+    recipe = codes = None
+    if args.replay:
+        # 读取数据前先校验、编译配方中的全部代码
+        try:
+            recipe = load_recipe(args.replay)
+            codes = prepare_steps(recipe)
+        except RecipeError as e:
+            print(str(e))
+            exit(1)
+
     input_file = input("请输入Excel文件路径: ").strip()
-    if not processor.read_excel(input_file):
+    if not processor.read_excel(input_file, chunksize=args.chunksize, deferred=args.lazy):
         exit()
+    if recipe is not None:
+        processor.replay_recipe(recipe, codes)
+
+    def show_progress(reasoning_chars, content_chars):
+        print(f"\r模型思考中… 推理{reasoning_chars}字，输出{content_chars}字", end='', flush=True)
 
     while True:
-        instruction = input("\n操作指令（输入'save'保存）: ").strip()
+        instruction = input("\n操作指令（输入'save'保存，'undo'撤销，'redo'重做，'sheets'列出工作表，"
+                            "'sheet 表名'切换，'open 路径'打开其他工作簿，'export 路径'导出配方）: ").strip()
         if instruction.lower() == 'save':
             break
+        if instruction.lower() in ('undo', 'redo'):
+            getattr(processor, instruction.lower())()
+            continue
+        if instruction.lower() == 'sheets':
+            processor.list_sheets()
+            continue
+        if instruction.lower().startswith('sheet '):
+            processor.switch_sheet(instruction[6:].strip())
+            continue
+        if instruction.lower().startswith('open '):
+            processor.read_excel(instruction[5:].strip())
+            continue
+        if instruction.lower().startswith('export '):
+            processor.export_recipe(instruction[7:].strip())
+            continue
             
-        if code := processor.generate_pandas_code(instruction):
+        started = time.perf_counter()
+        if args.candidates > 1:
+            code = processor.speculative_execute(instruction, args.candidates, on_progress=show_progress)
+            print(f"\r{'已采用' if code else '未能执行'}，总耗时{time.perf_counter() - started:.1f}秒" + ' ' * 20)
+            continue
+        code = processor.generate_pandas_code(instruction, on_progress=show_progress)
+        print(f"\r代码生成耗时{time.perf_counter() - started:.1f}秒" + ' ' * 20)
+        if code:
             print(f"生成代码: {code}")
-            processor.safe_execute(code) or print("失败建议：请使用标准化后的列名")
+            if not processor.execute_with_repair(instruction, code, args.repair, on_progress=show_progress):
+                processor.discard_cached_code(instruction)
+                print("失败建议：请使用标准化后的列名")
         else:
             print("代码生成失败")
 
-    output_file = input("保存路径（直接回车覆盖原文件）: ").strip() or input_file
-    processor.save_excel(output_file)
\ No newline at end of file
+    current_file = processor.workbook.path if processor.workbook else input_file
+    output_file = input("保存路径（直接回车覆盖原文件）: ").strip() or current_file
+    processor.save_excel(output_file)
+    for workbook in processor.workbooks.values():
+        if workbook is not processor.workbook and workbook.dirty:
+            if input(f"工作簿 {workbook.name} 有未保存的修改，是否保存？(y/n): ").strip().lower() == 'y':
+                processor.print_save_report(workbook.path, workbook.save())
+    stats = processor.code_cache.stats()
+    print(f"代码缓存：命中{stats['hits']}次，未命中{stats['misses']}次，命中率{stats['hit_rate']:.0%}")
+    processor.tracer.gauge('code_cache_hit_rate', stats['hit_rate'])
+    stats = processor.intent_matcher.stats()
+    print(f"本地规则：命中{stats['hits']}次，共{stats['attempts']}条指令，命中率{stats['hit_rate']:.0%}")
+    processor.tracer.gauge('intent_matcher_hit_rate', stats['hit_rate'])
+    stats = processor.repair_stats
+    if any(stats.values()):
+        print(f"自动修复：本地修复{stats['local']}次，请求模型{stats['llm']}次，未能修复{stats['failed']}次")
+    processor.tracer.close()
+    if processor.sandbox is not None:
+        processor.sandbox.close()
+    if processor.shard_pool is not None:
+        processor.shard_pool.close()
+    if processor.profiler is not None and processor.profiler.getstats():
+        processor.profiler.dump_stats(args.profile)
+        print(f"safe_execute性能分析已写入 {args.profile}，耗时最多的函数：")
+        import pstats
+        pstats.Stats(processor.profiler).sort_stats('cumulative').print_stats(15)
\ No newline at end of file
@@ -0,0 +1,91 @@
+import ast
+import os
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from streaming import is_row_local
+
+# 行数较少时序列化到子进程的开销超过并行的收益
+PARALLEL_MIN_ROWS = 50000
+
+# columns为None时每个分块包含整张表；否则只传入代码读写的列，结果只写回assigned中的列
+ShardPlan = namedtuple('ShardPlan', ['columns', 'assigned'])
+
+
+def default_shards():
+    return max(1, min(os.cpu_count() or 1, 32))
+
+
+def _string_keys(node):
+    """df['a'] / df[['a', 'b']] 中的列名；不是字符串常量时返回None"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, (ast.List, ast.Tuple)) and node.elts and all(
+            isinstance(e, ast.Constant) and isinstance(e.value, str) for e in node.elts):
+        return [e.value for e in node.elts]
+    return None
+
+
+def _column_usage(tree):
+    """代码只通过 df['列名'] 读写时返回 (用到的列, 被赋值的列)，否则返回 (None, None)"""
+    parents = {id(child): node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    columns, assigned = [], []
+    for node in ast.walk(tree):
+        if not (isinstance(node, ast.Name) and node.id == 'df'):
+            continue
+        parent = parents.get(id(node))
+        keys = _string_keys(parent.slice) if isinstance(parent, ast.Subscript) and parent.value is node else None
+        if keys is None:
+            return None, None
+        columns.extend(k for k in keys if k not in columns)
+        if isinstance(parent.ctx, ast.Store):
+            assigned.extend(k for k in keys if k not in assigned)
+    return columns, assigned
+
+
+# 在Python层逐个元素执行的运算；纯向量化运算本身很快，分块只会增加序列化开销
+ELEMENTWISE_CALLS = {'apply', 'map', 'applymap', 'transform', 'agg', 'aggregate'}
+
+
+def _elementwise(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp, ast.For)):
+            return True
+        if isinstance(node, ast.Attribute) and node.attr == 'str':
+            return True
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr in ELEMENTWISE_CALLS:
+            return True
+    return False
+
+
+def shard_plan(code):
+    """逐行/逐列的局部运算可以按行分块并行执行，返回ShardPlan；依赖整张表的代码返回None"""
+    if not isinstance(code, str) or not is_row_local(code):
+        return None
+    tree = ast.parse(code)
+    if not _elementwise(tree):
+        return None
+    # 是否可以分块与流式模式共用同一份白名单（is_row_local），这里只排除依赖主进程数据的代码
+    if any(isinstance(node, ast.Name) and node.id == 'sheets' for node in ast.walk(tree)):
+        return None
+    columns, assigned = _column_usage(tree)
+    return ShardPlan(columns, assigned)
+
+
+def run_sharded(pool, code, df, plan, shards):
+    """把df按行切成shards块，在进程池中并行执行同一段代码后按原顺序拼接"""
+    source = df if plan.columns is None else df[[c for c in plan.columns if c in df.columns]]
+    bounds = np.linspace(0, len(source), shards + 1, dtype=int)
+    pieces = [source.iloc[start:stop] for start, stop in zip(bounds, bounds[1:]) if stop > start]
+    with ThreadPoolExecutor(max_workers=len(pieces)) as executor:
+        results = list(executor.map(lambda piece: pool.run(code, piece), pieces))
+    combined = pd.concat(results)
+    if plan.columns is None:
+        return combined
+    result = df.copy(deep=False)
+    for name in plan.assigned:
+        result[name] = combined[name]
+    return result
@@ -0,0 +1,92 @@
+import ast
+
+from streaming import is_row_local
+
+MASK_METHODS = {'isin', 'notna', 'notnull', 'isna', 'isnull', 'between', 'contains', 'startswith',
+                'endswith', 'match', 'fullmatch', 'eq', 'ne', 'lt', 'gt', 'le', 'ge'}
+
+
+def _is_mask(node):
+    if isinstance(node, ast.BinOp):
+        return isinstance(node.op, (ast.BitAnd, ast.BitOr)) and _is_mask(node.left) and _is_mask(node.right)
+    if isinstance(node, ast.UnaryOp):
+        return isinstance(node.op, ast.Invert) and _is_mask(node.operand)
+    if isinstance(node, ast.Call):
+        return isinstance(node.func, ast.Attribute) and node.func.attr in MASK_METHODS
+    return isinstance(node, ast.Compare)
+
+
+def _as_filter(stmt):
+    """识别 df = df[mask] / df = df.loc[mask] / df = df.query('...')，返回 (类型, 条件节点)"""
+    if not (isinstance(stmt, ast.Assign) and len(stmt.targets) == 1
+            and isinstance(stmt.targets[0], ast.Name) and stmt.targets[0].id == 'df'):
+        return None
+    value = stmt.value
+    if isinstance(value, ast.Subscript):
+        target = value.value
+        is_df = isinstance(target, ast.Name) and target.id == 'df'
+        is_loc = (isinstance(target, ast.Attribute) and target.attr == 'loc'
+                  and isinstance(target.value, ast.Name) and target.value.id == 'df')
+        if (is_df or is_loc) and _is_mask(value.slice):
+            return 'mask', value.slice
+    if (isinstance(value, ast.Call) and isinstance(value.func, ast.Attribute) and value.func.attr == 'query'
+            and isinstance(value.func.value, ast.Name) and value.func.value.id == 'df'
+            and len(value.args) == 1 and not value.keywords
+            and isinstance(value.args[0], ast.Constant) and isinstance(value.args[0].value, str)
+            and '@' not in value.args[0].value):
+        return 'query', value.args[0].value
+    return None
+
+
+class LazyPlan:
+    """延迟执行计划：收集已验证的代码片段，保存时融合为一次执行"""
+
+    def __init__(self):
+        self.steps = []
+        self._compiled = None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, code):
+        self.steps.append(code)
+        self._compiled = None
+
+    def pop(self):
+        self._compiled = None
+        return self.steps.pop() if self.steps else None
+
+    def fuse(self):
+        """把相邻的逐行过滤合并为一个布尔掩码/query，其余语句原样串联"""
+        fused = []
+        pending = None  # (类型, [条件...])
+        for code in self.steps:
+            tree = ast.parse(code)
+            filt = _as_filter(tree.body[0]) if len(tree.body) == 1 and is_row_local(code) else None
+            if filt and pending and pending[0] == filt[0]:
+                pending[1].append(filt[1])
+                continue
+            if pending:
+                fused.append(self._render_filter(*pending))
+                pending = None
+            if filt:
+                pending = (filt[0], [filt[1]])
+            else:
+                fused.append(code)
+        if pending:
+            fused.append(self._render_filter(*pending))
+        return '\n'.join(fused)
+
+    @staticmethod
+    def _render_filter(kind, conditions):
+        if kind == 'query':
+            return f"df = df.query({' and '.join(f'({c})' for c in conditions)!r})"
+        mask = conditions[0]
+        for cond in conditions[1:]:
+            mask = ast.BinOp(left=mask, op=ast.BitAnd(), right=cond)
+        return f"df = df[{ast.unparse(mask)}]"
+
+    def compile(self):
+        if self._compiled is None:
+            self._compiled = compile(self.fuse(), '<plan>', 'exec')
+        return self._compiled
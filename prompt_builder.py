@@ -0,0 +1,166 @@
+import difflib
+import os
+import re
+import weakref
+from collections import OrderedDict, namedtuple
+
+from code_cache import schema_fingerprint
+
+MAIN_MODEL = os.getenv("EXCEL_AI_MODEL", "deepseek-r1")
+FAST_MODEL = os.getenv("EXCEL_AI_FAST_MODEL", "qwen-turbo")
+
+SUMMARY_ROWS = 10000
+SIMPLE_VERBS = re.compile(r'(删除|删掉|去掉|去除|重命名|改名|排序|筛选|过滤|保留|新增|添加|增加|填充|替换|大写|小写|'
+                          r'\b(?:drop|delete|rename|sort|filter|keep|add|fill|replace)\b)', re.IGNORECASE)
+COMPLEX_MARKERS = re.compile(r'(然后|接着|并且|同时|分组|汇总|统计|透视|合并|关联|每个|每组|如果|否则|累计|排名|'
+                             r'\b(?:group|pivot|merge|join|if|then|rank)\b)', re.IGNORECASE)
+
+ColumnSummary = namedtuple('ColumnSummary', ['name', 'dtype', 'nunique', 'samples'])
+
+REQUIREMENTS = """要求：
+1. 必须使用上述标准列名列表中的准确列名
+2. 生成单行Python代码，使用df变量操作DataFrame
+3. 删除列操作必须明确指定列名，格式：df.drop(columns=[列名1, 列名2])
+4. 兼容Pandas >=1.0版本语法
+5. 如果要生成随机数，则必须使用random模块生成随机值（如random.randint）
+6. 禁止直接import random模块（已预注入）
+7. 返回格式：<code>你的代码</code>"""
+QUOTED = re.compile(r'''['"]([^'"\n]{1,60})['"]''')
+
+
+def estimate_tokens(text):
+    """粗略估算token数：中日韩字符按1个，其余按4个字符1个"""
+    cjk = len(re.findall(r'[⺀-鿿가-힯＀-￯]', text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def _name_chars(name):
+    return {c for c in str(name).lower() if c.isalnum()}
+
+
+class PromptBuilder:
+    """按表结构缓存列摘要，只向模型发送与指令相关的列，并控制prompt的token预算"""
+
+    def __init__(self, token_budget=1200, max_relevant=12, sample_values=3, max_schemas=64):
+        self.token_budget = token_budget
+        self.max_relevant = max_relevant
+        self.sample_values = sample_values
+        self.max_schemas = max_schemas
+        self._summaries = OrderedDict()
+
+    def summarize(self, df):
+        """列摘要按DataFrame对象缓存：执行代码后得到的是新对象，结构相同的其他工作簿也不会共用样例值"""
+        key = (id(df), schema_fingerprint(df))
+        entry = self._summaries.get(key)
+        if entry is not None and entry[0]() is df:
+            self._summaries.move_to_end(key)
+            return entry[1]
+        sample = df.head(SUMMARY_ROWS)
+        summaries = []
+        for i, name in enumerate(df.columns):
+            column = sample.iloc[:, i]
+            values = column.dropna().drop_duplicates().head(self.sample_values)
+            summaries.append(ColumnSummary(
+                name=str(name),
+                dtype=str(column.dtype),
+                nunique=int(column.nunique()),
+                samples=tuple(str(v)[:20] for v in values),
+            ))
+        self._summaries[key] = (weakref.ref(df), summaries)
+        if len(self._summaries) > self.max_schemas:
+            self._summaries.popitem(last=False)
+        return summaries
+
+    def relevant_columns(self, instruction, summaries):
+        """按列名在指令中的出现程度打分，返回最相关的若干列"""
+        text = instruction.lower()
+        text_chars = _name_chars(text)
+        scored = []
+        for position, summary in enumerate(summaries):
+            name = summary.name.lower()
+            plain = name.strip('_').replace('_', '')
+            chars = _name_chars(name)
+            if name in text or (plain and plain in text.replace(' ', '')):
+                score = 10
+            elif chars:
+                score = 5 * len(chars & text_chars) / len(chars)
+                if score < 3:
+                    score = 0
+            else:
+                score = 0
+            if score:
+                scored.append((-score, position, summary))
+        scored.sort(key=lambda item: item[:2])
+        return [summary for _, _, summary in scored[:self.max_relevant]]
+
+    def build(self, instruction, df, related=None):
+        summaries = self.summarize(df)
+        relevant = self.relevant_columns(instruction, summaries)
+        if not relevant:
+            relevant = summaries[:self.max_relevant]
+
+        footer = f"\n请将以下自然语言指令转换为安全的Pandas代码：\n指令：{instruction}\n\n{REQUIREMENTS}"
+        return self._schema_prompt(df, summaries, relevant, footer, related)
+
+    def build_repair(self, instruction, df, code, error, related=None):
+        """代码执行失败后的修复prompt：错误信息、原代码，以及代码/错误中引用的列和与之相近的列"""
+        summaries = self.summarize(df)
+        names = [s.name for s in summaries]
+        wanted = []
+        for literal in QUOTED.findall(f"{code}\n{error}"):
+            matches = [literal] if literal in names else difflib.get_close_matches(literal, names, n=3, cutoff=0.5)
+            wanted.extend(m for m in matches if m not in wanted)
+        relevant = [s for s in summaries if s.name in wanted]
+        relevant += [s for s in self.relevant_columns(instruction, summaries) if s.name not in wanted]
+        footer = (f"\n以下代码执行失败，请修正：\n指令：{instruction}\n代码：{code}\n错误：\n{error}\n\n"
+                  f"{REQUIREMENTS}")
+        return self._schema_prompt(df, summaries, relevant[:self.max_relevant] or summaries[:self.max_relevant],
+                                   footer, related)
+
+    def _schema_prompt(self, df, summaries, relevant, footer, related):
+        header = f"当前DataFrame共{len(df)}行{len(summaries)}列。\n"
+        budget = self.token_budget - estimate_tokens(header + footer)
+
+        lines = ["相关列（列名: 类型, 不同值个数, 样例值）："]
+        for summary in relevant:
+            line = f"- {summary.name}: {summary.dtype}, {summary.nunique}, {' | '.join(summary.samples)}"
+            if estimate_tokens('\n'.join(lines + [line])) > budget // 2:
+                break
+            lines.append(line)
+        details = '\n'.join(lines)
+
+        names = [s.name for s in summaries]
+        remaining = budget - estimate_tokens(details) - 20
+        listed = []
+        for name in names:
+            remaining -= estimate_tokens(name + ', ')
+            if remaining < 0:
+                break
+            listed.append(name)
+        column_list = ', '.join(listed)
+        if len(listed) < len(names):
+            column_list += f" 等共{len(names)}列"
+        return f"{header}{details}\n\n当前标准列名列表：{column_list}\n{self._related_block(related)}{footer}"
+
+    def _related_block(self, related):
+        """指令涉及的其他工作表：只列出列名，代码中通过 sheets['表名'] 只读访问"""
+        if not related:
+            return ''
+        lines = ["\n指令涉及的其他工作表（在代码中用 sheets['表名'] 读取，只能修改df）："]
+        for key, other in related.items():
+            names = [s.name for s in self.summarize(other)]
+            shown = ', '.join(names[:self.max_relevant])
+            if len(names) > self.max_relevant:
+                shown += f" 等共{len(names)}列"
+            lines.append(f"- sheets[{key!r}]：{len(other)}行，列：{shown}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def choose_model(instruction, main_model=MAIN_MODEL, fast_model=FAST_MODEL):
+        """简单的单步指令交给更小更快的模型，其余使用推理模型"""
+        if not fast_model:
+            return main_model
+        simple = (len(instruction) <= 40 and SIMPLE_VERBS.search(instruction)
+                  and not COMPLEX_MARKERS.search(instruction)
+                  and len(re.findall(r'[，,；;。]', instruction)) == 0)
+        return fast_model if simple else main_model
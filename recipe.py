@@ -0,0 +1,172 @@
+import ast
+import hashlib
+import json
+import os
+import platform
+import time
+from collections import namedtuple
+
+import pandas as pd
+
+from code_validator import compile_code, validate_code
+
+RECIPE_FORMAT = 'excel-ai-recipe'
+RECIPE_VERSION = 1
+
+# schema为执行该步之前的表结构 [[列名, 类型], ...]
+RecipeStep = namedtuple('RecipeStep', ['sheet', 'instruction', 'code', 'schema'])
+
+
+class RecipeError(ValueError):
+    """配方文件格式错误、版本不支持或代码未通过校验"""
+
+
+def frame_schema(df, originals=None):
+    """[[列名, 类型], ...]；压缩过的列记录读取时的原类型，是否启用压缩不影响配方"""
+    originals = originals or {}
+    return [[str(name), str(originals.get(name, dtype))] for name, dtype in df.dtypes.items()]
+
+
+def schema_digest(schema):
+    """与code_cache.schema_fingerprint的计算方式一致"""
+    return hashlib.sha256(json.dumps(schema, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def dtype_family(dtype):
+    """类型大类；整数与浮点同属number（新数据中出现缺失值时整数列会读成浮点）"""
+    name = str(dtype)
+    if name in ('bool', 'boolean'):
+        return 'bool'
+    if name.lower().startswith(('int', 'uint', 'float')):
+        return 'number'
+    if name.startswith('datetime64'):
+        return 'datetime'
+    if name.startswith('timedelta64'):
+        return 'timedelta'
+    if name in ('object', 'str', 'category') or name.startswith('string'):
+        return 'text'
+    return name
+
+
+def referenced_columns(codes, columns):
+    """代码中以字符串常量出现的列名，回放时这些列必须存在"""
+    names = set()
+    for code in codes:
+        names.update(node.value for node in ast.walk(ast.parse(code))
+                     if isinstance(node, ast.Constant) and isinstance(node.value, str))
+    return [c for c in columns if c in names]
+
+
+class RecipeLog:
+    """会话中执行成功的步骤，随各工作表的撤销/重做同步增减，用于导出配方；key为(工作簿路径, 工作表)"""
+
+    def __init__(self):
+        self.steps = []
+        self.undone = {}
+
+    def record(self, key, step):
+        self.steps.append((key, step))
+        self.undone.pop(key, None)
+
+    def undo(self, key):
+        for i in range(len(self.steps) - 1, -1, -1):
+            if self.steps[i][0] == key:
+                self.undone.setdefault(key, []).append(self.steps.pop(i)[1])
+                return
+
+    def redo(self, key):
+        if self.undone.get(key):
+            self.steps.append((key, self.undone[key].pop()))
+
+    def for_source(self, source):
+        return [step for (path, _), step in self.steps if path == source]
+
+
+def build_recipe(steps, outputs, source=None):
+    """steps: 按执行顺序的RecipeStep；outputs: {工作表: 执行后的表结构}"""
+    codes = [step.code for step in steps]
+    sheets = {}
+    for step in steps:
+        if step.sheet not in sheets:
+            sheets[step.sheet] = {
+                'name': step.sheet,
+                'fingerprint': schema_digest(step.schema),
+                'input': step.schema,
+                'required': referenced_columns(codes, [name for name, _ in step.schema]),
+                'output': outputs[step.sheet],
+            }
+    return {
+        'format': RECIPE_FORMAT,
+        'version': RECIPE_VERSION,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'source': os.path.basename(source) if source else None,
+        'environment': {'python': platform.python_version(), 'pandas': pd.__version__},
+        'sheets': list(sheets.values()),
+        'steps': [{'sheet': step.sheet, 'instruction': step.instruction, 'code': step.code} for step in steps],
+    }
+
+
+def save_recipe(recipe, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(recipe, f, ensure_ascii=False, indent=2)
+
+
+def load_recipe(path):
+    """读取并检查配方结构；比当前程序新的版本无法回放"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            recipe = json.load(f)
+    except (OSError, ValueError) as e:
+        raise RecipeError(f"无法读取配方 {path}: {e}")
+    if not isinstance(recipe, dict) or recipe.get('format') != RECIPE_FORMAT:
+        raise RecipeError(f"{path} 不是配方文件")
+    version = recipe.get('version')
+    if not isinstance(version, int) or version > RECIPE_VERSION:
+        raise RecipeError(f"不支持的配方版本{version}（当前程序支持到{RECIPE_VERSION}）")
+    sheets = {sheet.get('name') for sheet in recipe.get('sheets') or []}
+    steps = recipe.get('steps')
+    if not steps or any(not isinstance(step.get('code'), str) or step.get('sheet') not in sheets for step in steps):
+        raise RecipeError(f"配方 {path} 的步骤不完整")
+    return recipe
+
+
+def prepare_steps(recipe):
+    """回放前统一校验并编译所有步骤，任何一步不合法都在读取数据之前报错；
+    编译结果按源码缓存（compile_code），回放多个文件时不再重复编译"""
+    codes = []
+    for i, step in enumerate(recipe['steps'], 1):
+        result = validate_code(step['code'])
+        if not result.ok:
+            raise RecipeError(f"第{i}步代码未通过校验: {'; '.join(result.errors)}")
+        compile_code(result.code)
+        codes.append(result.code)
+    return codes
+
+
+def check_schema(contract, schema):
+    """回放前的结构兼容性检查，返回 (错误, 提示)：代码引用的列缺失或类型大类不同为错误，其余差异只提示"""
+    if schema_digest(schema) == contract['fingerprint']:
+        return [], []
+    errors, notes = [], []
+    current, expected = dict(schema), dict(contract['input'])
+    required = set(contract.get('required', ()))
+    for name, dtype in contract['input']:
+        target = errors if name in required else notes
+        if name not in current:
+            target.append(f"缺少列 {name}")
+        elif dtype_family(current[name]) != dtype_family(dtype):
+            target.append(f"列 {name} 的类型为{current[name]}，配方要求{dtype}")
+    extra = [name for name in current if name not in expected]
+    if extra:
+        notes.append(f"新增列 {', '.join(extra)}")
+    return errors, notes
+
+
+def compare_output(expected, schema):
+    """回放结果与导出时记录的输出结构的差异"""
+    current, before = dict(schema), dict(expected)
+    diffs = [f"缺少列 {name}" for name in before if name not in current]
+    diffs += [f"多出列 {name}" for name in current if name not in before]
+    diffs += [f"列 {name} 的类型为{current[name]}，导出时为{dtype}" for name, dtype in before.items()
+              if name in current and dtype_family(current[name]) != dtype_family(dtype)]
+    return diffs
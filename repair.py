@@ -0,0 +1,147 @@
+import ast
+import hashlib
+import io
+import json
+import re
+import tokenize
+import traceback
+from collections import namedtuple
+
+from sandbox_pool import SandboxError
+
+SNIPPET_FILES = ('<string>', '<sandbox>')
+MAX_MESSAGE = 300
+# 修复记录存入代码缓存时使用的命名空间
+RULE_NAMESPACE = 'repair:rule'
+CODE_NAMESPACE = 'repair:code'
+
+ErrorInfo = namedtuple('ErrorInfo', ['type', 'message', 'line', 'signature'])
+
+
+def describe_error(exc, code):
+    """把异常压缩为：错误类型、消息、出错的代码行（不含pandas内部调用栈）"""
+    if isinstance(exc, SandboxError):
+        # 子进程只返回 "类型: 消息" 文本
+        m = re.match(r'(\w+): (.*)', str(exc), re.S)
+        kind, message = (m.group(1), m.group(2)) if m else (type(exc).__name__, str(exc))
+    else:
+        kind, message = type(exc).__name__, str(exc)
+    line = None
+    frames = [f for f in traceback.extract_tb(exc.__traceback__) if f.filename in SNIPPET_FILES]
+    if frames and isinstance(code, str):
+        lines = code.splitlines()
+        if 0 < frames[-1].lineno <= len(lines):
+            line = lines[frames[-1].lineno - 1].strip()
+    return make_error(kind, message, line)
+
+
+def make_error(kind, message, line=None):
+    message = message.strip()[:MAX_MESSAGE]
+    # 数字与内存地址因数据而异，不参与签名；引号内的列名保留
+    normalized = re.sub(r'0x[0-9a-fA-F]+|\b\d+\b', 'N', message)
+    signature = hashlib.sha256(f"{kind}\x1f{normalized}".encode('utf-8')).hexdigest()[:16]
+    return ErrorInfo(kind, message, line, signature)
+
+
+def format_error(error):
+    """发送给模型的紧凑错误描述"""
+    text = f"{error.type}: {error.message}"
+    return f"出错代码行: {error.line}\n{text}" if error.line else text
+
+
+def _tokens(code):
+    try:
+        return [(t.type, t.string) for t in tokenize.generate_tokens(io.StringIO(code).readline)
+                if t.type not in (tokenize.NL, tokenize.NEWLINE, tokenize.COMMENT, tokenize.ENDMARKER)]
+    except (tokenize.TokenError, IndentationError, SyntaxError):
+        return None
+
+
+def literal_substitutions(failed, repaired):
+    """修复只改动了字符串常量（如写错的列名）时返回 [(旧常量, 新常量)]，否则返回None"""
+    before, after = _tokens(failed), _tokens(repaired)
+    if not before or not after or len(before) != len(after):
+        return None
+    substitutions = []
+    for (kind, old), (new_kind, new) in zip(before, after):
+        if kind != new_kind:
+            return None
+        if old == new:
+            continue
+        if kind != tokenize.STRING:
+            return None
+        if (old, new) not in substitutions:
+            substitutions.append((old, new))
+    return substitutions or None
+
+
+def apply_substitutions(code, substitutions):
+    """按记录的常量替换改写代码；代码中不含这些常量时返回None"""
+    tokens = _tokens(code)
+    if not tokens:
+        return None
+    mapping = dict(substitutions)
+    if not any(kind == tokenize.STRING and text in mapping for kind, text in tokens):
+        return None
+    out, changed = [], False
+    readline = io.StringIO(code).readline
+    for token in tokenize.generate_tokens(readline):
+        if token.type == tokenize.STRING and token.string in mapping:
+            token = token._replace(string=mapping[token.string])
+            changed = True
+        out.append(token)
+    return tokenize.untokenize(out) if changed else None
+
+
+def _literal(token):
+    try:
+        return str(ast.literal_eval(token))
+    except (ValueError, SyntaxError):
+        return None
+
+
+def _named(substitutions, error):
+    """替换规则只适用于错误消息指明了被替换常量的错误（如KeyError: 'Qty'）；
+    空结果等消息中没有常量的签名与具体代码无关，不能套用替换"""
+    if error.type == 'InvalidResult':
+        return False
+    return all((name := _literal(old)) and repr(name) in error.message for old, _ in substitutions)
+
+
+def _applicable(substitutions, error, columns):
+    """错误消息中提到的常量（写错的列名等）只有在替换后的列确实存在时才替换"""
+    return _named(substitutions, error) and all(_literal(new) in columns for _, new in substitutions)
+
+
+class RepairStore:
+    """按错误签名缓存修复结果（存放在代码缓存中）：
+    只改了字符串常量的修复记为替换规则，不依赖表结构，可用于其他代码中的同类错误；
+    其余修复按原代码与表结构精确匹配"""
+
+    def __init__(self, code_cache):
+        self.code_cache = code_cache
+
+    def lookup(self, code, error, fingerprint, columns=()):
+        repaired = self.code_cache.get(f"{error.signature}\n{code}", fingerprint, namespace=CODE_NAMESPACE,
+                                       count=False)
+        if repaired and repaired != code:
+            return repaired
+        rule = self.code_cache.get(error.signature, '', namespace=RULE_NAMESPACE, count=False)
+        if rule:
+            substitutions = [tuple(pair) for pair in json.loads(rule)]
+            if _applicable(substitutions, error, {str(c) for c in columns}):
+                repaired = apply_substitutions(code, substitutions)
+                if repaired and repaired != code:
+                    return repaired
+        return None
+
+    def record(self, code, error, fingerprint, repaired):
+        self.code_cache.put(f"{error.signature}\n{code}", fingerprint, repaired, namespace=CODE_NAMESPACE)
+        substitutions = literal_substitutions(code, repaired)
+        if substitutions and _named(substitutions, error):
+            self.code_cache.put(error.signature, '', json.dumps(substitutions, ensure_ascii=False),
+                                namespace=RULE_NAMESPACE)
+
+    def discard(self, code, error, fingerprint):
+        self.code_cache.invalidate(f"{error.signature}\n{code}", fingerprint, namespace=CODE_NAMESPACE)
+        self.code_cache.invalidate(error.signature, '', namespace=RULE_NAMESPACE)
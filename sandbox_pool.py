@@ -0,0 +1,265 @@
+import marshal
+import multiprocessing as mp
+import os
+import pickle
+import queue
+import random
+import signal
+import threading
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:  # 未安装pyarrow时通过共享内存传递pickle数据
+    pa = None
+
+try:
+    import resource
+except ImportError:  # Windows没有rlimit，只保留超时控制
+    resource = None
+
+SAFE_BUILTINS = {
+    'str': str, 'int': int, 'float': float, 'bool': bool,
+    'list': list, 'dict': dict, 'tuple': tuple,
+    'len': len, 'range': range,
+}
+
+Payload = namedtuple('Payload', ['kind', 'name', 'size'])
+
+
+class SandboxError(Exception):
+    """子进程中的代码执行失败，或子进程因超出资源限制被终止"""
+
+
+class SandboxTimeout(SandboxError):
+    pass
+
+
+def _attach(name):
+    shm = SharedMemory(name=name)
+    # 只读取不负责释放，取消附加时的登记，避免退出时误报泄漏
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _write_arrow(table, target):
+    with pa.ipc.new_stream(target, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _encode(df, name=None):
+    """DataFrame → 共享内存：优先Arrow IPC（先统计大小，再直接写入共享内存），
+    列类型不受Arrow支持时退回pickle"""
+    table = None
+    if pa is not None:
+        try:
+            table = pa.Table.from_pandas(df, preserve_index=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError, ValueError, TypeError):
+            table = None
+    if table is None:
+        data = pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)
+        shm = SharedMemory(name=name, create=True, size=max(len(data), 1))
+        shm.buf[:len(data)] = data
+        return shm, Payload('pickle', shm.name, len(data))
+
+    mock = pa.MockOutputStream()
+    _write_arrow(table, mock)
+    size = mock.size()
+    shm = SharedMemory(name=name, create=True, size=max(size, 1))
+    buffer = pa.py_buffer(shm.buf)
+    try:
+        _write_arrow(table, pa.FixedSizeBufferWriter(buffer))
+    except BaseException:
+        del buffer
+        shm.close()
+        shm.unlink()
+        raise
+    del buffer  # 释放对共享内存的引用，之后才能close
+    return shm, Payload('arrow', shm.name, size)
+
+
+def _decode(payload):
+    """从共享内存读取DataFrame；先复制出数据，随后即可关闭共享内存"""
+    shm = _attach(payload.name)
+    try:
+        data = bytes(shm.buf[:payload.size])
+    finally:
+        shm.close()
+    if payload.kind == 'arrow':
+        with pa.ipc.open_stream(pa.py_buffer(data)) as reader:
+            return reader.read_all().to_pandas()
+    return pickle.loads(data)
+
+
+def _unlink(name):
+    try:
+        shm = SharedMemory(name=name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+@lru_cache(maxsize=256)
+def _compile(code):
+    return compile(code, '<sandbox>', 'exec')
+
+
+def _limit_memory(memory_mb):
+    """在当前虚拟内存基础上再允许memory_mb，超出时分配失败抛MemoryError"""
+    if resource is None or not memory_mb:
+        return
+    try:
+        with open('/proc/self/statm') as f:
+            base = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        base = 0
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = base + memory_mb * 1024 * 1024
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(cpu_seconds):
+    """CPU时间是进程累计值，每次执行前在已用时间上再放宽cpu_seconds，超出时内核发送SIGXCPU"""
+    if resource is None or not cpu_seconds:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    soft = int(usage.ru_utime + usage.ru_stime) + int(cpu_seconds) + 1
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _worker_main(conn, memory_mb, cpu_seconds):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C由主进程处理
+    # 共享内存一律由主进程释放，子进程不登记到resource_tracker（重启的子进程会与主进程共用同一个tracker）
+    resource_tracker.register = resource_tracker.unregister = lambda name, rtype: None
+    _limit_memory(memory_mb)
+    # fork出的子进程继承了主进程的随机数状态，重新播种，否则各子进程（各分块）生成相同的随机数
+    random.seed()
+    np.random.seed()
+    namespace = {'pd': pd, 'np': np, 'random': random, '__builtins__': SAFE_BUILTINS}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            break
+        if message is None:
+            break
+        code, payload, output_name = message
+        _limit_cpu(cpu_seconds)
+        try:
+            local_vars = {'df': _decode(payload)}
+            exec(marshal.loads(code) if isinstance(code, bytes) else _compile(code), namespace, local_vars)
+            result = local_vars.get('df')
+            if not isinstance(result, pd.DataFrame):
+                reply = ('error', f"代码执行后df不是DataFrame（{type(result).__name__}）")
+            else:
+                shm, out = _encode(result, output_name)
+                shm.close()
+                reply = ('ok', out)
+        except MemoryError:
+            conn.send(('fatal', "内存超出限制"))
+            break
+        except Exception as e:
+            reply = ('error', f"{type(e).__name__}: {e}")
+        conn.send(reply)
+
+
+class _Worker:
+    def __init__(self, ctx, memory_mb, cpu_seconds):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker_main, args=(child, memory_mb, cpu_seconds), daemon=True)
+        self.process.start()
+        child.close()
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class SandboxPool:
+    """预先fork的执行子进程池：子进程已导入pandas，带CPU/内存rlimit与超时，
+    DataFrame通过共享内存中的Arrow IPC传递；子进程超时或崩溃时终止并补充新进程"""
+
+    def __init__(self, workers=2, timeout=30.0, memory_mb=4096, cpu_seconds=None):
+        self.timeout = timeout
+        self.memory_mb = memory_mb
+        self.cpu_seconds = cpu_seconds if cpu_seconds is not None else timeout
+        # fork可直接继承已导入的pandas；不支持fork的平台退回spawn
+        method = 'fork' if 'fork' in mp.get_all_start_methods() else 'spawn'
+        self._ctx = mp.get_context(method)
+        self._idle = queue.Queue()
+        self._workers = set()
+        self._lock = threading.Lock()
+        self.restarts = 0
+        for _ in range(workers):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        worker = _Worker(self._ctx, self.memory_mb, self.cpu_seconds)
+        with self._lock:
+            self._workers.add(worker)
+        return worker
+
+    def _replace(self, worker):
+        worker.stop(kill=True)
+        with self._lock:
+            self._workers.discard(worker)
+        self.restarts += 1
+        self._idle.put(self._spawn())
+
+    def run(self, code, df):
+        """在子进程中执行代码（字符串或编译后的code对象），返回新的DataFrame"""
+        if not isinstance(code, str):
+            code = marshal.dumps(code)
+        # 先序列化再取子进程：序列化失败（无法pickle的对象列、共享内存不足）时不会占住子进程
+        shm, payload = _encode(df)
+        worker = self._idle.get()
+        output_name = f"excel_ai_{uuid.uuid4().hex[:16]}"
+        healthy = False
+        try:
+            worker.conn.send((code, payload, output_name))
+            if not worker.conn.poll(self.timeout):
+                raise SandboxTimeout(f"执行超过{self.timeout:g}秒，已终止子进程")
+            status, value = worker.conn.recv()
+            healthy = status != 'fatal'
+            if status == 'ok':
+                return _decode(value)
+            raise SandboxError(value)
+        except (EOFError, OSError) as e:
+            raise SandboxError(f"子进程异常退出（可能超出CPU或内存限制）: {e or type(e).__name__}")
+        finally:
+            shm.close()
+            shm.unlink()
+            _unlink(output_name)
+            if healthy:
+                self._idle.put(worker)
+            else:
+                self._replace(worker)
+
+    def close(self):
+        with self._lock:
+            workers, self._workers = list(self._workers), set()
+        for worker in workers:
+            worker.stop()
@@ -0,0 +1,476 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+from openai import OpenAI
+
+from code_cache import DEFAULT_CACHE_DIR, CodeCache
+from main3 import BASE_URL, ExcelAIProcessor
+from sidecar import read_excel_cached
+from tracing import Tracer
+from workbook_session import WorkbookSession
+
+SPILL_DIR = os.path.join(DEFAULT_CACHE_DIR, "sessions")
+PREVIEW_ROWS = 5
+ROUTES = [
+    ('POST', re.compile(r'^/sessions$'), 'create'),
+    ('GET', re.compile(r'^/sessions/(?P<sid>\w+)$'), 'status'),
+    ('DELETE', re.compile(r'^/sessions/(?P<sid>\w+)$'), 'close'),
+    ('POST', re.compile(r'^/sessions/(?P<sid>\w+)/instruction$'), 'instruction'),
+    ('POST', re.compile(r'^/sessions/(?P<sid>\w+)/(?P<action>undo|redo)$'), 'history'),
+    ('POST', re.compile(r'^/sessions/(?P<sid>\w+)/sheet$'), 'sheet'),
+    ('POST', re.compile(r'^/sessions/(?P<sid>\w+)/save$'), 'save'),
+    ('GET', re.compile(r'^/stats$'), 'stats'),
+]
+
+
+class UnknownSession(Exception):
+    pass
+
+
+class ThreadOutput:
+    """按线程收集print输出：处理请求的线程开启收集后，处理器打印的信息随响应返回，互不混杂"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def write(self, text):
+        buffer = getattr(self._local, 'buffer', None)
+        return (buffer if buffer is not None else self.stream).write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    @contextlib.contextmanager
+    def capture(self):
+        self._local.buffer = buffer = io.StringIO()
+        try:
+            yield buffer
+        finally:
+            self._local.buffer = None
+
+
+class FrameCache:
+    """所有会话共享的已加载工作表（按路径、工作表与文件mtime区分），超过内存上限时淘汰最久未用的；
+    写时复制下各会话在共享的DataFrame上修改不会互相影响"""
+
+    def __init__(self, max_bytes=2048 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def load(self, path, sheet_name=0):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), sheet_name, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0], True
+            loading = self._loading.setdefault(key, threading.Lock())
+        with loading:  # 同一工作表只读取一次，其余会话等待
+            with self._lock:
+                if key in self._entries:
+                    self.hits += 1
+                    return self._entries[key][0], True
+            df, from_sidecar = read_excel_cached(path, sheet_name=sheet_name)
+            nbytes = int(df.memory_usage(index=True, deep=True).sum())
+            with self._lock:
+                self.misses += 1
+                self._loading.pop(key, None)
+                self._entries[key] = (df, nbytes)
+                self.nbytes += nbytes
+                while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                    _, (_, evicted) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted
+        return df, from_sidecar
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses}
+
+
+class Session:
+    def __init__(self, session_id, processor):
+        self.id = session_id
+        self.processor = processor
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.spill_path = None
+
+
+class SessionManager:
+    """每个会话一个ExcelAIProcessor；模型客户端（连接池）、代码缓存和已加载的工作表在会话间共享，
+    空闲超时或活动会话过多时把会话状态写入磁盘，下次访问时恢复"""
+
+    def __init__(self, client, code_cache, frames, tracer=None, root='.', spill_dir=SPILL_DIR,
+                 idle_seconds=600, max_active=32, compact=False):
+        self.client = client
+        self.code_cache = code_cache
+        self.frames = frames
+        self.tracer = tracer if tracer is not None else Tracer()
+        self.root = os.path.realpath(root)
+        self.spill_dir = spill_dir
+        self.idle_seconds = idle_seconds
+        self.max_active = max_active
+        self.compact = compact
+        self.sessions = {}
+        self._lock = threading.Lock()
+        os.makedirs(spill_dir, exist_ok=True)
+
+    def resolve(self, path):
+        """客户端提供的路径必须位于服务根目录内"""
+        full = os.path.realpath(os.path.join(self.root, path))
+        if os.path.commonpath([full, self.root]) != self.root:
+            raise PermissionError(f"路径不在服务目录内: {path}")
+        return full
+
+    def _processor(self):
+        processor = ExcelAIProcessor(code_cache=self.code_cache, tracer=self.tracer, client=self.client)
+        processor.compact = self.compact
+        return processor
+
+    def open_workbook(self, processor, path, sheet=None):
+        path = self.resolve(path)
+        if path not in processor.workbooks:
+            processor.workbooks[path] = WorkbookSession(path, processor._standardize_columns,
+                                                        compact=processor.compact, loader=self.frames.load)
+        return processor.read_excel(path, sheet_name=sheet)
+
+    def create(self, path, sheet=None):
+        session = Session(uuid.uuid4().hex[:16], self._processor())
+        with session.lock:
+            if not self.open_workbook(session.processor, path, sheet):
+                raise ValueError(f"读取文件失败: {path}")
+        with self._lock:
+            self.sessions[session.id] = session
+        return session
+
+    @contextlib.contextmanager
+    def use(self, session_id):
+        """独占使用会话（同一会话的请求串行执行），已写入磁盘的会话先恢复"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+        if session is None:
+            raise UnknownSession(session_id)
+        with session.lock:
+            if session.processor is None:
+                self._restore(session)
+            session.last_used = time.monotonic()
+            try:
+                yield session.processor
+            finally:
+                session.last_used = time.monotonic()
+
+    def close(self, session_id):
+        with self._lock:
+            session = self.sessions.pop(session_id, None)
+        if session is None:
+            raise UnknownSession(session_id)
+        with session.lock:
+            if session.spill_path and os.path.exists(session.spill_path):
+                os.remove(session.spill_path)
+            session.processor = None
+
+    def spill(self, session):
+        """把会话的工作簿状态（修改后的工作表、撤销记录）写入磁盘；会话正在处理请求时跳过"""
+        if not session.lock.acquire(blocking=False):
+            return False
+        try:
+            processor = session.processor
+            if processor is None:
+                return False
+            for workbook in processor.workbooks.values():
+                workbook.unload_clean()
+            state = {
+                'workbooks': processor.workbooks,
+                'current': (processor.workbook.path, processor.sheet_name) if processor.workbook else None,
+            }
+            path = os.path.join(self.spill_dir, f"{session.id}.pkl")
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            session.processor, session.spill_path = None, path
+            self.tracer.count('session_spill')
+            return True
+        finally:
+            session.lock.release()
+
+    def _restore(self, session):
+        with open(session.spill_path, 'rb') as f:
+            state = pickle.load(f)
+        os.remove(session.spill_path)
+        processor = self._processor()
+        for workbook in state['workbooks'].values():
+            workbook.loader = self.frames.load
+        processor.workbooks = state['workbooks']
+        if state['current']:
+            path, sheet = state['current']
+            processor._activate(processor.workbooks[path], sheet)
+        session.processor, session.spill_path = processor, None
+        self.tracer.count('session_restore')
+
+    def reap(self):
+        """空闲超时的会话写入磁盘；活动会话超过上限时按最久未用依次写入"""
+        now = time.monotonic()
+        with self._lock:
+            active = sorted((s for s in self.sessions.values() if s.processor is not None),
+                            key=lambda s: s.last_used)
+        excess = len(active) - self.max_active
+        for session in active:
+            if now - session.last_used >= self.idle_seconds or excess > 0:
+                if self.spill(session):
+                    excess -= 1
+
+    def stats(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        active = sum(1 for s in sessions if s.processor is not None)
+        return {
+            'sessions': len(sessions),
+            'active': active,
+            'spilled': len(sessions) - active,
+            'frame_cache': self.frames.stats(),
+            'code_cache': self.code_cache.stats(),
+        }
+
+
+def _preview(processor, rows=PREVIEW_ROWS):
+    df = processor.df
+    return {
+        'workbook': processor.workbook.name if processor.workbook else None,
+        'sheet': processor.sheet_name,
+        'shape': list(df.shape),
+        'preview': json.loads(df.head(rows).to_json(orient='split', date_format='iso', force_ascii=False)),
+    }
+
+
+class SessionHandler(BaseHTTPRequestHandler):
+    """JSON接口；执行指令时请求头 Accept: text/event-stream 可通过SSE接收模型进度"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def do_DELETE(self):
+        self._dispatch('DELETE')
+
+    def _dispatch(self, method):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}') if length else {}
+        except ValueError:
+            return self._send_json(400, {'error': '请求体不是合法的JSON'})
+        for route_method, pattern, name in ROUTES:
+            m = pattern.match(self.path.split('?')[0])
+            if m and route_method == method:
+                break
+        else:
+            return self._send_json(404, {'error': 'not found'})
+        output = self.server.output
+        self.streaming = False
+        try:
+            with output.capture() as self.log:
+                status, payload = getattr(self, f'_{name}')(body, **m.groupdict())
+        except UnknownSession as e:
+            return self._send_error(404, f"会话不存在: {e.args[0]}")
+        except PermissionError as e:
+            return self._send_error(403, str(e))
+        except FileNotFoundError as e:
+            return self._send_error(404, f"文件不存在: {e.filename or e}")
+        except (ValueError, TypeError, OSError) as e:
+            return self._send_error(400, str(e))
+        except Exception as e:
+            return self._send_error(500, f"{type(e).__name__}: {e}")
+        if payload is None:  # 已通过SSE发送
+            return
+        payload['log'] = self.log.getvalue()
+        self._send_json(status, payload)
+
+    def _create(self, body):
+        if not body.get('path'):
+            raise ValueError("缺少path")
+        session = self.server.manager.create(body['path'], body.get('sheet'))
+        with self.server.manager.use(session.id) as processor:
+            return 201, {'session': session.id, 'sheets': processor.workbook.sheet_names, **_preview(processor)}
+
+    def _status(self, body, sid):
+        with self.server.manager.use(sid) as processor:
+            dirty = {wb.name: sorted(wb.dirty) for wb in processor.workbooks.values() if wb.dirty}
+            return 200, {'session': sid, 'dirty': dirty, **_preview(processor)}
+
+    def _close(self, body, sid):
+        self.server.manager.close(sid)
+        return 200, {'session': sid, 'closed': True}
+
+    def _history(self, body, sid, action):
+        with self.server.manager.use(sid) as processor:
+            ok = getattr(processor, action)()
+            return 200, {'ok': ok, **_preview(processor)}
+
+    def _sheet(self, body, sid):
+        manager = self.server.manager
+        with manager.use(sid) as processor:
+            if body.get('path'):
+                ok = manager.open_workbook(processor, body['path'], body.get('sheet'))
+            else:
+                ok = processor.switch_sheet(body.get('sheet'))
+            return 200 if ok else 400, {'ok': ok, **_preview(processor)}
+
+    def _save(self, body, sid):
+        manager = self.server.manager
+        with manager.use(sid) as processor:
+            output = manager.resolve(body['path']) if body.get('path') else processor.workbook.path
+            ok = processor.save_excel(output)
+            return 200 if ok else 500, {'ok': ok, 'path': output}
+
+    def _instruction(self, body, sid):
+        instruction = (body.get('instruction') or '').strip()
+        if not instruction:
+            raise ValueError("缺少instruction")
+        stream = 'text/event-stream' in (self.headers.get('Accept') or '')
+        candidates = int(body.get('candidates', self.server.candidates))
+        repair = int(body.get('repair', self.server.repair))
+        send_lock, finished = threading.Lock(), []
+
+        def progress(reasoning_chars, content_chars):
+            with send_lock:
+                if not finished:
+                    self._send_event('progress', {'reasoning_chars': reasoning_chars, 'content_chars': content_chars})
+
+        with self.server.manager.use(sid) as processor:
+            if stream:
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                self.streaming = True
+            start = time.perf_counter()
+            on_progress = progress if stream else None
+            if candidates > 1:
+                code = processor.speculative_execute(instruction, candidates, on_progress=on_progress)
+            else:
+                code = processor.generate_pandas_code(instruction, on_progress=on_progress)
+                if code:
+                    code = processor.execute_with_repair(instruction, code, repair, on_progress=on_progress)
+                    if not code:
+                        processor.discard_cached_code(instruction)
+            payload = {'ok': bool(code), 'code': code, 'seconds': time.perf_counter() - start, **_preview(processor)}
+        if not stream:
+            return 200, payload
+        with send_lock:
+            finished.append(True)
+            payload['log'] = self.log.getvalue()
+            self._send_event('result', payload)
+        return 200, None
+
+    def _stats(self, body):
+        return 200, self.server.manager.stats()
+
+    def _send_event(self, event, payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str)
+        try:
+            self.wfile.write(f"event: {event}\ndata: {data}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端已断开，指令仍会执行完成
+
+    def _send_error(self, status, message):
+        """已开始SSE时以error事件发送，否则返回JSON错误"""
+        payload = {'error': message, 'log': self.log.getvalue()}
+        if self.streaming:
+            payload['status'] = status
+            return self._send_event('error', payload)
+        self._send_json(status, payload)
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_client(connections=16, base_url=BASE_URL):
+    """所有会话共用的模型客户端，keep-alive连接池"""
+    return OpenAI(
+        api_key=os.getenv("DASHSCOPE_API_KEY"),
+        base_url=base_url,
+        http_client=httpx.Client(
+            limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+    )
+
+
+def start_server(manager, host='127.0.0.1', port=0, candidates=1, repair=2, reap_interval=30.0):
+    """在后台线程启动会话服务，返回server对象，地址为 server.url"""
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+    server = ThreadingHTTPServer((host, port), SessionHandler)
+    server.daemon_threads = True
+    server.manager, server.output = manager, sys.stdout
+    server.candidates, server.repair = candidates, repair
+    server.url = f"http://{host}:{server.server_address[1]}"
+    stop = threading.Event()
+
+    def reaper():
+        while not stop.wait(reap_interval):
+            manager.reap()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    threading.Thread(target=reaper, daemon=True).start()
+    server.stop_reaper = stop.set
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="多用户会话服务：常驻进程，共享模型连接池、代码缓存与已加载的工作表")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--root', default='.', help="客户端只能读写该目录内的文件")
+    parser.add_argument('--memory-limit', type=int, default=2048, help="共享工作表缓存的内存上限（MB）")
+    parser.add_argument('--idle', type=float, default=600, help="会话空闲多少秒后写入磁盘")
+    parser.add_argument('--max-active', type=int, default=32, help="内存中最多保留的会话数")
+    parser.add_argument('--spill-dir', default=SPILL_DIR)
+    parser.add_argument('--connections', type=int, default=16, help="模型连接池大小")
+    parser.add_argument('--compact', action='store_true', help="读取后压缩内存")
+    parser.add_argument('--candidates', type=int, default=1, help="默认的并行候选代码数")
+    parser.add_argument('--repair', type=int, default=2, help="默认的自动修复次数")
+    args = parser.parse_args()
+
+    manager = SessionManager(make_client(args.connections), CodeCache(), FrameCache(args.memory_limit * 1024 * 1024),
+                             root=args.root, spill_dir=args.spill_dir, idle_seconds=args.idle,
+                             max_active=args.max_active, compact=args.compact)
+    server = start_server(manager, args.host, args.port, args.candidates, args.repair,
+                          reap_interval=min(30.0, args.idle / 4))
+    print(f"会话服务已启动：{server.url}，目录：{manager.root}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop_reaper()
+        server.shutdown()
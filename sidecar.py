@@ -0,0 +1,80 @@
+import hashlib
+import os
+import tempfile
+
+import pandas as pd
+
+from code_cache import DEFAULT_CACHE_DIR
+
+try:
+    import pyarrow.feather as feather
+except ImportError:  # 未安装pyarrow时退化为直接读取xlsx
+    feather = None
+
+SIDECAR_DIR = os.path.join(DEFAULT_CACHE_DIR, "sidecar")
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _sidecar_prefix(path, sheet_name):
+    source = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    sheet = hashlib.sha1(str(sheet_name).encode('utf-8')).hexdigest()[:8]
+    return f"{source}-{sheet}-"
+
+
+def sidecar_path(path, sheet_name=0, directory=SIDECAR_DIR):
+    """按源文件路径、内容哈希和mtime确定Feather副本路径"""
+    stat = os.stat(path)
+    key = f"{_file_hash(path)[:24]}-{stat.st_mtime_ns}"
+    return os.path.join(directory, f"{_sidecar_prefix(path, sheet_name)}{key}.feather")
+
+
+def _load(target):
+    if feather is None or not os.path.exists(target):
+        return None
+    try:
+        return feather.read_table(target, memory_map=True).to_pandas()
+    except Exception:
+        return None
+
+
+def _write(target, df):
+    """写入未压缩的Feather副本（便于内存映射），并清理同一源文件的旧副本"""
+    if feather is None or not all(isinstance(c, str) for c in df.columns) or df.columns.duplicated().any():
+        return False
+    directory = os.path.dirname(target)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(suffix='.feather', dir=directory)
+    os.close(fd)
+    try:
+        feather.write_feather(df.reset_index(drop=True), tmp_path, compression='uncompressed')
+        os.replace(tmp_path, target)
+    except Exception:
+        return False
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    prefix = os.path.basename(target).rsplit('-', 2)[0] + '-'
+    for name in os.listdir(directory):
+        if name.startswith(prefix) and os.path.join(directory, name) != target:
+            os.remove(os.path.join(directory, name))
+    return True
+
+
+def read_excel_cached(path, sheet_name=0, directory=SIDECAR_DIR):
+    """优先从Feather副本加载；首次读取xlsx后生成副本。返回 (df, 是否命中副本)"""
+    if feather is None:
+        return pd.read_excel(path, sheet_name=sheet_name), False
+    target = sidecar_path(path, sheet_name, directory)
+    df = _load(target)
+    if df is not None:
+        return df, True
+    df = pd.read_excel(path, sheet_name=sheet_name)
+    _write(target, df)
+    return df, False
@@ -0,0 +1,16 @@
+import importlib
+import threading
+
+
+def preload(*names):
+    """在后台线程提前导入模块（openai、tabulate等），与等待用户输入重叠；
+    之后的正常import会等待后台导入完成并得到同一个模块，未安装的模块忽略"""
+    def run():
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except ImportError:
+                pass
+    thread = threading.Thread(target=run, name='preload', daemon=True)
+    thread.start()
+    return thread
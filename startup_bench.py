@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ('main', 'main2', 'main3', 'try')
+# 启动时不应导入、需要时才加载的模块
+DEFERRED = ('openai', 'tabulate', 'cProfile')
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+# 在子进程中分别计时：导入入口模块、创建处理器（不请求模型）
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+module = __import__({name!r})
+imported = time.perf_counter()
+module.ExcelAIProcessor()
+created = time.perf_counter()
+print(json.dumps({{'import_s': imported - start, 'construct_s': created - imported,
+                  'loaded': [m for m in {deferred!r} if m in sys.modules]}}))
+"""
+
+
+def _run(args):
+    env = dict(os.environ)
+    env.setdefault('DASHSCOPE_API_KEY', 'startup-bench')  # 旧版本在创建处理器时就需要密钥
+    return subprocess.run([sys.executable, *args], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+def import_profile(name, top=8):
+    """-X importtime 的结果：入口模块的总导入耗时，以及它直接导入的模块中最慢的几个"""
+    result = _run(['-X', 'importtime', '-c', f"__import__({name!r})"])
+    total, children = None, []
+    for line in result.stderr.splitlines():
+        m = IMPORTTIME_RE.match(line)
+        if not m:
+            continue
+        depth = (len(m.group(3)) - 1) // 2
+        if depth == 0 and m.group(4) == name:
+            total = int(m.group(2))
+        elif depth == 1:
+            children.append((m.group(4), int(m.group(2))))
+    children.sort(key=lambda item: item[1], reverse=True)
+    return total, children[:top]
+
+
+def measure_entry(name, repeat=5):
+    _run(['-c', PROBE.format(name=name, deferred=DEFERRED)])  # 预热：生成.pyc
+    walls, probes = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = _run(['-c', PROBE.format(name=name, deferred=DEFERRED)])
+        walls.append(time.perf_counter() - start)
+        probes.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    total_us, top = import_profile(name)
+    return {
+        'entry': name,
+        'runs': repeat,
+        'wall_s': statistics.median(walls),
+        'import_s': statistics.median(p['import_s'] for p in probes),
+        'construct_s': statistics.median(p['construct_s'] for p in probes),
+        'importtime_us': total_us,
+        'top_imports': top,
+        'loaded_at_startup': probes[-1]['loaded'],
+    }
+
+
+def run_suite(entries=ENTRY_POINTS, repeat=5):
+    results = []
+    for name in entries:
+        stats = measure_entry(name, repeat)
+        results.append(stats)
+        print(f"{name:<6} 进程总耗时{stats['wall_s'] * 1000:8.1f}ms  导入{stats['import_s'] * 1000:8.1f}ms  "
+              f"创建处理器{stats['construct_s'] * 1000:6.1f}ms")
+        print("       最慢的直接导入：" + ', '.join(f"{n} {us / 1000:.0f}ms" for n, us in stats['top_imports'][:5]))
+        if stats['loaded_at_startup']:
+            print(f"       启动时已导入：{', '.join(stats['loaded_at_startup'])}")
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': repeat,
+        },
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=1.2):
+    """按入口对比进程总耗时的中位数，返回变慢超过阈值的入口"""
+    before = {r['entry']: r for r in baseline['results']}
+    regressions = []
+    for result in current['results']:
+        old = before.get(result['entry'])
+        if old is None or not old['wall_s']:
+            continue
+        ratio = result['wall_s'] / old['wall_s']
+        mark = '  变慢' if ratio > threshold else ''
+        print(f"{result['entry']:<6} {old['wall_s'] * 1000:8.1f}ms → {result['wall_s'] * 1000:8.1f}ms  x{ratio:.2f}{mark}")
+        if ratio > threshold:
+            regressions.append((result['entry'], ratio))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="各入口脚本的启动耗时基准（导入 + 创建处理器，基于 -X importtime）")
+    parser.add_argument('--entries', nargs='+', choices=ENTRY_POINTS, default=list(ENTRY_POINTS))
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default='startup_results.json')
+    parser.add_argument('--compare', help="与之前的结果JSON对比")
+    parser.add_argument('--threshold', type=float, default=1.2, help="中位数超过基线的倍数视为变慢")
+    parser.add_argument('--check', action='store_true', help=f"启动时导入了{'/'.join(DEFERRED)}时返回非零")
+    args = parser.parse_args()
+
+    report = run_suite(args.entries, args.repeat)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+
+    failed = False
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"{len(regressions)}个入口的启动耗时超过基线的{args.threshold}倍")
+            failed = True
+    if args.check:
+        eager = [r['entry'] for r in report['results'] if r['loaded_at_startup']]
+        if eager:
+            print(f"以下入口在启动时导入了应延迟加载的模块：{', '.join(eager)}")
+            failed = True
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,264 @@
+import ast
+import os
+import tempfile
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+# 逐块执行与整表执行结果相同的操作（白名单）；未列出的方法、属性（排序、聚合、累计、shape/size、iloc等）都视为依赖整张表
+ROW_LOCAL_ATTRS = {
+    'loc', 'index', 'columns', 'dtypes', 'dtype', 'values', 'name', 'str', 'dt',
+    'astype', 'fillna', 'replace', 'map', 'apply', 'applymap', 'isin', 'between', 'isna', 'notna', 'isnull',
+    'notnull', 'where', 'mask', 'clip', 'round', 'abs', 'copy', 'rename', 'drop', 'dropna', 'assign', 'query',
+    'eval', 'get', 'insert', 'pop', 'to_numpy', 'tolist', 'to_list', 'combine_first', 'add', 'sub', 'mul', 'div',
+    'truediv', 'floordiv', 'mod', 'pow', 'radd', 'rsub', 'rmul', 'rdiv', 'eq', 'ne', 'lt', 'le', 'gt', 'ge',
+    # vectorize生成的 rng = np.random.default_rng() 上的逐行随机数
+    'integers', 'random', 'uniform', 'choice', 'normal',
+}
+STR_METHODS = {
+    'strip', 'lstrip', 'rstrip', 'lower', 'upper', 'title', 'capitalize', 'swapcase', 'casefold', 'replace',
+    'contains', 'startswith', 'endswith', 'match', 'fullmatch', 'len', 'slice', 'slice_replace', 'split',
+    'rsplit', 'get', 'join', 'extract', 'findall', 'count', 'find', 'rfind', 'pad', 'center', 'ljust', 'rjust',
+    'zfill', 'repeat', 'isdigit', 'isnumeric', 'isalpha', 'isalnum', 'isspace', 'islower', 'isupper', 'istitle',
+    'isdecimal', 'normalize', 'removeprefix', 'removesuffix', 'translate',
+}
+DT_ATTRS = {
+    'year', 'month', 'day', 'hour', 'minute', 'second', 'date', 'time', 'dayofweek', 'day_of_week', 'weekday',
+    'dayofyear', 'day_of_year', 'quarter', 'is_month_start', 'is_month_end', 'is_quarter_start',
+    'is_quarter_end', 'is_year_start', 'is_year_end', 'is_leap_year', 'days_in_month', 'days', 'seconds',
+    'total_seconds', 'strftime', 'normalize', 'floor', 'ceil', 'round', 'month_name', 'day_name',
+}
+MODULE_FUNCS = {
+    'np': {'where', 'select', 'isnan', 'isinf', 'round', 'floor', 'ceil', 'abs', 'sqrt', 'exp', 'log', 'log10',
+           'log1p', 'sign', 'power', 'clip', 'maximum', 'minimum', 'nan', 'inf', 'pi', 'nan_to_num',
+           'logical_and', 'logical_or', 'logical_not', 'int64', 'float64', 'random'},
+    'np.random': {'default_rng', 'randint', 'rand', 'random', 'choice', 'uniform', 'normal'},
+    'random': {'randint', 'random', 'uniform', 'choice', 'choices', 'gauss', 'randrange'},
+    'pd': {'to_datetime', 'to_numeric', 'to_timedelta', 'isna', 'notna', 'isnull', 'notnull', 'NA', 'NaT',
+           'Timestamp', 'Timedelta', 'DateOffset', 'Series', 'offsets'},
+}
+ROW_REDUCTIONS = {'sum', 'mean', 'max', 'min', 'median', 'std', 'var', 'count', 'prod', 'any', 'all'}
+# 按位置生成的随机数：rng.integers(1, 10, size=len(df)) 中的len(df)是每块的行数
+RANDOM_SIZE_CALLS = {'integers', 'random', 'uniform', 'choice', 'normal', 'randint', 'rand'}
+
+
+def _row_wise_reductions(tree):
+    """df[['a', 'b']].sum(axis=1) 这类按行聚合是分块安全的"""
+    allowed = set()
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                and node.func.attr in ROW_REDUCTIONS and _axis_columns(node)):
+            allowed.add(id(node.func))
+    return allowed
+
+
+def _per_row_ranges(tree):
+    """[random.randint(...) for _ in range(len(df))] 这类逐行生成值的range是分块安全的"""
+    allowed = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.ListComp, ast.GeneratorExp)) and len(node.generators) == 1:
+            gen = node.generators[0]
+            used = {n.id for n in ast.walk(node.elt) if isinstance(n, ast.Name)}
+            if isinstance(gen.target, ast.Name) and gen.target.id not in used:
+                allowed.add(id(gen.iter))
+    return allowed
+
+
+def _axis_columns(call):
+    return any(k.arg == 'axis' and isinstance(k.value, ast.Constant) and k.value.value in (1, 'columns')
+               for k in call.keywords)
+
+
+def _dotted(node):
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    return [node.id] + parts[::-1] if isinstance(node, ast.Name) else None
+
+
+def _mentions_df(node):
+    return any(isinstance(n, ast.Name) and n.id == 'df' for n in ast.walk(node))
+
+
+def _label_lookup(node):
+    """df.loc[0, 'a'] / df.loc[[1, 2]] 按行标签定位，分块后标签只存在于其中一块"""
+    key = node.slice.elts[0] if isinstance(node.slice, ast.Tuple) else node.slice
+    if isinstance(key, ast.Constant):
+        return True
+    return isinstance(key, (ast.List, ast.Tuple)) and all(isinstance(e, ast.Constant) for e in key.elts)
+
+
+def _drops_rows(node):
+    """drop/dropna只有明确按列操作时才是逐块安全的：drop按列删除；dropna按行删除"""
+    by_columns = _axis_columns(node) or any(k.arg == 'columns' for k in node.keywords)
+    return not by_columns if node.func.attr == 'drop' else by_columns
+
+
+def _element_names(tree):
+    """apply/map等传入的lambda参数及推导式变量，代表单个元素或一行，不是分块数据"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Lambda):
+            names.update(a.arg for a in node.args.args)
+        elif isinstance(node, ast.comprehension):
+            names.update(n.id for n in ast.walk(node.target) if isinstance(n, ast.Name))
+    return names - {'df'}
+
+
+def _root(node):
+    """v.strip().upper() / r['a'].lower() 的起点名称"""
+    while isinstance(node, (ast.Attribute, ast.Call, ast.Subscript)):
+        node = node.func if isinstance(node, ast.Call) else node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+def _attribute_ok(node, parent, elements):
+    if _root(node) in elements:
+        return True
+    dotted = _dotted(node)
+    if dotted and dotted[0] in MODULE_FUNCS:
+        if isinstance(parent, ast.Attribute) and parent.value is node:
+            return True  # 只检查完整的属性链
+        owner = dotted[0]
+        for depth, attr in enumerate(dotted[1:], 1):
+            if owner not in MODULE_FUNCS:
+                return True  # pd.offsets.Day等
+            if attr not in MODULE_FUNCS[owner]:
+                return False
+            owner = '.'.join(dotted[:depth + 1])
+        return True
+    receiver = node.value
+    if isinstance(receiver, ast.Attribute) and receiver.attr in ('str', 'dt'):
+        allowed = STR_METHODS if receiver.attr == 'str' else DT_ATTRS
+        return node.attr in allowed
+    if node.attr == 'index' and isinstance(node.ctx, ast.Store):
+        return False
+    return node.attr in ROW_LOCAL_ATTRS
+
+
+def is_row_local(code):
+    """判断代码是否只做逐行/逐列的局部运算（过滤、列赋值、字符串清洗等），可以分块执行。
+    采用白名单：只有已知逐块执行结果与整表执行相同的方法、函数才放行"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return False
+    parents = {id(child): node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    ranges = _per_row_ranges(tree)
+    per_row = {id(inner) for node in ast.walk(tree) if id(node) in ranges for inner in ast.walk(node)}
+    reductions = _row_wise_reductions(tree)
+    elements = _element_names(tree)
+    for node in ast.walk(tree):
+        parent = parents.get(id(node))
+        if isinstance(node, ast.Attribute) and id(node) not in reductions \
+                and not _attribute_ok(node, parent, elements):
+            return False
+        if isinstance(node, ast.keyword) and node.arg == 'method':
+            return False
+        if isinstance(node, ast.Subscript):
+            # df[:2] / df['a'][-3:] 按位置切片，每块都会各取一段；.str[:2]是逐个元素的切片
+            bounded = isinstance(node.slice, ast.Slice) and any((node.slice.lower, node.slice.upper, node.slice.step))
+            if bounded and _mentions_df(node.value) and not (
+                    isinstance(node.value, ast.Attribute) and node.value.attr == 'str'):
+                return False
+            if isinstance(node.value, ast.Attribute) and node.value.attr == 'loc' and _label_lookup(node):
+                return False
+        if not isinstance(node, ast.Call):
+            continue
+        func = node.func
+        if isinstance(func, ast.Attribute):
+            if func.attr in ('drop', 'dropna') and _drops_rows(node):
+                return False
+            if func.attr == 'apply' and _is_frame(func.value) and not _axis_columns(node):
+                return False  # df.apply(f) 默认逐列传入整列
+            if func.attr in ('split', 'rsplit') and any(k.arg == 'expand' for k in node.keywords):
+                return False  # 各块拆出的列数可能不同
+            if _dotted(func) == ['pd', 'Series'] and not any(k.arg == 'index' for k in node.keywords):
+                return False  # 默认索引从0开始，与分块的行标签对不上
+        elif isinstance(func, ast.Name):
+            if func.id in ('range', 'sorted', 'enumerate', 'zip', 'reversed') and id(node) not in per_row:
+                return False
+            if func.id == 'len' and _mentions_df(node) and id(node) not in per_row and not _random_size(node, parent):
+                return False  # len(df)为每块的行数
+    return True
+
+
+def _is_frame(node):
+    """df 或 df[['a', 'b']]"""
+    if isinstance(node, ast.Name):
+        return node.id == 'df'
+    return isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) and node.value.id == 'df' \
+        and isinstance(node.slice, ast.List)
+
+
+def _random_size(node, parent):
+    """len(df)作为随机数函数的size参数"""
+    if isinstance(parent, ast.keyword):
+        return parent.arg == 'size'
+    return isinstance(parent, ast.Call) and node in parent.args and isinstance(parent.func, ast.Attribute) \
+        and parent.func.attr in RANDOM_SIZE_CALLS
+
+
+def iter_excel_chunks(file_path, chunksize=50000, sheet_name=None):
+    """以openpyxl只读模式逐块读取工作表，产出DataFrame"""
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        ws = wb[sheet_name] if sheet_name else wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [f"Unnamed: {i}" if h is None else h for i, h in enumerate(header)]
+        buffer, start = [], 0
+        for row in rows:
+            buffer.append(row)
+            if len(buffer) >= chunksize:
+                yield pd.DataFrame(buffer, columns=columns, index=pd.RangeIndex(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer or start == 0:
+            yield pd.DataFrame(buffer, columns=columns, index=pd.RangeIndex(start, start + len(buffer)))
+    finally:
+        wb.close()
+
+
+def to_cell(value):
+    if value is None or value is pd.NaT:
+        return None
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+class StreamingWriter:
+    """使用write-only工作簿逐块写入，写完后原子替换目标文件"""
+
+    def __init__(self, output_path, sheet_title=None):
+        self.output_path = output_path
+        self.columns = None
+        self.rows = 0
+        self._wb = Workbook(write_only=True)
+        self._ws = self._wb.create_sheet(sheet_title)
+
+    def append(self, df):
+        if self.columns is None:
+            self.columns = list(df.columns)
+            self._ws.append([str(c) for c in self.columns])
+        df = df.reindex(columns=self.columns)
+        for row in df.itertuples(index=False, name=None):
+            self._ws.append([to_cell(v) for v in row])
+        self.rows += len(df)
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.output_path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=directory)
+        os.close(fd)
+        try:
+            self._wb.save(tmp_path)
+            os.replace(tmp_path, self.output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,124 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """模拟OpenAI兼容的 /chat/completions 接口，返回固定的<code>回复"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        config = self.server.config
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send_json(404, {'error': {'message': 'not found'}})
+        with self.server.lock:
+            self.server.request_count += 1
+            failing = self.server.request_count <= config['fail_first']
+            self.server.active += 1
+            self.server.max_active = max(self.server.max_active, self.server.active)
+        try:
+            time.sleep(config['latency'])
+        finally:
+            with self.server.lock:
+                self.server.active -= 1
+        if failing or random.random() < config['fail_rate']:
+            status = config['fail_status'] if failing else random.choice([429, 500, 503])
+            return self._send_json(status, {'error': {'message': f'stub error {status}'}},
+                                   headers={'Retry-After': '0'} if status == 429 else None)
+
+        request = json.loads(body or b'{}')
+        content = f"<code>{config['code']}</code>{config['trailer']}"
+        if request.get('stream'):
+            return self._send_stream(request, content)
+        prompt_tokens = sum(len(m.get('content', '')) for m in request.get('messages', []))
+        self._send_json(200, {
+            'id': f'stub-{self.server.request_count}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stub'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(content),
+                      'total_tokens': prompt_tokens + len(content)},
+        })
+
+    def _send_stream(self, request, content):
+        """以SSE逐块返回：先输出推理内容，再输出<code>回复"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        config = self.server.config
+        pieces = [('reasoning_content', '思' * 20)] * (config['reasoning'] // 20)
+        pieces += [('content', content[i:i + 8]) for i in range(0, len(content), 8)]
+        try:
+            for field, text in pieces:
+                chunk = {
+                    'id': 'stub-stream', 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': request.get('model', 'stub'),
+                    'choices': [{'index': 0, 'delta': {field: text}, 'finish_reason': None}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                time.sleep(config['chunk_delay'])
+            self.wfile.write(b"data: [DONE]\n\n")
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # 客户端提前取消
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(code="df = df.copy()", latency=0.0, fail_rate=0.0, reasoning=0, trailer='',
+                      chunk_delay=0.0, host='127.0.0.1', port=0, fail_first=0, fail_status=503):
+    """在后台线程启动桩服务，返回server对象，base_url为 server.base_url；
+    前fail_first个请求固定返回fail_status，server.max_active记录同时处理中的最大请求数"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.config = {'code': code, 'latency': latency, 'fail_rate': fail_rate, 'reasoning': reasoning,
+                     'trailer': trailer, 'chunk_delay': chunk_delay, 'fail_first': fail_first,
+                     'fail_status': fail_status}
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.active = server.max_active = 0
+    server.base_url = f"http://{host}:{server.server_address[1]}/v1"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="OpenAI兼容的本地桩服务")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--code', default="df = df.copy()", help="返回的<code>内容")
+    parser.add_argument('--latency', type=float, default=0.5, help="每次请求的延迟（秒）")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="随机返回429/5xx的概率")
+    parser.add_argument('--reasoning', type=int, default=0, help="流式模式下先输出的推理字数")
+    parser.add_argument('--trailer', default='', help="<code>之后追加的说明文字")
+    parser.add_argument('--chunk-delay', type=float, default=0.0, help="流式模式下每块之间的延迟（秒）")
+    args = parser.parse_args()
+
+    server = start_stub_server(args.code, args.latency, args.fail_rate, args.reasoning, args.trailer,
+                               args.chunk_delay, port=args.port)
+    print(f"桩服务已启动：DASHSCOPE_BASE_URL={server.base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pandas as pd
+import pytest
+
+import async_processor
+from async_processor import AsyncExcelAIProcessor, RateLimiter
+from stub_server import start_stub_server
+
+CODE = "df['b'] = df['a'] + 1"
+
+
+@pytest.fixture
+def stub(workdir, monkeypatch):
+    server = start_stub_server(code=CODE)
+    monkeypatch.setattr(async_processor, 'BASE_URL', server.base_url)
+    monkeypatch.setenv('DASHSCOPE_API_KEY', 'stub')
+    yield server
+    server.shutdown()
+
+
+def _generate(instructions, **kwargs):
+    async def run():
+        processor = AsyncExcelAIProcessor(**kwargs)
+        try:
+            return await processor.agenerate_many(instructions, pd.DataFrame({'a': [1, 2, 3]}))
+        finally:
+            await processor.aclose()
+    return asyncio.run(run())
+
+
+def test_retry_after_is_honoured(stub):
+    stub.config.update(fail_first=2, fail_status=429)
+    start = time.perf_counter()
+    assert _generate(['第一条指令'], requests_per_second=None) == [CODE]
+    assert stub.request_count == 3
+    assert time.perf_counter() - start < 1.0  # Retry-After: 0，不走指数退避
+
+
+def test_server_errors_back_off_and_retry(stub, monkeypatch):
+    stub.config.update(fail_first=2, fail_status=503)
+    monkeypatch.setattr(async_processor.random, 'random', lambda: 0.0)  # 退避0.25s、0.5s
+    start = time.perf_counter()
+    assert _generate(['第一条指令'], requests_per_second=None) == [CODE]
+    assert stub.request_count == 3
+    assert time.perf_counter() - start >= 0.7
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.config.update(fail_first=10, fail_status=429)
+    assert _generate(['第一条指令'], max_retries=2, requests_per_second=None) == [None]
+    assert stub.request_count == 3
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.config.update(fail_first=10, fail_status=400)
+    assert _generate(['第一条指令'], requests_per_second=None) == [None]
+    assert stub.request_count == 1
+
+
+def test_concurrency_is_bounded(stub):
+    stub.config['latency'] = 0.2
+    instructions = [f'第{i}条指令' for i in range(9)]
+    start = time.perf_counter()
+    assert _generate(instructions, max_concurrency=3, requests_per_second=None) == [CODE] * 9
+    elapsed = time.perf_counter() - start
+    assert stub.max_active == 3
+    assert 0.6 <= elapsed < 9 * 0.2
+
+
+def test_rate_limiter_spaces_requests():
+    async def run():
+        limiter = RateLimiter(20, burst=1)
+        for _ in range(6):
+            await limiter.acquire()
+    start = time.perf_counter()
+    asyncio.run(run())
+    assert time.perf_counter() - start >= 0.2
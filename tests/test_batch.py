@@ -0,0 +1,43 @@
+import os
+
+import pandas as pd
+import pytest
+from openai import OpenAI
+
+from batch import compile_instructions, output_paths
+from main3 import ExcelAIProcessor
+from stub_server import start_stub_server
+
+
+@pytest.fixture
+def stub():
+    server = start_stub_server()
+    yield server
+    server.shutdown()
+
+
+def _processor(stub):
+    return ExcelAIProcessor(client=OpenAI(api_key='stub', base_url=stub.base_url, max_retries=0))
+
+
+def test_same_name_in_different_directories(tmp_path):
+    files = [str(tmp_path / 'b' / 'x' / 'data.xlsx'), str(tmp_path / 'b' / 'y' / 'data.xlsx')]
+    outputs = output_paths(files, 'bout')
+    assert sorted(outputs.values()) == [os.path.join('bout', 'x', 'data.xlsx'), os.path.join('bout', 'y', 'data.xlsx')]
+    assert output_paths(files[:1], 'bout') == {files[0]: os.path.join('bout', 'data.xlsx')}
+
+
+def test_filter_with_no_sample_matches_compiles(workdir, stub):
+    stub.config['code'] = "df = df[df['a'] > 1000]"
+    codes = compile_instructions(_processor(stub), pd.DataFrame({'a': range(50)}), ['保留a大于1000的行'])
+    assert codes == ["df = df[df['a'] > 1000]"]
+
+
+def test_failed_sample_run_discards_cached_code(workdir, stub):
+    stub.config['code'] = "df['b'] = df['missing'] + 1"
+    processor = _processor(stub)
+    sample = pd.DataFrame({'a': range(50)})
+    assert compile_instructions(processor, sample, ['b等于missing加1']) is None
+    stub.config['code'] = "df['b'] = df['a'] + 1"
+    assert compile_instructions(_processor(stub), sample, ['b等于missing加1']) == ["df['b'] = df['a'] + 1"]
+    assert stub.request_count == 2
@@ -0,0 +1,32 @@
+import pandas as pd
+
+from code_cache import CodeCache, normalize_instruction
+from main3 import ExcelAIProcessor
+
+
+def test_case_is_significant(tmp_path):
+    cache = CodeCache(str(tmp_path / 'cache.sqlite3'))
+    cache.put("新增一列Flag值为YES", 'fp', "df['Flag'] = 'YES'")
+    assert cache.get("新增一列flag值为yes", 'fp') is None
+    assert cache.get("新增一列Flag值为YES", 'fp') == "df['Flag'] = 'YES'"
+    cache.close()
+
+
+def test_width_and_whitespace_are_folded():
+    assert normalize_instruction("  删除　ＡＢ 列。 ") == normalize_instruction("删除 AB 列")
+
+
+def test_invalid_cached_code_is_evicted(workdir):
+    pd.DataFrame({'a': [1, 2]}).to_excel('in.xlsx', index=False)
+    cache = CodeCache('cache.sqlite3')
+    processor = ExcelAIProcessor(code_cache=cache)
+    assert processor.read_excel('in.xlsx')
+    instruction = '新增一列b'
+    key = (instruction, processor._fingerprint(), processor._model_for(instruction))
+    cache.put(key[0], key[1], "pd.compat.os.system('touch pwned')\ndf['b'] = 1", namespace=key[2])
+    assert processor._lookup_code(instruction) is None
+    assert cache.get(*key[:2], namespace=key[2]) is None
+
+    cache.put(key[0], key[1], "df['b'] = df['a'] + 1", namespace=key[2])
+    assert processor._lookup_code(instruction) == "df['b'] = df['a'] + 1"
+    cache.close()
@@ -0,0 +1,48 @@
+import pytest
+
+from code_validator import validate_code
+
+
+@pytest.mark.parametrize('code', [
+    "df['x'] = '{0.__class__.__init__.__globals__}'.format(df)",
+    "df['x'] = '{c.__class__}'.format_map({'c': df})",
+    "t = '{0.__class__}'\ndf['x'] = t.format(df)",
+    "df['x'] = ('{0.' + '__class__}').format(df)",
+    "df = df.query('__import__(\"os\")')",
+    "df['x'] = df.__class__",
+    "df['x'] = ('{0.' + '_' * 2 + 'class' + '_' * 2 + '}').format(df)",
+])
+def test_dunder_access_rejected(code):
+    assert not validate_code(code).ok
+
+
+@pytest.mark.parametrize('code', [
+    "pd.compat.os.system('touch pwned')\ndf['x'] = 1",
+    "df['x'] = pd.core.frame.sys.version",
+    "df['x'] = np.f2py.os.getcwd()",
+    "df['x'] = str(np.f2py.subprocess)",
+    "m = pd\ndf['x'] = 1",
+    "df['x'] = df['a'].map(lambda v: v.os)",
+    "df['x'] = '{0.compat}'.format(pd)",
+    "df['x'] = df.eval('a' + ' + 1')",
+    "q = 'a > 1'\ndf = df.query(q)",
+    "df['x'] = df.eval('a.__class__')",
+    "df = df.query('@pd.compat.os.getcwd()')",
+])
+def test_module_escape_rejected(code):
+    assert not validate_code(code).ok
+
+
+@pytest.mark.parametrize('code', [
+    "df['a__b'] = df['a__b'] + 1",
+    "df['x'] = '{}-{}'.format(1, 2)",
+    "df['x'] = df['a'].map('{:.2f}'.format)",
+    "rng = np.random.default_rng()\ndf['x'] = rng.integers(0, 5, size=len(df))",
+    "df['x'] = pd.Series(np.where(df['a'] > 1, 1, 0), index=df.index)",
+    "df['x'] = pd.to_datetime(df['a']) + pd.offsets.Day(1)",
+    "df['x'] = pd.api.types.is_numeric_dtype(df['a'])",
+    "df = df.query('a > 1')",
+    "df['x'] = df.eval('a * 2')",
+])
+def test_ordinary_code_allowed(code):
+    assert validate_code(code).ok
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+
+from compact import compact_frame, widen_ints
+from main3 import ExcelAIProcessor
+
+
+def test_narrow_int_column_does_not_overflow(workdir):
+    ages = np.arange(10, 90)
+    pd.DataFrame({'age': ages, 'name': [f'n{i}' for i in ages], 'city': 'x', 'score': 1.5}).to_excel(
+        'ages.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    processor.compact = True
+    assert processor.read_excel('ages.xlsx')
+    assert processor.df['age'].dtype == np.int16
+
+    assert processor.safe_execute("df['age'] = df['age'] * 1000")
+    assert processor.df['age'].tolist() == (ages * 1000).tolist()
+    assert processor.save_excel('out.xlsx')
+    assert pd.read_excel('out.xlsx')['age'].tolist() == (ages * 1000).tolist()
+
+
+def test_widen_ints_restores_original_dtype():
+    df, report = compact_frame(pd.DataFrame({'a': np.arange(100, dtype=np.int64)}))
+    assert df['a'].dtype == np.int16
+    assert widen_ints(df, report.dtypes)['a'].dtype == np.int64
+
+
+def _compacted(path):
+    pd.DataFrame({'age': np.arange(10, 90), 'city': 'x', 'score': 1.5}).to_excel(path, index=False)
+    processor = ExcelAIProcessor()
+    processor.compact = True
+    assert processor.read_excel(path)
+    return processor
+
+
+def test_retry_runs_on_untouched_input(workdir):
+    processor = _compacted('ages.xlsx')
+    assert processor.df['city'].dtype == 'category'
+    # 第一次执行在category列上报错之前已原地修改了score，重试不能叠加这次修改
+    assert processor.safe_execute("df['score'] = df['score'] * 4\ndf['city'] = df['city'] + '!'")
+    assert processor.df['score'].eq(6.0).all()
+    assert processor.df['city'].astype(str).eq('x!').all()
+
+
+def test_fingerprint_ignores_compaction(workdir):
+    compacted = _compacted('ages.xlsx')
+    plain = ExcelAIProcessor()
+    assert plain.read_excel('ages.xlsx')
+    assert compacted._fingerprint() == plain._fingerprint()
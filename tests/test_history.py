@@ -0,0 +1,19 @@
+import pandas as pd
+
+from history import History
+
+
+def _texts(char):
+    return pd.DataFrame({'s': pd.Series([char * 1000] * 100, dtype=object)})
+
+
+def test_budget_counts_string_payloads():
+    history = History(max_bytes=200 * 1024)
+    frames = [_texts(c) for c in 'abcd']
+    for before, after in zip(frames, frames[1:]):
+        history.record(before, after)
+    # 每条记录保存约100KB的字符串，超出预算的早期记录被淘汰
+    assert history.nbytes > 100 * 1000
+    assert len(history.undo_stack) == 1
+    previous, _ = history.undo(frames[-1])
+    pd.testing.assert_frame_equal(previous, frames[-2])
@@ -0,0 +1,44 @@
+import pandas as pd
+import pytest
+
+from intent_matcher import IntentMatcher
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame({'姓名': ['张三', None, '李四'], '城市': ['北京', '上海', '广州'], '年龄': [20, 30, 40]})
+
+
+@pytest.mark.parametrize('instruction, code', [
+    ('删除姓名为空的行', "df = df[~(df['姓名'].isna())]"),
+    ('筛选姓名不为空的行', "df = df[df['姓名'].notna()]"),
+    ('筛选姓名非空的行', "df = df[df['姓名'].notna()]"),
+    ('筛选城市为北京或上海的行', "df = df[df['城市'].isin(['北京', '上海'])]"),
+    ('删除城市是北京、广州的行', "df = df[~(df['城市'].isin(['北京', '广州']))]"),
+    ('筛选城市不是北京的行', "df = df[df['城市'] != '北京']"),
+    ('筛选年龄大于25的行', "df = df[df['年龄'] > 25]"),
+    ('筛选年龄为20或40的行', "df = df[df['年龄'].isin([20, 40])]"),
+    ('按年龄降序排序', "df = df.sort_values('年龄', ascending=False)"),
+])
+def test_match(df, instruction, code):
+    assert IntentMatcher().match(instruction, df) == code
+
+
+@pytest.mark.parametrize('instruction', [
+    '筛选年龄大于空的行',
+    '筛选年龄大于20或30的行',
+    '筛选城市大于北京的行',
+    '筛选年龄为二十的行',
+])
+def test_ambiguous_conditions_declined(df, instruction):
+    assert IntentMatcher().match(instruction, df) is None
+
+
+def test_matched_code_runs(df):
+    matcher = IntentMatcher()
+    local_vars = {'df': df}
+    exec(matcher.match('删除姓名为空的行', df), {}, local_vars)
+    assert local_vars['df']['姓名'].tolist() == ['张三', '李四']
+    local_vars = {'df': df}
+    exec(matcher.match('筛选城市为北京或上海的行', df), {}, local_vars)
+    assert local_vars['df']['城市'].tolist() == ['北京', '上海']
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main3 import ExcelAIProcessor
+from parallel import run_sharded, shard_plan
+from sandbox_pool import SandboxPool
+
+SHARDABLE = [
+    "df['n'] = df['a'].apply(lambda v: v * 2)",
+    "df['s'] = df['s'].map(lambda v: v.strip().upper())",
+    "df['n'] = df.apply(lambda r: r['a'] + r['b'], axis=1)",
+    "df['t'] = df['s'].str.strip().str[:2]",
+    "df = df[df['a'].apply(lambda v: v % 3 == 0)]",
+]
+
+# 每段都含逐元素运算，只因依赖总行数/整列数据而不能分块
+NOT_SHARDABLE = [
+    "df['n'] = df['a'].apply(lambda v: v * 2) + df.shape[0]",
+    "df['n'] = df['a'].apply(lambda v: v * 2) + df.size",
+    "df['n'] = df['s'].map(str.strip).str.cat(sep=',')",
+    "df['n'] = df['a'].apply(lambda v: v * 2).cumsum()",
+    "df['n'] = df['a'].apply(lambda v: v * 2).rank()",
+    "df['n'] = np.arange(len(df)) + df['a'].apply(lambda v: v)",
+    "df['n'] = df['a'].apply(lambda v: v * 2)\ndf = df[:10]",
+]
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = SandboxPool(2, timeout=30)
+    yield pool
+    pool.close()
+
+
+def _frame():
+    return pd.DataFrame({'a': np.arange(60), 'b': np.arange(60) * 10, 's': [f' s{i} ' for i in range(60)]})
+
+
+def _serial(code, df):
+    local_vars = {'df': df.copy()}
+    exec(code, ExcelAIProcessor().safe_globals, local_vars)
+    return local_vars['df']
+
+
+@pytest.mark.parametrize('code', SHARDABLE)
+def test_sharded_matches_serial(pool, code):
+    plan = shard_plan(code)
+    assert plan is not None
+    df = _frame()
+    pd.testing.assert_frame_equal(run_sharded(pool, code, df, plan, 3), _serial(code, df))
+
+
+@pytest.mark.parametrize('code', NOT_SHARDABLE)
+def test_whole_frame_code_not_sharded(code):
+    assert shard_plan(code) is None
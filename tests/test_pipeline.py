@@ -0,0 +1,20 @@
+import pandas as pd
+
+from main3 import ExcelAIProcessor
+
+
+def test_fused_failure_falls_back_from_original(workdir):
+    pd.DataFrame({'a': [1.5, 2.5, 3.5]}).to_excel('in.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('in.xlsx', deferred=True)
+    assert processor.safe_execute("df['a'] = df['a'] * 4")
+    assert processor.safe_execute("df['b'] = df['a'] + 1")
+    # 融合后的代码执行了第一步后报错，逐条执行时不能在已修改的数据上再执行一次
+    processor.plan.compile = lambda: compile("df['a'] = df['a'] * 4\nraise ValueError('fused')", '<plan>', 'exec')
+    source = processor.deferred_df
+    assert processor.save_excel('out.xlsx')
+
+    out = pd.read_excel('out.xlsx')
+    assert out['a'].tolist() == [6.0, 10.0, 14.0]
+    assert out['b'].tolist() == [7.0, 11.0, 15.0]
+    assert source['a'].tolist() == [1.5, 2.5, 3.5]
@@ -0,0 +1,22 @@
+import pandas as pd
+
+from main3 import ExcelAIProcessor
+from prompt_builder import PromptBuilder
+
+
+def test_same_schema_frames_do_not_share_samples():
+    builder = PromptBuilder()
+    first = builder.summarize(pd.DataFrame({'city': ['北京', '上海']}))
+    second = builder.summarize(pd.DataFrame({'city': ['广州', '深圳']}))
+    assert first[0].samples == ('北京', '上海')
+    assert second[0].samples == ('广州', '深圳')
+
+
+def test_summary_follows_edits(workdir):
+    pd.DataFrame({'city': ['北京', '上海']}).to_excel('in.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('in.xlsx')
+    assert '北京' in processor._build_prompt('把city改成拼音')
+    assert processor.safe_execute("df['city'] = df['city'].replace({'北京': 'beijing'})")
+    prompt = processor._build_prompt('把city改成拼音')
+    assert 'beijing' in prompt and '北京' not in prompt
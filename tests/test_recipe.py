@@ -0,0 +1,41 @@
+import pandas as pd
+
+from code_validator import validate_code
+from main3 import ExcelAIProcessor
+from recipe import load_recipe, prepare_steps
+
+
+def test_vectorized_step_replays(workdir):
+    pd.DataFrame({'a': range(300), 'b': 'x'}).to_excel('in.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('in.xlsx')
+    code = processor.optimize_code("df['n'] = df['a'].apply(lambda v: random.randint(1, 10))")
+    assert 'np.' in code
+    assert processor.safe_execute(code, '随机数')
+    assert processor.export_recipe('recipe.json')
+
+    recipe = load_recipe('recipe.json')
+    assert prepare_steps(recipe) == [code]
+    replay = ExcelAIProcessor()
+    assert replay.read_excel('in.xlsx')
+    assert replay.replay_recipe(recipe)
+    assert replay.df['n'].between(1, 10).all()
+
+
+def test_numpy_file_access_rejected():
+    for code in ("df['a'] = np.load('x.npy')", "df['a'].to_numpy().tofile('x')", "np.lib.npyio.savetxt('x', df)",
+                 "df['a'] = np.fromregex('x.txt', 'x', [])", "df['a'].to_numpy().dump('x')",
+                 "df['a'] = len(df.values.dumps())", "df['a'] = np.frombuffer(b'x', 'u1')"):
+        assert not validate_code(code).ok
+
+
+def test_vectorizer_output_validates(workdir):
+    pd.DataFrame({'a': range(50)}).to_excel('in.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('in.xlsx')
+    for code in ("df['n'] = df['a'].apply(lambda v: random.randint(1, 10))",
+                 "df['n'] = df['a'].apply(lambda v: random.choice(['x', 'y']))",
+                 "df['n'] = df['a'].apply(lambda v: random.uniform(0, 1))"):
+        optimized = processor.optimize_code(code)
+        assert 'np.' in optimized
+        assert validate_code(optimized).ok
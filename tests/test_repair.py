@@ -0,0 +1,31 @@
+from code_cache import CodeCache
+from repair import RepairStore, make_error
+
+
+def test_repair_lookups_do_not_count_as_code_cache_hits(tmp_path):
+    cache = CodeCache(str(tmp_path / 'cache.sqlite3'))
+    repairs = RepairStore(cache)
+    error = make_error('KeyError', "'Qty'", 1)
+    failed, fixed = "df['t'] = df['Qty'] * 2", "df['t'] = df['qty'] * 2"
+    assert repairs.lookup(failed, error, 'fp', ['qty']) is None
+    repairs.record(failed, error, 'fp', fixed)
+    assert repairs.lookup(failed, error, 'fp', ['qty']) == fixed
+    assert cache.stats()['hits'] == cache.stats()['misses'] == 0
+    cache.close()
+
+
+def test_rules_need_the_literal_in_the_error(tmp_path):
+    cache = CodeCache(str(tmp_path / 'cache.sqlite3'))
+    repairs = RepairStore(cache)
+    empty = make_error('InvalidResult', '执行后df为空表')
+    failed, fixed = "df = df[df['city'] == '北京']", "df = df[df['city'] == 'Beijing']"
+    repairs.record(failed, empty, 'fp', fixed)
+    # 空结果的修复只对原代码生效，不会变成替换规则套用到其他代码
+    assert repairs.lookup(failed, empty, 'fp', ['city']) == fixed
+    assert repairs.lookup("df = df[df['region'] == '北京']", empty, 'fp', ['region']) is None
+
+    missing = make_error('KeyError', "'Qty'")
+    repairs.record("df['t'] = df['Qty'] * 2", missing, 'fp', "df['t'] = df['qty'] * 2")
+    assert repairs.lookup("df['u'] = df['Qty'] + 1", missing, 'fp', ['qty']) == "df['u'] = df['qty'] + 1"
+    assert repairs.lookup("df['u'] = df['Qty'] + 1", missing, 'fp', ['amount']) is None
+    cache.close()
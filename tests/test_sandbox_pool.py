@@ -0,0 +1,22 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from sandbox_pool import SandboxPool
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(1, timeout=10)
+    yield pool
+    pool.close()
+
+
+def test_encode_failure_keeps_worker(pool):
+    lock = threading.Lock()  # 既不是Arrow类型也无法pickle
+    with pytest.raises(TypeError):
+        pool.run("df['b'] = 1", pd.DataFrame({'a': [lock, lock]}))
+    assert pool._idle.qsize() == 1
+    result = pool.run("df['b'] = df['a'] + 1", pd.DataFrame({'a': [1, 2]}))
+    assert result['b'].tolist() == [2, 3]
@@ -0,0 +1,32 @@
+import httpx
+import pandas as pd
+import pytest
+
+from code_cache import CodeCache
+from session_server import FrameCache, SessionManager, start_server
+
+
+@pytest.fixture
+def server(workdir):
+    manager = SessionManager(None, CodeCache(str(workdir / 'cache.sqlite3')), FrameCache(), root=str(workdir),
+                             spill_dir=str(workdir / 'spill'))
+    server = start_server(manager)
+    yield server
+    server.stop_reaper()
+    server.shutdown()
+
+
+def test_errors_are_json(server, workdir):
+    pd.DataFrame({'a': [1, 2]}).to_excel(workdir / 'in.xlsx', index=False)
+    with httpx.Client(base_url=server.url) as client:
+        response = client.post('/sessions', json={'path': 'missing.xlsx'})
+        assert response.status_code == 404
+        assert 'missing.xlsx' in response.json()['error']
+        assert client.post('/sessions', json={'path': '../outside.xlsx'}).status_code == 403
+        response = client.post('/sessions', json={'path': 'in.xlsx'})
+        assert response.status_code == 201
+        session = response.json()['session']
+        response = client.post(f'/sessions/{session}/sheet', json={'path': 'nope.xlsx'})
+        assert response.status_code == 404
+        assert 'nope.xlsx' in response.json()['error']
+        assert client.get(f'/sessions/{session}').status_code == 200
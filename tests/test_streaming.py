@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from main3 import ExcelAIProcessor
+from streaming import is_row_local
+
+ROW_LOCAL = [
+    "df['n'] = df['a'] * 2",
+    "df = df[df['a'] > 3]",
+    "df['s'] = df['s'].str.strip().str.upper()",
+    "df['t'] = df['s'].str[:1]",
+    "df['n'] = df[['a', 'b']].sum(axis=1)",
+    "df['n'] = np.where(df['a'] > 3, 'y', 'n')",
+    "df['n'] = df.apply(lambda r: r['a'] + r['b'], axis=1)",
+    "df.loc[df['a'] > 3, 'b'] = 0",
+    "df['n'] = df.index + 1",
+    "df = df.query('a > 3')",
+    "df = df.drop(columns=['b'])",
+]
+
+WHOLE_FRAME = [
+    "df['n'] = np.arange(1, len(df) + 1)",
+    "df = df[:2]",
+    "df['n'] = df['a'][-3:]",
+    "df['n'] = df.shape[0]",
+    "df['n'] = df.size",
+    "df['n'] = len(df)",
+    "df['n'] = df['s'].str.cat(sep=',')",
+    "df['n'] = df['a'].cumsum()",
+    "df['n'] = df['a'].rank()",
+    "df['n'] = df['a'] - df['a'].mean()",
+    "df['n'] = np.mean(df['a'])",
+    "df = df.sort_values('a')",
+    "df = df.iloc[:2]",
+    "df = df.drop(0)",
+    "df['n'] = pd.Series(range(len(df)))",
+    "df = df.apply(lambda c: c / c.sum())",
+]
+
+
+@pytest.mark.parametrize('code', WHOLE_FRAME)
+def test_whole_frame_code_rejected(code):
+    assert not is_row_local(code)
+
+
+def _source(path):
+    pd.DataFrame({'a': np.arange(10), 'b': np.arange(10) * 10, 's': [f' x{i} ' for i in range(10)]}).to_excel(
+        path, index=False)
+
+
+@pytest.mark.parametrize('code', ROW_LOCAL)
+def test_streaming_matches_whole_frame(workdir, code):
+    _source('in.xlsx')
+    assert is_row_local(code)
+    whole = ExcelAIProcessor()
+    assert whole.read_excel('in.xlsx')
+    assert whole.safe_execute(code)
+    assert whole.save_excel('whole.xlsx')
+
+    streaming = ExcelAIProcessor()
+    assert streaming.read_excel('in.xlsx', chunksize=3)
+    assert streaming.safe_execute(code)
+    assert streaming.save_excel('chunked.xlsx')
+    pd.testing.assert_frame_equal(pd.read_excel('chunked.xlsx'), pd.read_excel('whole.xlsx'))
+
+
+def test_streaming_refuses_positional_code(workdir):
+    _source('in.xlsx')
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('in.xlsx', chunksize=3)
+    assert not processor.safe_execute("df['n'] = np.arange(1, len(df) + 1)")
+
+
+def test_element_lambdas_are_row_local():
+    assert is_row_local("df['s'] = df['s'].map(lambda v: v.strip().upper())")
+    assert not is_row_local("df['n'] = df['a'].apply(lambda v: v / df['a'].sum())")
+    assert not is_row_local("df['n'] = df['a'].apply(lambda df: df.sum())\ndf = df.sort_values('a')")
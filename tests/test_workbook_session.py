@@ -0,0 +1,45 @@
+import pandas as pd
+import pytest
+
+from main3 import ExcelAIProcessor
+
+
+def _two_sheets(path):
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame({'id': [1, 2, 3], 'v': [1.0, 2.0, 3.0]}).to_excel(writer, sheet_name='A', index=False)
+        pd.DataFrame({'id': [1, 2, 3], 'age': [30, 40, 50]}).to_excel(writer, sheet_name='B', index=False)
+
+
+@pytest.mark.filterwarnings('ignore::pandas.errors.ChainedAssignmentError')
+def test_sheets_accessor_is_read_only(workdir):
+    _two_sheets('two.xlsx')
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('two.xlsx')
+    assert processor.safe_execute("sheets['B']['age'] = 0\nsheets['A']['v'] = 0\ndf['z'] = 1")
+    workbook = processor.workbook
+    assert workbook.get('B')['age'].tolist() == [30, 40, 50]
+    assert 'B' not in workbook.dirty
+    assert processor.df['v'].tolist() == [1.0, 2.0, 3.0]
+    assert processor.safe_execute("df['age'] = df['id'].map(sheets['B'].set_index('id')['age'])")
+    assert processor.df['age'].tolist() == [30, 40, 50]
+
+
+def test_header_is_the_same_for_patch_and_full_save(workdir):
+    pd.DataFrame({'unit price': [3.0, 1.0, 2.0], 'qty': [1, 2, 3]}).to_excel('prices.xlsx', index=False)
+    headers = {}
+    for name, code in (('patch', "df.loc[0, 'qty'] = 9"), ('full', "df = df.sort_values('unit_price')")):
+        processor = ExcelAIProcessor()
+        assert processor.read_excel('prices.xlsx')
+        assert processor.safe_execute(code)
+        processor.save_excel(f'{name}.xlsx')
+        headers[name] = list(pd.read_excel(f'{name}.xlsx').columns)
+    assert headers['patch'] == headers['full'] == ['unit price', 'qty']
+
+
+def test_new_column_keeps_its_name(workdir):
+    pd.DataFrame({'unit price': [3.0, 1.0], 'qty': [1, 2]}).to_excel('prices.xlsx', index=False)
+    processor = ExcelAIProcessor()
+    assert processor.read_excel('prices.xlsx')
+    assert processor.safe_execute("df['total'] = df['unit_price'] * df['qty']")
+    processor.save_excel('out.xlsx')
+    assert list(pd.read_excel('out.xlsx').columns) == ['unit price', 'qty', 'total']
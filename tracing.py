@@ -0,0 +1,205 @@
+import contextlib
+import functools
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+
+def frame_nbytes(df):
+    """DataFrame占用的内存（字节）；不做deep统计，避免遍历object列"""
+    if df is None:
+        return None
+    return int(df.memory_usage(index=True, deep=False).sum())
+
+
+class MemorySink:
+    """保存在内存中，便于测试与交互查看"""
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+    def spans(self, name=None):
+        return [r for r in self.records if r['type'] == 'span' and (name is None or r['name'] == name)]
+
+    def close(self):
+        pass
+
+
+class JsonLogSink:
+    """每条记录一行JSON，追加写入"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def emit(self, record):
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for v in labels.values())
+    return '{' + ','.join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + '}'
+
+
+class PrometheusSink:
+    """汇总为Prometheus文本格式（供node_exporter textfile采集），按间隔原子重写文件"""
+
+    def __init__(self, path, prefix='excel_ai', interval=5.0):
+        self.path = path
+        self.prefix = prefix
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._span_sum = defaultdict(float)
+        self._span_count = defaultdict(int)
+        self._counters = defaultdict(float)
+        self._gauges = {}
+        self._written = 0.0
+
+    def _metric(self, name):
+        return f"{self.prefix}_{re.sub(r'[^a-zA-Z0-9_]', '_', name)}"
+
+    def emit(self, record):
+        key = (record['name'], tuple(sorted(record.get('labels', {}).items())))
+        with self._lock:
+            if record['type'] == 'span':
+                self._span_sum[record['name']] += record['duration_ms'] / 1000
+                self._span_count[record['name']] += 1
+            elif record['type'] == 'counter':
+                self._counters[key] += record['value']
+            elif record['type'] == 'gauge':
+                self._gauges[key] = record['value']
+            due = time.monotonic() - self._written >= self.interval
+        if due:
+            self.write()
+
+    def render(self):
+        lines = [f"# TYPE {self.prefix}_span_seconds summary"]
+        for name in sorted(self._span_count):
+            label = _labels({'span': name})
+            lines.append(f"{self.prefix}_span_seconds_sum{label} {self._span_sum[name]:.6f}")
+            lines.append(f"{self.prefix}_span_seconds_count{label} {self._span_count[name]}")
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{self._metric(name)}_total{_labels(dict(labels))} {value:g}")
+        for (name, labels), value in sorted(self._gauges.items()):
+            lines.append(f"{self._metric(name)}{_labels(dict(labels))} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        with self._lock:
+            text = self.render()
+            self._written = time.monotonic()
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(suffix='.prom', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def close(self):
+        self.write()
+
+
+class Tracer:
+    """记录各阶段耗时（span）、计数器和gauge，分发给一个或多个sink；没有sink时几乎无开销"""
+
+    def __init__(self, sinks=()):
+        self.sinks = list(sinks)
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _emit(self, record):
+        for sink in self.sinks:
+            sink.emit(record)
+
+    @contextlib.contextmanager
+    def span(self, name, **attrs):
+        if not self.sinks:
+            yield attrs
+            return
+        stack = self._stack()
+        record = {'type': 'span', 'name': name, 'ts': time.time(),
+                  'parent': stack[-1]['name'] if stack else None, 'attrs': attrs}
+        stack.append(record)
+        start = time.perf_counter()
+        try:
+            yield attrs
+        except BaseException as e:
+            attrs['error'] = type(e).__name__
+            raise
+        finally:
+            record['duration_ms'] = (time.perf_counter() - start) * 1000
+            stack.pop()
+            self._emit(record)
+
+    def annotate(self, **attrs):
+        """给当前span补充属性（如token数、缓存是否命中）"""
+        stack = self._stack() if self.sinks else None
+        if stack:
+            stack[-1]['attrs'].update(attrs)
+
+    def count(self, name, value=1, **labels):
+        if self.sinks:
+            self._emit({'type': 'counter', 'name': name, 'ts': time.time(), 'value': value, 'labels': labels})
+
+    def gauge(self, name, value, **labels):
+        if self.sinks:
+            self._emit({'type': 'gauge', 'name': name, 'ts': time.time(), 'value': value, 'labels': labels})
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+def traced(name=None, frame=False, profile=False, status=True):
+    """方法装饰器：用self.tracer记录span；frame=True时记录self.df执行前后的内存，
+    profile=True时在self.profiler存在的情况下对该方法做cProfile，status=True时按返回值记录是否成功"""
+    def decorator(method):
+        span_name = name or method.__name__.lstrip('_')
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler if profile else None
+            if not self.tracer.sinks and profiler is None:
+                return method(self, *args, **kwargs)
+            with self.tracer.span(span_name) as attrs:
+                if frame and self.tracer.sinks:
+                    attrs['df_bytes_before'] = frame_nbytes(self.df)
+                if profiler is not None:
+                    profiler.enable()
+                try:
+                    result = method(self, *args, **kwargs)
+                finally:
+                    if profiler is not None:
+                        profiler.disable()
+                if frame and self.tracer.sinks:
+                    attrs['df_bytes_after'] = frame_nbytes(self.df)
+                    attrs['shape'] = list(self.df.shape) if self.df is not None else None
+                if status:
+                    attrs['ok'] = result is not None and result is not False
+                return result
+        return wrapper
+    return decorator
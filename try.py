@@ -3,17 +3,13 @@ import pandas as pd  # 核心数据分析库
 import os  # 操作系统接口
 import re  # 正则表达式处理
 import random  # 随机数生成
-from openpyxl import load_workbook  # Excel文件读写支持[1](@ref)
-from openai import OpenAI  # OpenAI API客户端
+from startup import preload  # 后台预先导入openai等模块
 
 class ExcelAIProcessor:
     def __init__(self):
         """初始化处理器核心组件"""
         self.df = None  # 存储Excel数据的DataFrame
-        self.client = OpenAI(  # 配置安全API客户端
-            api_key=os.getenv("DASHSCOPE_API_KEY"),  # 从环境变量获取API密钥
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"  # 阿里云兼容端点
-        )
+        self._client = None  # API客户端在首次请求模型时创建
         self.safe_globals = {  # 创建沙箱执行环境
             'pd': pd,  # 仅允许访问pandas
             'df': None,  # 数据容器占位符
@@ -25,6 +21,17 @@ class ExcelAIProcessor:
             }
         }
 
+    @property
+    def client(self):
+        """首次请求模型时才导入openai并创建客户端，之后复用"""
+        if self._client is None:
+            from openai import OpenAI  # OpenAI API客户端
+            self._client = OpenAI(  # 配置安全API客户端
+                api_key=os.getenv("DASHSCOPE_API_KEY"),  # 从环境变量获取API密钥
+                base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"  # 阿里云兼容端点
+            )
+        return self._client
+
     def read_excel(self, file_path):
         """读取并预处理Excel文件"""
         try:
@@ -142,6 +149,8 @@ class ExcelAIProcessor:
 if __name__ == "__main__":
     # 创建处理器实例
     processor = ExcelAIProcessor()
+    # 等待输入时在后台导入openai和to_markdown依赖的tabulate
+    preload('openai', 'tabulate')
     
     # 获取输入文件路径
     input_file = input("请输入Excel文件路径: ").strip()
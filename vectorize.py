@@ -0,0 +1,276 @@
+import ast
+import copy
+
+import pandas as pd
+
+STR_METHODS = {
+    'upper', 'lower', 'strip', 'lstrip', 'rstrip', 'title', 'capitalize', 'swapcase', 'zfill',
+    'startswith', 'endswith', 'split', 'center', 'ljust', 'rjust', 'isdigit', 'isalpha', 'isnumeric',
+    'find', 'count',
+}
+CAST_CALLS = {'str': 'str', 'int': 'int', 'float': 'float'}
+COMPARE_OPS = (ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE)
+
+
+def _parse_expr(src):
+    return ast.parse(src, mode='eval').body
+
+
+def _call(func, *args, **kwargs):
+    return ast.Call(func=func, args=list(args), keywords=[ast.keyword(arg=k, value=v) for k, v in kwargs.items()])
+
+
+def _attr(value, *names):
+    for name in names:
+        value = ast.Attribute(value=value, attr=name, ctx=ast.Load())
+    return value
+
+
+class _Context:
+    """一次改写的上下文：lambda参数对应的Series、行变量、索引与长度表达式"""
+
+    def __init__(self, var=None, series=None, row=None, frame=None):
+        self.var = var
+        self.series = series
+        self.row = row
+        self.frame = frame
+        base = series if series is not None else frame
+        self.index = _attr(copy.deepcopy(base), 'index')
+        self.size = _call(ast.Name(id='len', ctx=ast.Load()), copy.deepcopy(base))
+        self.random = False
+
+
+def _is_bool(node):
+    return isinstance(node, (ast.Compare, ast.BoolOp)) or (
+        isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+
+
+def _random_call(node, ctx):
+    """random.xxx(...) → 一次生成整列的numpy随机数"""
+    if not (isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name)
+            and node.func.value.id == 'random' and not node.keywords):
+        return None
+    rng = _call(_parse_expr('np.random.default_rng'))
+    name, args = node.func.attr, node.args
+    if name == 'randint' and len(args) == 2:
+        values = _call(_attr(rng, 'integers'), *args, endpoint=ast.Constant(True), size=ctx.size)
+    elif name == 'random' and not args:
+        values = _call(_attr(rng, 'random'), ctx.size)
+    elif name == 'uniform' and len(args) == 2:
+        values = _call(_attr(rng, 'uniform'), *args, ctx.size)
+    elif name == 'choice' and len(args) == 1:
+        values = _call(_attr(rng, 'choice'), _call(ast.Name(id='list', ctx=ast.Load()), args[0]), ctx.size)
+    else:
+        return None
+    ctx.random = True
+    return _call(_attr(ast.Name(id='pd', ctx=ast.Load()), 'Series'), values, index=copy.deepcopy(ctx.index))
+
+
+def _translate(node, ctx):
+    """把逐元素表达式翻译为列运算；返回 (节点, 是否为Series)，无法翻译时返回 None"""
+    if isinstance(node, ast.Constant):
+        return node, False
+    if isinstance(node, ast.Name):
+        if ctx.var is not None and node.id == ctx.var:
+            return copy.deepcopy(ctx.series), True
+        return None
+    if ctx.row is not None and isinstance(node, ast.Subscript) and isinstance(node.value, ast.Name) \
+            and node.value.id == ctx.row and isinstance(node.slice, ast.Constant):
+        return ast.Subscript(value=copy.deepcopy(ctx.frame), slice=node.slice, ctx=ast.Load()), True
+    if ctx.row is not None and isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) \
+            and node.value.id == ctx.row:
+        return ast.Subscript(value=copy.deepcopy(ctx.frame), slice=ast.Constant(node.attr), ctx=ast.Load()), True
+    if isinstance(node, (ast.List, ast.Tuple)):
+        items = [_translate(e, ctx) for e in node.elts]
+        if any(i is None or i[1] for i in items):
+            return None
+        return node, False
+
+    if isinstance(node, ast.BinOp):
+        left, right = _translate(node.left, ctx), _translate(node.right, ctx)
+        if left is None or right is None:
+            return None
+        return ast.BinOp(left=left[0], op=node.op, right=right[0]), left[1] or right[1]
+    if isinstance(node, ast.UnaryOp):
+        operand = _translate(node.operand, ctx)
+        if operand is None:
+            return None
+        if isinstance(node.op, ast.Not):
+            if not (operand[1] and _is_bool(node.operand)):
+                return None
+            return ast.UnaryOp(op=ast.Invert(), operand=operand[0]), True
+        return ast.UnaryOp(op=node.op, operand=operand[0]), operand[1]
+    if isinstance(node, ast.Compare):
+        parts = [_translate(n, ctx) for n in [node.left] + node.comparators]
+        if any(p is None for p in parts):
+            return None
+        terms = []
+        for i, op in enumerate(node.ops):
+            left, right = parts[i], parts[i + 1]
+            if isinstance(op, COMPARE_OPS):
+                terms.append((ast.Compare(left=left[0], ops=[op], comparators=[right[0]]), left[1] or right[1]))
+            elif isinstance(op, (ast.In, ast.NotIn)) and left[1] and not right[1] \
+                    and isinstance(node.comparators[i], (ast.List, ast.Tuple, ast.Set)):
+                test = _call(_attr(left[0], 'isin'), right[0])
+                terms.append((test if isinstance(op, ast.In) else ast.UnaryOp(op=ast.Invert(), operand=test), True))
+            else:
+                return None
+        result, is_series = terms[0]
+        for term, term_series in terms[1:]:
+            result = ast.BinOp(left=result, op=ast.BitAnd(), right=term)
+            is_series = is_series or term_series
+        return result, is_series
+    if isinstance(node, ast.BoolOp):
+        if not all(_is_bool(v) for v in node.values):
+            return None
+        values = [_translate(v, ctx) for v in node.values]
+        if any(v is None for v in values):
+            return None
+        op = ast.BitAnd() if isinstance(node.op, ast.And) else ast.BitOr()
+        result = values[0][0]
+        for value in values[1:]:
+            result = ast.BinOp(left=result, op=op, right=value[0])
+        return result, any(v[1] for v in values)
+    if isinstance(node, ast.IfExp):
+        test, body, orelse = (_translate(n, ctx) for n in (node.test, node.body, node.orelse))
+        if test is None or body is None or orelse is None or not test[1]:
+            return None
+        base = body[0] if body[1] else _call(_attr(ast.Name(id='pd', ctx=ast.Load()), 'Series'),
+                                             body[0], index=copy.deepcopy(ctx.index))
+        return _call(_attr(base, 'where'), test[0], orelse[0]), True
+    if isinstance(node, ast.Subscript):
+        value = _translate(node.value, ctx)
+        if value is None or not value[1] or not isinstance(node.slice, (ast.Constant, ast.Slice, ast.UnaryOp)):
+            return None
+        return ast.Subscript(value=_attr(value[0], 'str'), slice=node.slice, ctx=ast.Load()), True
+    if isinstance(node, ast.Call):
+        random_values = _random_call(node, ctx)
+        if random_values is not None:
+            return random_values, True
+        if node.keywords:
+            return None
+        if isinstance(node.func, ast.Name) and len(node.args) == 1:
+            arg = _translate(node.args[0], ctx)
+            if arg is None or not arg[1]:
+                return None
+            if node.func.id == 'len':
+                return _call(_attr(arg[0], 'str', 'len')), True
+            if node.func.id in CAST_CALLS:
+                return _call(_attr(arg[0], 'astype'), ast.Name(id=CAST_CALLS[node.func.id], ctx=ast.Load())), True
+            return None
+        if isinstance(node.func, ast.Attribute):
+            target = _translate(node.func.value, ctx)
+            args = [_translate(a, ctx) for a in node.args]
+            if target is None or not target[1] or any(a is None or a[1] for a in args):
+                return None
+            method = node.func.attr
+            if method == 'replace' and len(args) == 2:
+                return _call(_attr(target[0], 'str', 'replace'), *(a[0] for a in args),
+                             regex=ast.Constant(False)), True
+            if method in STR_METHODS:
+                return _call(_attr(target[0], 'str', method), *(a[0] for a in args)), True
+    return None
+
+
+class _Vectorizer(ast.NodeTransformer):
+    def __init__(self):
+        self.changed = False
+        self.random = False
+
+    def _accept(self, ctx, body):
+        result = _translate(body, ctx)
+        if result is None or not result[1]:
+            return None
+        self.changed = True
+        self.random = self.random or ctx.random
+        return result[0]
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if not (isinstance(func, ast.Attribute) and func.attr in ('apply', 'map')
+                and len(node.args) == 1 and isinstance(node.args[0], ast.Lambda)
+                and len(node.args[0].args.args) == 1):
+            return node
+        lam = node.args[0]
+        var = lam.args.args[0].arg
+        owner = func.value
+        is_frame = isinstance(owner, ast.Name) and owner.id == 'df'
+        if is_frame and func.attr == 'apply' and len(node.keywords) == 1 and node.keywords[0].arg == 'axis' \
+                and isinstance(node.keywords[0].value, ast.Constant) and node.keywords[0].value.value in (1, 'columns'):
+            return self._accept(_Context(row=var, frame=owner), lam.body) or node
+        if not is_frame and not node.keywords and self._is_column(owner):
+            return self._accept(_Context(var=var, series=owner), lam.body) or node
+        return node
+
+    def visit_ListComp(self, node):
+        self.generic_visit(node)
+        if len(node.generators) != 1 or node.generators[0].ifs or node.generators[0].is_async:
+            return node
+        gen = node.generators[0]
+        if not isinstance(gen.target, ast.Name):
+            return node
+        used = {n.id for n in ast.walk(node.elt) if isinstance(n, ast.Name)}
+        if self._is_column(gen.iter):
+            return self._accept(_Context(var=gen.target.id, series=gen.iter), node.elt) or node
+        if gen.target.id not in used and self._is_len_range(gen.iter):
+            return self._accept(_Context(frame=ast.Name(id='df', ctx=ast.Load())), node.elt) or node
+        return node
+
+    @staticmethod
+    def _is_column(node):
+        base = node.value if isinstance(node, (ast.Subscript, ast.Attribute)) else None
+        if not (isinstance(base, ast.Name) and base.id == 'df'):
+            return False
+        if isinstance(node, ast.Subscript):
+            return isinstance(node.slice, ast.Constant)
+        return node.attr not in ('index', 'columns', 'values', 'loc', 'iloc', 'T')
+
+    @staticmethod
+    def _is_len_range(node):
+        return (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'range'
+                and len(node.args) == 1 and isinstance(node.args[0], ast.Call)
+                and isinstance(node.args[0].func, ast.Name) and node.args[0].func.id == 'len'
+                and len(node.args[0].args) == 1 and isinstance(node.args[0].args[0], ast.Name)
+                and node.args[0].args[0].id == 'df')
+
+
+def vectorize_code(code):
+    """把逐行apply/map/列表推导改写为向量化代码；返回 (新代码, 是否含随机数)，无可改写时返回 (None, False)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None, False
+    vectorizer = _Vectorizer()
+    tree = ast.fix_missing_locations(vectorizer.visit(tree))
+    if not vectorizer.changed:
+        return None, False
+    return ast.unparse(tree), vectorizer.random
+
+
+def _equivalent(a, b, random_values):
+    if not isinstance(a, pd.DataFrame) or not isinstance(b, pd.DataFrame):
+        return False
+    if list(a.columns) != list(b.columns) or not a.index.equals(b.index):
+        return False
+    if random_values:
+        # 随机数无法逐值比较，只检查结构与数值/非数值类别
+        return all(pd.api.types.is_numeric_dtype(a[c]) == pd.api.types.is_numeric_dtype(b[c]) for c in a.columns)
+    try:
+        pd.testing.assert_frame_equal(a, b, check_dtype=False)
+        return True
+    except AssertionError:
+        return False
+
+
+def verify_rewrite(original, rewritten, sample, run, random_values=False):
+    """在样例上分别执行原代码与改写代码，结果一致才采用改写"""
+    try:
+        expected = run(original, sample.copy())
+    except Exception:
+        return False
+    try:
+        actual = run(rewritten, sample.copy())
+    except Exception:
+        return False
+    return _equivalent(expected, actual, random_values)
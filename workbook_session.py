@@ -0,0 +1,228 @@
+import os
+import shutil
+import tempfile
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from compact import compact_frame, expand_frame
+from history import History
+from sidecar import read_excel_cached
+from streaming import StreamingWriter, to_cell
+from xlsx_patch import NotPatchable, patch_workbook, plan_patch
+
+try:
+    import xlsxwriter
+except ImportError:  # 未安装xlsxwriter时使用openpyxl的write-only模式
+    xlsxwriter = None
+
+# 修改的单元格超过该比例时整表重写比逐单元格回写更快
+PATCH_RATIO = 0.5
+
+SaveReport = namedtuple('SaveReport', ['mode', 'sheets', 'cells', 'bytes', 'seconds', 'reason'])
+
+
+def list_sheet_names(path):
+    """只读取workbook.xml中的元数据列出工作表，不解析任何表格内容"""
+    try:
+        wb = load_workbook(path, read_only=True)
+    except Exception:
+        with pd.ExcelFile(path) as xls:  # .xls等openpyxl不支持的格式
+            return list(xls.sheet_names)
+    try:
+        return list(wb.sheetnames)
+    finally:
+        wb.close()
+
+
+def write_full(output_path, df, sheet_title=None):
+    """单工作表整表快速写入：优先xlsxwriter常量内存模式，否则openpyxl write-only"""
+    if xlsxwriter is None:
+        writer = StreamingWriter(output_path, sheet_title)
+        writer.append(df)
+        writer.save()
+        return
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(output_path)))
+    os.close(fd)
+    try:
+        wb = xlsxwriter.Workbook(tmp_path, {
+            'constant_memory': True, 'strings_to_urls': False, 'strings_to_formulas': False,
+            'default_date_format': 'yyyy-mm-dd hh:mm:ss', 'remove_timezone': True,
+        })
+        ws = wb.add_worksheet(sheet_title)
+        ws.write_row(0, 0, [str(c) for c in df.columns])
+        for i, row in enumerate(df.itertuples(index=False, name=None), start=1):
+            ws.write_row(i, 0, [to_cell(v) for v in row])
+        wb.close()
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def replace_sheet(wb, title, df):
+    """用DataFrame重写指定工作表，保留位置、列宽和冻结窗格"""
+    ws = wb[title]
+    index = wb.index(ws)
+    widths = {key: dim.width for key, dim in ws.column_dimensions.items() if dim.width}
+    freeze = ws.freeze_panes
+    wb.remove(ws)
+    new = wb.create_sheet(title, index)
+    new.append([str(c) for c in df.columns])
+    for row in df.itertuples(index=False, name=None):
+        new.append([to_cell(v) for v in row])
+    for key, width in widths.items():
+        new.column_dimensions[key].width = width
+    new.freeze_panes = freeze
+    return new
+
+
+class WorkbookSession:
+    """工作簿会话：按元数据列出工作表，按需加载，保存时只回写修改过的工作表"""
+
+    def __init__(self, path, standardize, compact=False, loader=read_excel_cached):
+        self.path = os.path.abspath(path)
+        self.name = os.path.basename(path)
+        self.sheet_names = list_sheet_names(path)
+        self.standardize = standardize
+        self.compact = compact
+        self.loader = loader
+        self.compacted = {}
+        self.frames = {}
+        self.originals = {}
+        self.column_maps = {}
+        self.histories = {}
+        self.from_sidecar = {}
+        self.dirty = set()
+
+    def is_loaded(self, sheet):
+        return sheet in self.frames
+
+    def get(self, sheet):
+        if sheet not in self.frames:
+            df, from_sidecar = self.loader(self.path, sheet_name=sheet)
+            original_columns = df.columns.tolist()
+            # 加载器返回的DataFrame可能被多个会话共享，不原地修改列名
+            df = df.set_axis(self.standardize(df.columns), axis=1)
+            self.column_maps[sheet] = dict(zip(map(str, original_columns), df.columns))
+            self.from_sidecar[sheet] = from_sidecar
+            if self.compact:
+                df, self.compacted[sheet] = compact_frame(df)
+            self.frames[sheet] = self.originals[sheet] = df
+        return self.frames[sheet]
+
+    def update(self, sheet, df):
+        self.frames[sheet] = df
+        self.dirty.add(sheet)
+
+    def history(self, sheet):
+        return self.histories.setdefault(sheet, History())
+
+    def unload_clean(self):
+        """释放没有修改也没有撤销记录的工作表，之后访问时重新加载"""
+        for sheet in list(self.frames):
+            history = self.histories.get(sheet)
+            if sheet not in self.dirty and not (history and (history.undo_stack or history.redo_stack)):
+                for state in (self.frames, self.originals, self.compacted, self.from_sidecar, self.histories):
+                    state.pop(sheet, None)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['loader'] = None  # 共享加载器（含锁）不参与序列化，恢复后重新指定
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.loader = self.loader or read_excel_cached
+
+    def original_dtypes(self, sheet):
+        """压缩过的列 → 读取时的类型；未压缩时为空"""
+        report = self.compacted.get(sheet)
+        return report.dtypes if report else {}
+
+    def _with_headers(self, sheet, df):
+        """写出时表头使用标准化前的原始列名，补丁回写与整表重写得到相同的表头；新增的列使用当前列名"""
+        headers = {}
+        for name, standardized in self.column_maps[sheet].items():
+            headers.setdefault(standardized, name)
+        return df.set_axis([headers.get(c, c) for c in df.columns], axis=1)
+
+    def export(self, sheet):
+        """按读取时的类型和原始列名导出工作表，整表写出时与未压缩时写入相同的值"""
+        return self._with_headers(sheet, expand_frame(self.frames[sheet], self.original_dtypes(sheet)))
+
+    def save(self, output_path=None):
+        """只回写修改过的单元格；改动过多或结构变化时整表重写，返回SaveReport"""
+        start = time.perf_counter()
+        output_path = os.path.abspath(output_path or self.path)
+        sheets = sorted(self.dirty, key=self.sheet_names.index)
+        if not sheets:
+            if output_path == self.path:
+                return SaveReport('none', [], 0, 0, 0.0, None)
+            shutil.copyfile(self.path, output_path)
+            return SaveReport('copy', [], 0, os.path.getsize(output_path), time.perf_counter() - start, None)
+
+        reason = None
+        try:
+            frames = {sheet: self._with_headers(sheet, self.frames[sheet]) for sheet in sheets}
+            originals = {sheet: self._with_headers(sheet, self.originals[sheet]) for sheet in sheets}
+            patches = [plan_patch(sheet, originals[sheet], frames[sheet]) for sheet in sheets]
+            changed = sum(p.cells for p in patches)
+            if changed > PATCH_RATIO * sum(p.total for p in patches):
+                raise NotPatchable(f"修改了{changed}个单元格，超过{PATCH_RATIO:.0%}")
+            written = patch_workbook(self.path, output_path, patches, frames, originals)
+            mode, cells = 'patch', changed
+        except NotPatchable as e:
+            reason = str(e)
+            written, cells = self._save_full(output_path, sheets)
+            mode = 'full'
+
+        if output_path == self.path:
+            for sheet in sheets:
+                self.originals[sheet] = self.frames[sheet]
+            self.dirty.clear()
+        return SaveReport(mode, sheets, cells, written, time.perf_counter() - start, reason)
+
+    def _save_full(self, output_path, sheets):
+        cells = sum((len(self.frames[s]) + 1) * len(self.frames[s].columns) for s in sheets)
+        if len(self.sheet_names) == 1:
+            write_full(output_path, self.export(sheets[0]), sheets[0])
+            return os.path.getsize(output_path), cells
+        # 多工作表时用openpyxl打开原工作簿，只重建修改过的工作表，其余工作表保持原格式
+        wb = load_workbook(self.path)
+        for sheet in sheets:
+            replace_sheet(wb, sheet, self.export(sheet))
+        fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(output_path))
+        os.close(fd)
+        try:
+            wb.save(tmp_path)
+            os.replace(tmp_path, output_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return os.path.getsize(output_path), cells
+
+
+class SheetAccessor(Mapping):
+    """注入沙箱的 sheets['表名'] / sheets['文件名/表名']，按需加载其他工作表（只读）；
+    返回副本，代码对其赋值不会改动已加载的工作表。写时复制下浅拷贝即可，deep=True用于未开启写时复制的pandas"""
+
+    def __init__(self, resolve, names, deep=False):
+        self._resolve = resolve
+        self._names = names
+        self._deep = deep
+
+    def __getitem__(self, key):
+        df = self._resolve(key)
+        if df is None:
+            raise KeyError(f"找不到工作表: {key}")
+        return df.copy(deep=self._deep)
+
+    def __iter__(self):
+        return iter(self._names())
+
+    def __len__(self):
+        return len(self._names())
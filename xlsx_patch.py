@@ -0,0 +1,232 @@
+import bisect
+import datetime
+import os
+import posixpath
+import re
+import tempfile
+import zipfile
+from collections import namedtuple
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+from openpyxl.utils import column_index_from_string, get_column_letter
+from openpyxl.utils.datetime import to_excel
+
+from history import _same_buffer
+from streaming import to_cell
+
+NS_MAIN = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+NS_REL = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+NS_PKG_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+ROW_START_RE = re.compile(r'<row\b[^>]*?\br="(\d+)"[^>]*?(/?)>')
+CELL_RE = re.compile(r'<c\b[^>]*?(?:/>|>.*?</c>)', re.S)
+CELL_REF_RE = re.compile(r'\br="([A-Z]+)(\d+)"')
+STYLE_RE = re.compile(r'\bs="(\d+)"')
+SPANS_RE = re.compile(r'\s+spans="[^"]*"')
+DIMENSION_RE = re.compile(r'<dimension\b[^>]*/>')
+HAS_VALUE_RE = re.compile(r'<(?:v|is)\b')
+
+SheetPatch = namedtuple('SheetPatch', ['sheet', 'cells', 'changes', 'total', 'nrows', 'ncols'])
+
+
+class NotPatchable(Exception):
+    """原文件结构或修改内容不适合逐单元格回写，需要整表重写"""
+
+
+def _sheet_parts(zin):
+    """工作表名称 → 压缩包内的XML路径"""
+    workbook = ElementTree.fromstring(zin.read('xl/workbook.xml'))
+    rels = ElementTree.fromstring(zin.read('xl/_rels/workbook.xml.rels'))
+    targets = {rel.get('Id'): rel.get('Target') for rel in rels.iter(f'{NS_PKG_REL}Relationship')}
+    parts = {}
+    for sheet in workbook.iter(f'{NS_MAIN}sheet'):
+        target = targets.get(sheet.get(f'{NS_REL}id'), '')
+        parts[sheet.get('name')] = target.lstrip('/') if target.startswith('/') \
+            else posixpath.normpath(posixpath.join('xl', target))
+    return parts
+
+
+def _changed_rows(original, current):
+    """逐列比较，返回 {列位置: 需要写入的行位置数组}，以及需要重写表头的列位置"""
+    n, m = len(original), len(original.columns)
+    changes, headers = {}, []
+    for j in range(len(current.columns)):
+        new = current.iloc[:, j]
+        if j >= m:
+            headers.append(j)
+            changes[j] = np.flatnonzero(new.notna().to_numpy())
+            continue
+        if current.columns[j] != original.columns[j]:
+            headers.append(j)
+        old = original.iloc[:, j]
+        head = new.iloc[:n]
+        if _same_buffer(head, old):
+            rows = np.empty(0, dtype=np.intp)
+        else:
+            try:
+                same = np.asarray(head.to_numpy() == old.to_numpy(), dtype=bool)
+                same = same | (head.isna().to_numpy() & old.isna().to_numpy())
+            except (TypeError, ValueError):
+                same = None
+            # 类型不可比较时按整列修改处理
+            rows = np.flatnonzero(~same) if same is not None and same.shape == (n,) else np.arange(n)
+        if len(current) > n:
+            rows = np.concatenate([rows, n + np.flatnonzero(new.iloc[n:].notna().to_numpy())])
+        if len(rows):
+            changes[j] = rows
+    return changes, headers
+
+
+def plan_patch(sheet, original, current):
+    """比较加载时的数据与当前数据；行列只增不减且行顺序不变时才能逐单元格回写"""
+    if len(current) < len(original) or len(current.columns) < len(original.columns):
+        raise NotPatchable("删除了行或列")
+    if not current.index[:len(original)].equals(original.index):
+        raise NotPatchable("行顺序发生变化")
+    changes, headers = _changed_rows(original, current)
+    total = max(len(current), 1) * max(len(current.columns), 1)
+    cells = sum(len(rows) for rows in changes.values()) + len(headers)
+    return SheetPatch(sheet, cells, (changes, headers), total, len(current), len(current.columns))
+
+
+def _cell_xml(ref, value, style):
+    """生成单个单元格的XML；字符串使用内联字符串，不改动sharedStrings"""
+    s = f' s="{style}"' if style else ''
+    value = to_cell(value)
+    if value is None:
+        return f'<c r="{ref}"{s}/>' if style else ''
+    if isinstance(value, bool):
+        return f'<c r="{ref}"{s} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        if isinstance(value, float) and not np.isfinite(value):
+            raise NotPatchable(f"单元格{ref}为无穷大")
+        return f'<c r="{ref}"{s}><v>{value!r}</v></c>'
+    if isinstance(value, (datetime.datetime, datetime.date, pd.Timestamp)):
+        if not style:
+            raise NotPatchable(f"单元格{ref}缺少日期格式")
+        return f'<c r="{ref}"{s}><v>{to_excel(value)!r}</v></c>'
+    if not isinstance(value, str):
+        raise NotPatchable(f"单元格{ref}的类型{type(value).__name__}无法直接回写")
+    if ILLEGAL_CHARACTERS_RE.search(value):
+        raise NotPatchable(f"单元格{ref}包含非法字符")
+    space = ' xml:space="preserve"' if value != value.strip() else ''
+    return f'<c r="{ref}"{s} t="inlineStr"><is><t{space}>{escape(value)}</t></is></c>'
+
+
+def _patch_row(row_xml, row_number, cells):
+    """把 {列号: (坐标, 新值)} 合并进一行，保留其余单元格（包括样式与公式）"""
+    head = row_xml[:row_xml.index('>') + 1]
+    if head.endswith('/>'):
+        head = head[:-2] + '>'
+    existing = {}
+    for cell in CELL_RE.findall(row_xml):
+        ref = CELL_REF_RE.search(cell)
+        if ref is None:
+            raise NotPatchable(f"第{row_number}行存在缺少坐标的单元格")
+        existing[column_index_from_string(ref.group(1))] = cell
+    for col, (ref, value) in cells.items():
+        old = existing.get(col, '')
+        if '<f>' in old or '<f ' in old:
+            raise NotPatchable(f"单元格{ref}是公式单元格")
+        style = STYLE_RE.search(old)
+        existing[col] = _cell_xml(ref, value, style.group(1) if style else None)
+    body = ''.join(existing[col] for col in sorted(existing))
+    return SPANS_RE.sub('', head) + body + '</row>'
+
+
+def _row_end(xml, m):
+    return m.end() if m.group(2) else xml.index('</row>', m.end()) + len('</row>')
+
+
+def patch_sheet_xml(xml, patch, original, current):
+    """在工作表XML中只替换发生变化的单元格；返回 (新XML, 改写的行XML字节数)"""
+    changes, headers = patch.changes
+    start, end = xml.find('<sheetData>'), xml.find('</sheetData>')
+    if start < 0 or end < 0:
+        raise NotPatchable("工作表没有数据区")
+    start += len('<sheetData>')
+
+    # 只建立行号到起始位置的索引，需要改写的行再截取完整内容
+    rows = {int(m.group(1)): m for m in ROW_START_RE.finditer(xml, start, end)}
+    if len(rows) != xml.count('<row', start, end):
+        raise NotPatchable("存在缺少行号的行")
+    numbers = sorted(rows)
+    last_valued = next((n for n in reversed(numbers)
+                        if HAS_VALUE_RE.search(xml, rows[n].start(), _row_end(xml, rows[n]))), 0)
+    # 表头必须在第1行且从A列开始，数据紧随其后且中间没有被跳过的空行
+    header = xml[rows[1].start():_row_end(xml, rows[1])] if 1 in rows else ''
+    header_cols = [column_index_from_string(r.group(1)) for r in CELL_REF_RE.finditer(header)]
+    if header_cols != list(range(1, len(original.columns) + 1)) or last_valued > len(original) + 1:
+        raise NotPatchable("表格不是从A1开始的标准表头布局")
+
+    updates = {}
+    for j, positions in changes.items():
+        letter, values = get_column_letter(j + 1), current.iloc[:, j].to_numpy(dtype=object)
+        for i in positions.tolist():
+            updates.setdefault(i + 2, {})[j + 1] = (f'{letter}{i + 2}', values[i])
+    for j in headers:
+        updates.setdefault(1, {})[j + 1] = (f'{get_column_letter(j + 1)}1', str(current.columns[j]))
+
+    pieces = []
+    for number in sorted(updates):
+        match = rows.get(number)
+        if match is None:
+            # 新增的行插入到下一个已有行之前
+            following = bisect.bisect(numbers, number)
+            position = rows[numbers[following]].start() if following < len(numbers) else end
+            pieces.append((position, position, _patch_row(f'<row r="{number}">', number, updates[number])))
+        else:
+            finish = _row_end(xml, match)
+            pieces.append((match.start(), finish, _patch_row(xml[match.start():finish], number, updates[number])))
+
+    pieces.sort(key=lambda piece: piece[0])
+    out, cursor = [], 0
+    for begin, finish, text in pieces:
+        out.append(xml[cursor:begin])
+        out.append(text)
+        cursor = finish
+    out.append(xml[cursor:])
+    xml = ''.join(out)
+
+    ref = f'A1:{get_column_letter(max(patch.ncols, 1))}{patch.nrows + 1}'
+    written = sum(len(text.encode('utf-8')) for _, _, text in pieces)
+    return DIMENSION_RE.sub(f'<dimension ref="{ref}"/>', xml, count=1), written
+
+
+def patch_workbook(src, dst, patches, frames, originals):
+    """复制原xlsx压缩包，只替换被修改工作表的XML；返回改写的单元格XML字节数"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.xlsx', dir=os.path.dirname(os.path.abspath(dst)))
+    os.close(fd)
+    written = 0
+    try:
+        try:
+            zin = zipfile.ZipFile(src)
+        except zipfile.BadZipFile as e:
+            raise NotPatchable(f"原文件不是xlsx压缩包: {e}")
+        with zin:
+            try:
+                parts = _sheet_parts(zin)
+            except KeyError as e:
+                raise NotPatchable(f"原文件缺少工作簿结构: {e}")
+            replaced = {}
+            for patch in patches:
+                part = parts.get(patch.sheet)
+                if part is None:
+                    raise NotPatchable(f"找不到工作表 {patch.sheet} 对应的XML")
+                xml, size = patch_sheet_xml(zin.read(part).decode('utf-8'), patch,
+                                            originals[patch.sheet], frames[patch.sheet])
+                replaced[part] = xml.encode('utf-8')
+                written += size
+            with zipfile.ZipFile(tmp_path, 'w') as zout:
+                for info in zin.infolist():
+                    data = replaced.get(info.filename)
+                    zout.writestr(info, zin.read(info) if data is None else data)
+        os.replace(tmp_path, dst)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return written